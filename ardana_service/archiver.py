@@ -0,0 +1,162 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Background task that keeps the log dir from growing without bound: the logs
+# and events of finished plays are compressed once they reach a certain age,
+# and old plays are removed according to the retention settings in the
+# [plays] section of the config file.  The plays module reads compressed files
+# transparently.
+
+import collections
+import gzip
+import os
+from oslo_config import cfg
+from oslo_log import log as logging
+import tempfile
+import time
+
+from . import play_index
+from . import plays
+from . import socketio
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# Files of each play that are compressed.  The metadata is left alone since
+# it is small and is read to rebuild the play index
+ARCHIVED_EXTS = (plays.LOG_EXT, plays.EVENTS_EXT, plays.PROGRESS_EXT)
+
+BLOCK_SIZE = 64 * 1024
+
+
+def start():
+    socketio.start_background_task(_run)
+
+
+def _run():
+    while True:
+        try:
+            archive_plays()
+        except Exception:
+            LOG.exception("Failed to archive plays")
+        socketio.sleep(60 * CONF.plays.archive_interval_minutes)
+
+
+def archive_plays():
+    """Compress the files of old plays and remove plays past retention"""
+    now = int(1000 * time.time())
+
+    # Plays in the running registry may still be running in a process that
+    # the service has not yet reattached to after a restart
+    running = set(plays.get_running_plays())
+    running.update(plays.read_running_registry())
+
+    if CONF.plays.archive_after_hours:
+        cutoff = now - CONF.plays.archive_after_hours * 3600 * 1000
+        finished, total = play_index.query(max_end_time=cutoff)
+        for play in finished:
+            if play['id'] not in running:
+                compress_play(play['id'])
+
+    remove_old_plays(now, running)
+
+
+def compress_play(id):
+    for ext in ARCHIVED_EXTS:
+        path = plays.get_play_file(id, ext)
+        if os.path.exists(path):
+            try:
+                compress_file(path)
+            except (IOError, OSError):
+                LOG.exception("Failed to compress %s", path)
+
+
+def compress_file(path):
+    # Write the compressed file alongside the original under a temporary name
+    # and rename it into place before removing the original, so that readers
+    # always find one or the other
+    (fd, temp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(path),
+        prefix='.%s.' % os.path.basename(path))
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(os.path.basename(path), 'wb',
+                               fileobj=raw) as dst:
+                for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+                    dst.write(block)
+                    # Compressing is cpu-bound, so let other tasks run
+                    socketio.sleep(0)
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, path + plays.ARCHIVE_EXT)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+    os.unlink(path)
+
+
+def remove_old_plays(now, running):
+    days = CONF.plays.retention_days
+    count = CONF.plays.retention_count
+    max_bytes = CONF.plays.retention_megabytes * 1024 * 1024
+    if not (days or count or max_bytes):
+        return
+
+    # All plays, oldest first.  Plays that are neither running nor queued but
+    # have no end time were orphaned by a restart, and are treated as having
+    # finished when they started
+    all_plays, total = play_index.query(ascending=True)
+    finished = [p for p in all_plays
+                if p['id'] not in running and not p.get('queued')]
+
+    files = get_play_files()
+    total_size = sum(size for play in all_plays
+                     for (name, size) in files.get(play['id'], []))
+
+    to_remove = []
+    for play in finished:
+        play_size = sum(size for (name, size) in files.get(play['id'], []))
+        finish_time = play.get('endTime') or play.get('startTime') or 0
+
+        if (days and finish_time < now - days * 86400 * 1000) or \
+                (count and total > count) or \
+                (max_bytes and total_size > max_bytes):
+            to_remove.append(play['id'])
+            total -= 1
+            total_size -= play_size
+
+    for id in to_remove:
+        LOG.info("Removing play %s", id)
+        for (name, size) in files.get(id, []):
+            try:
+                os.unlink(os.path.join(CONF.paths.log_dir, name))
+            except OSError:
+                LOG.exception("Failed to remove %s", name)
+
+    play_index.remove(to_remove)
+
+
+def get_play_files():
+    # Return a dict of play id -> list of (filename, size) of the files of
+    # that play in the log dir
+    files = collections.defaultdict(list)
+    for name in os.listdir(CONF.paths.log_dir):
+        if name.startswith('.') or '.' not in name:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(CONF.paths.log_dir, name))
+        except OSError:
+            continue
+        files[name.split('.', 1)[0]].append((name, size))
+    return files
@@ -0,0 +1,142 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Pool of the clients used to call other OpenStack services, so that the many
+# calls made while a page of the UI loads do not each authenticate with
+# keystone and open new connections.  Clients that act on behalf of a user
+# are kept for as long as the user's token is valid, and all of them share a
+# single keystoneauth session, and so its pool of http connections.
+
+import calendar
+import collections
+from keystoneauth1 import loading
+from keystoneauth1 import session
+from oslo_config import cfg
+from oslo_log import log as logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# Clients are discarded this long before their token expires, so that a
+# request is not started with a token that expires while it runs
+EXPIRY_MARGIN_SECONDS = 60
+
+# Maximum number of clients that are kept, which bounds the number kept for
+# tokens that are never used again
+MAX_CLIENTS = 100
+
+# (expiry time, client) by key, least recently created first
+_clients = collections.OrderedDict()
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Return the keystoneauth session shared by the pooled clients
+
+    The session has no auth of its own; each client supplies the auth of the
+    token it was created for.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = session.Session(
+                verify=not CONF.keystone_authtoken.insecure)
+        return _session
+
+
+def get_token_client(name, token, factory):
+    """Return the named client that authenticates with the given token
+
+    The client is created by calling factory with the shared session and the
+    auth for the token, and is reused until shortly before the scoped token
+    obtained for it expires.
+    """
+    def create():
+        loader = loading.get_plugin_loader('v3token')
+        auth = loader.load_from_options(
+            auth_url=CONF.keystone_authtoken.auth_url,
+            token=token,
+            project_name=CONF.keystone_authtoken.project_name,
+            project_domain_name=CONF.keystone_authtoken.project_domain_name
+        )
+        sess = get_session()
+
+        # Authenticate now in order to find out when the token expires
+        expires = auth.get_access(sess).expires
+        return factory(sess, auth), calendar.timegm(expires.utctimetuple())
+
+    return _get((name, token), create)
+
+
+def get_password_client(name, factory, ttl):
+    """Return the named client that authenticates with the service's password
+
+    The client is created by calling factory with the shared session and a
+    password auth for the service's credentials (in the [keystone_authtoken]
+    section of the config file), and is reused for ttl seconds.  Unlike a
+    token client, the auth obtains a new token whenever its token expires, so
+    the client suits background work that may outlive the request that
+    started it.
+    """
+    def create():
+        loader = loading.get_plugin_loader('password')
+        auth = loader.load_from_options(
+            auth_url=CONF.keystone_authtoken.auth_url,
+            username=CONF.keystone_authtoken.username,
+            password=CONF.keystone_authtoken.password,
+            project_name=CONF.keystone_authtoken.project_name,
+            project_domain_name=CONF.keystone_authtoken.project_domain_name,
+            user_domain_name=CONF.keystone_authtoken.user_domain_name
+        )
+        return factory(get_session(), auth), time.time() + ttl
+
+    return _get(('password', name), create)
+
+
+def get_service_client(key, factory, ttl):
+    """Return a client that authenticates with the service's credentials
+
+    The client is created by calling factory without arguments, and is reused
+    for ttl seconds.  key identifies the client, and should include anything
+    on which the client depends, such as its endpoint.
+    """
+    return _get(key, lambda: (factory(), time.time() + ttl))
+
+
+def _get(key, create):
+    now = time.time()
+    with _lock:
+        entry = _clients.get(key)
+        if entry is not None and entry[0] - EXPIRY_MARGIN_SECONDS > now:
+            return entry[1]
+
+    # Clients are created without holding the lock since that may involve a
+    # call to keystone.  Requests that need the same client at the same time
+    # may then each create it, in which case the last one is kept
+    (client, expires) = create()
+
+    with _lock:
+        _clients.pop(key, None)
+        _clients[key] = (expires, client)
+
+        for (k, (e, c)) in list(_clients.items()):
+            if e - EXPIRY_MARGIN_SECONDS <= now:
+                del _clients[k]
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+
+    return client
@@ -12,44 +12,72 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import clients
+from . import migrations
 from . import policy
 
+import eventlet
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
 from flask import request
+from flask import url_for
 import json
-from keystoneauth1 import loading
-from keystoneauth1 import session
 from novaclient import client as novaClient
 import os
 from oslo_config import cfg
 from oslo_log import log as logging
+import threading
+import time
 
 LOG = logging.getLogger(__name__)
 bp = Blueprint('compute', __name__)
 CONF = cfg.CONF
 
+# How long the compute client that acts as the service is reused for
+SERVICE_CLIENT_TTL_SECONDS = 15 * 60
+
+# How long the hosts of each aggregate are cached for
+AGGREGATE_INDEX_TTL_SECONDS = 30
+
+# (time built, index) of the hosts of each aggregate, keyed by the token that
+# the aggregates were listed with, since what is visible depends on the token
+_aggregate_indexes = {}
+_aggregate_lock = threading.Lock()
+
+
+def _create_compute_client(sess, auth):
+    return novaClient.Client(
+        # api version for live_migrate with block_migration='auto'
+        '2.25',
+        endpoint_type="internalURL",
+        session=sess,
+        auth=auth
+    )
+
 
 def get_compute_client(req):
 
     try:
-        loader = loading.get_plugin_loader('v3token')
-        auth = loader.load_from_options(
-            auth_url=CONF.keystone_authtoken.auth_url,
-            token=req.headers.get('X-Auth-Token'),
-            project_name=CONF.keystone_authtoken.project_name,
-            project_domain_name=CONF.keystone_authtoken.project_domain_name
-        )
-        sess = session.Session(auth=auth,
-                               verify=not CONF.keystone_authtoken.insecure)
-        compute_client = novaClient.Client(
-            # api version for live_migrate with block_migration='auto'
-            '2.25',
-            endpoint_type="internalURL",
-            session=sess
-        )
-        return compute_client
+        return clients.get_token_client(
+            'compute', req.headers.get('X-Auth-Token'),
+            _create_compute_client)
+
+    except Exception as e:
+        LOG.error(e)
+        abort(500, 'Failed to get compute novaclient')
+
+
+def get_service_compute_client():
+    """Return a compute client that authenticates as the service
+
+    Unlike the client of a request, it does not depend on the request's
+    token, and so can be used by work that outlives the request, such as
+    migrations.
+    """
+    try:
+        return clients.get_password_client(
+            'compute', _create_compute_client, SERVICE_CLIENT_TTL_SECONDS)
 
     except Exception as e:
         LOG.error(e)
@@ -62,6 +90,61 @@ def complete_with_errors_response(msg, contents):
     return response
 
 
+def get_aggregate_index(compute_client, token, refresh=False):
+    """Return a dict of the hosts of each aggregate, keyed by aggregate id
+
+    Each value is a dict of the aggregate's ``id``, ``name``,
+    ``availability_zone`` and ``hosts``.  The index is built from a single
+    listing of the aggregates made with the compute client of the given
+    token, and is shared for a short while by the requests made with the same
+    token to avoid listing them again for each one.  With refresh, the index
+    is always built afresh, as is needed before changing any aggregates.
+    """
+    with _aggregate_lock:
+        cached = _aggregate_indexes.get(token)
+        if not refresh and cached is not None and \
+                cached[0] + AGGREGATE_INDEX_TTL_SECONDS > time.time():
+            return cached[1]
+
+    index = {}
+    for aggr in compute_client.aggregates.list():
+        hosts = getattr(aggr, 'hosts', None)
+        if hosts is None:
+            # Only fetch the details of aggregates whose listing lacks them
+            hosts = getattr(compute_client.aggregates.get(aggr), 'hosts', [])
+
+        id = getattr(aggr, 'id')
+        index[id] = {'id': id,
+                     'name': getattr(aggr, 'name'),
+                     'availability_zone': getattr(aggr, 'availability_zone'),
+                     'hosts': list(hosts or [])}
+
+    now = time.time()
+    with _aggregate_lock:
+        # Forget the indexes of tokens that have not been used for a while
+        for (key, (built, _)) in list(_aggregate_indexes.items()):
+            if built + AGGREGATE_INDEX_TTL_SECONDS <= now:
+                del _aggregate_indexes[key]
+        _aggregate_indexes[token] = (now, index)
+    return index
+
+
+def invalidate_aggregate_index():
+    """Discard the aggregate indexes after changing any aggregate"""
+    with _aggregate_lock:
+        _aggregate_indexes.clear()
+
+
+def get_host_aggregates(compute_client, token, hostname, refresh=False):
+    """Return the aggregates that include the given host"""
+    index = get_aggregate_index(compute_client, token, refresh)
+    return [{'id': aggr['id'],
+             'name': aggr['name'],
+             'availability_zone': aggr['availability_zone']}
+            for aggr in sorted(index.values(), key=lambda a: a['id'])
+            if hostname in aggr['hosts']]
+
+
 @bp.route("/api/v2/compute/services/<hostname>", methods=['GET'])
 @policy.enforce('lifecycle:get_compute')
 def compute_services_status(hostname):
@@ -322,6 +405,50 @@ def compute_delete_services(hostname):
     return jsonify(deleted)
 
 
+@bp.route("/api/v2/compute/aggregates/<hostname>", methods=['GET'])
+@policy.enforce('lifecycle:get_compute')
+def compute_get_aggregates(hostname):
+    """Get the aggregates of a compute host
+
+        .. :quickref: Compute; Get aggregates of a compute host
+
+        **Example Request**:
+
+        .. sourcecode:: http
+
+           GET /api/v2/compute/aggregates/<hostname> HTTP/1.1
+           Content-Type: application/json
+
+        **Example Response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+
+            [{
+                "availability_zone": null,
+                "id": 1,
+                "name": "agg_group1"
+            }, {
+                "availability_zone": "test-az",
+                "id": 3,
+                "name": "agg_group3"
+            }]
+    """
+    # mock for getting the aggregates of a compute host
+    if cfg.CONF.testing.use_mock:
+        mock_json = "tools/compute-mock-data.json"
+        json_file = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), mock_json)
+        with open(json_file) as f:
+            return jsonify(json.load(f)['get_aggregates'])
+
+    compute_client = get_compute_client(request)
+
+    return jsonify(get_host_aggregates(
+        compute_client, request.headers.get('X-Auth-Token'), hostname))
+
+
 @bp.route("/api/v2/compute/aggregates/<hostname>", methods=['DELETE'])
 @policy.enforce('lifecycle:update_compute')
 def compute_delete_aggregates(hostname):
@@ -369,48 +496,37 @@ def compute_delete_aggregates(hostname):
 
     compute_client = get_compute_client(request)
 
-    # list all the aggregates
-    compute_aggregates = compute_client.aggregates.list()
-
-    if len(compute_aggregates) == 0:
-        msg = 'No aggregates found for %s ' % hostname
-        LOG.info(msg)
-        abort(410, msg)
-
-    # get details so we can decide which one we need to
-    # remove compute host
-    aggregates = []
-    for aggr in compute_aggregates:
-        details = compute_client.aggregates.get(aggr)
-        id = getattr(aggr, 'id')
-        name = getattr(aggr, 'name')
-        az = getattr(aggr, 'availability_zone')
-        if hostname in getattr(details, 'hosts', []):
-            aggregates.append({
-                'id': id, 'name': name, 'availability_zone': az})
+    # Act on the current aggregates rather than those of a cached index
+    aggregates = get_host_aggregates(
+        compute_client, request.headers.get('X-Auth-Token'), hostname,
+        refresh=True)
 
     if len(aggregates) == 0:
         msg = 'No aggregates found for %s ' % hostname
         LOG.info(msg)
         abort(410, msg)
 
-    failed = []
-    deleted = []
-    for aggr in aggregates:
+    def remove_host(aggr):
         id = aggr['id']
         name = aggr['name']
         az = aggr['availability_zone']
         try:
             compute_client.aggregates.remove_host(id, hostname)
-            deleted.append({'id': id, 'name': name, 'availability_zone': az})
+            return {'id': id, 'name': name, 'availability_zone': az}
         except Exception as ex:
-            failed.append({
-                'id': id, 'name': name,
-                'availability_zone': az, 'error': str(ex)})
             LOG.error(
                 'Failed to delete aggregate for %s id = %s name = %s '
                 'availability_zone = %s' % (hostname, id, name, az))
             LOG.error(ex)
+            return {'id': id, 'name': name,
+                    'availability_zone': az, 'error': str(ex)}
+
+    # Remove the host from all of its aggregates at once
+    results = list(eventlet.GreenPool().imap(remove_host, aggregates))
+    invalidate_aggregate_index()
+
+    failed = [r for r in results if 'error' in r]
+    deleted = [r for r in results if 'error' not in r]
 
     if len(failed) > 0:
         return complete_with_errors_response(
@@ -427,6 +543,15 @@ def compute_delete_aggregates(hostname):
 def compute_migrate_instances(src_hostname, target_hostname):
     """Migrate instances of a compute host to another compute host
 
+        The instances are live migrated in the background, with up to
+        ``max_concurrent_migrations`` migrations (in the ``[compute]``
+        section of the config file) in progress at once.  The response lists
+        the instances being migrated, and its ``Location`` header refers to
+        the status of the migration, which tracks each instance until it
+        reaches the target host or its migration fails.  The same status is
+        also sent over socketIO to clients that emit ``join_migration`` with
+        the id of the migration.
+
         .. :quickref: Compute; Live migrate instances of a compute host
 
         **Example Request**:
@@ -442,7 +567,8 @@ def compute_migrate_instances(src_hostname, target_hostname):
 
         .. sourcecode:: http
 
-            HTTP/1.1 200 OK
+            HTTP/1.1 202 ACCEPTED
+            Location: http://localhost:9085/api/v2/compute/migrations/6858
 
 
             [{
@@ -474,29 +600,77 @@ def compute_migrate_instances(src_hostname, target_hostname):
         LOG.info(msg)
         abort(410, msg)
 
-    migrating = []  # list of migrating instance ids and names
-    failed = []  # list of failed instance ids, names and errors
-    for inst in instances:
-        id = getattr(inst, 'id')
-        name = getattr(inst, 'name')
-        try:
-            compute_client.servers.live_migrate(
-                id, target_hostname, block_migration='auto')
-            migrating.append({'id': id, 'name': name})
+    # The migration is run as the service, since it may well take longer
+    # than the token of the request is valid for
+    migration = migrations.start(get_service_compute_client(), src_hostname,
+                                 target_hostname, instances)
+    if migration is None:
+        abort(403, 'Instances of %s are already being migrated' %
+              src_hostname)
 
-        except Exception as ex:
-            failed.append({'id': id, 'name': name, 'error': str(ex)})
-            LOG.error(
-                'Failed to start migrating instance of %s id = %s name = %s' %
-                (src_hostname, id, name))
-            LOG.error(ex)
+    migrating = [{'id': inst['id'], 'name': inst['name']}
+                 for inst in migration.instances]
+    return jsonify(migrating), 202, \
+        {'Location': url_for('compute.compute_get_migration',
+                             id=migration.id)}
 
-    if len(failed) > 0:
-        return complete_with_errors_response(
-            'Completed migrating instances with errors',
-            {'failed': failed, 'migrating': migrating})
 
-    return jsonify(migrating)
+@bp.route("/api/v2/compute/migrations/<id>", methods=['GET'])
+@policy.enforce('lifecycle:get_compute')
+def compute_get_migration(id):
+    """Return the status of a migration of the instances of a compute host
+
+        Each instance is ``queued``, ``migrating``, ``migrated`` or
+        ``failed``, and the ``counts`` of the instances in each state are
+        included.  The migration is ``running`` until every instance has
+        either migrated or failed, and is then ``completed``.  The status of
+        a migration is only kept for a while after it completes.
+
+        .. :quickref: Compute; Get the status of a migration
+
+        **Example Request**:
+
+        .. sourcecode:: http
+
+           GET /api/v2/compute/migrations/1534180830476 HTTP/1.1
+           Content-Type: application/json
+
+        **Example Response**:
+
+        .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+
+            {
+                "id": "1534180830476",
+                "source": "compute1",
+                "target": "compute2",
+                "status": "running",
+                "startTime": 1534180830476,
+                "endTime": null,
+                "counts": {
+                    "queued": 0,
+                    "migrating": 1,
+                    "migrated": 0,
+                    "failed": 1
+                },
+                "instances": [{
+                    "id": "8279e65d-6e87-4a50-b789-96edd753fbb2",
+                    "name": "test3",
+                    "status": "migrating"
+                }, {
+                    "id": "1d51f18f-27fd-4c34-a0aa-c07a5e9462e7",
+                    "name": "test2",
+                    "status": "failed",
+                    "error": "Instance remained on compute1"
+                }]
+            }
+    """
+    migration = migrations.get_migration(id)
+    if migration is None:
+        abort(404, 'Migration %s not found' % id)
+
+    return jsonify(migration.get_status())
 
 
 @bp.route("/api/v2/compute/instances/<hostname>", methods=['GET'])
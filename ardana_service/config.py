@@ -115,6 +115,100 @@ path_opts = [
                help='Temporary file containing all hosts\' packages data'),
 ]
 
+play_opts = [
+    cfg.IntOpt('log_batch_interval_ms',
+               default=200,
+               min=0,
+               help='How often in milliseconds the logs of running plays '
+                    'are checked for output to send to listening clients'),
+    cfg.IntOpt('log_batch_bytes',
+               default=64 * 1024,
+               min=1,
+               help='Maximum amount of playbook output that is sent to '
+                    'listening clients at once'),
+    cfg.IntOpt('archive_after_hours',
+               default=24,
+               min=0,
+               help='Compress the logs of plays that finished this many '
+                    'hours ago.  0 disables compression'),
+    cfg.IntOpt('archive_interval_minutes',
+               default=60,
+               min=1,
+               help='How often to look for plays to compress or remove'),
+    cfg.IntOpt('retention_days',
+               default=0,
+               min=0,
+               help='Remove plays that finished more than this many days '
+                    'ago.  0 keeps plays regardless of age'),
+    cfg.IntOpt('retention_count',
+               default=0,
+               min=0,
+               help='Remove the oldest finished plays when there are more '
+                    'than this many plays.  0 keeps any number of plays'),
+    cfg.IntOpt('retention_megabytes',
+               default=0,
+               min=0,
+               help='Remove the oldest finished plays while the files of all '
+                    'plays take more than this much space.  0 permits any '
+                    'amount of space to be used'),
+    cfg.IntOpt('kill_grace_seconds',
+               default=5,
+               min=0,
+               help='Time that a play being killed is given to shut down '
+                    'after being interrupted, before it is killed outright'),
+    cfg.IntOpt('max_running_plays',
+               default=0,
+               min=0,
+               help='Maximum number of plays that may run at once.  Further '
+                    'plays are queued until running ones finish.  0 permits '
+                    'any number of plays to run'),
+    cfg.DictOpt('playbook_limits',
+                default={
+                    'ardana-gen-hosts-file': '1',
+                    'config-processor-clean': '1',
+                    'config-processor-run': '1',
+                    'installui-os-provision': '1',
+                    'monasca-deploy': '1',
+                    'ready-deployment': '1',
+                    'site': '1',
+                    'wipe_disks': '1',
+                },
+                help='Maximum number of concurrent plays of individual '
+                     'playbooks, as playbook:limit pairs.  Playbooks that '
+                     'are not listed are only subject to max_running_plays'),
+    cfg.DictOpt('playbook_groups',
+                default={
+                    'installui-os-provision': 'deployment',
+                    'ready-deployment': 'deployment',
+                    'site': 'deployment',
+                    'wipe_disks': 'deployment',
+                    'config-processor-clean': 'config-processor',
+                    'config-processor-run': 'config-processor',
+                },
+                help='Mutually exclusive groups of playbooks, as '
+                     'playbook:group pairs.  A play of a playbook in a group '
+                     'is queued while any play of the same group is running'),
+]
+
+compute_opts = [
+    cfg.IntOpt('max_concurrent_migrations',
+               default=4,
+               min=1,
+               help='Maximum number of live migrations that are in progress '
+                    'at once when migrating the instances of a compute host'),
+    cfg.IntOpt('migration_poll_seconds',
+               default=5,
+               min=1,
+               help='How often migrating instances are checked for having '
+                    'reached their target host'),
+    cfg.IntOpt('migration_timeout_minutes',
+               default=60,
+               min=0,
+               help='Time after which the migration of an instance that has '
+                    'not reached its target host is considered to have '
+                    'failed.  0 waits indefinitely'),
+]
+
 url_opts = [
     cfg.StrOpt('horizon',
                help='Location of horizon UI'),
@@ -128,6 +222,8 @@ url_group = cfg.OptGroup(name='urls',
 CONF = cfg.CONF
 CONF.register_opts(flask_opts)
 CONF.register_opts(path_opts, 'paths')
+CONF.register_opts(play_opts, 'plays')
+CONF.register_opts(compute_opts, 'compute')
 CONF.register_group(url_group)
 CONF.register_opts(url_opts, url_group)
 
@@ -135,7 +231,8 @@ CONF.register_opts(url_opts, url_group)
 # This function is used by "tox -e genopts" to generate a config file
 # containing for the ardana service
 def list_opts():
-    return [('DEFAULT', flask_opts), ('paths', path_opts)]
+    return [('DEFAULT', flask_opts), ('paths', path_opts),
+            ('plays', play_opts), ('compute', compute_opts)]
 
 
 def requires_auth():
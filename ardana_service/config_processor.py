@@ -114,7 +114,7 @@ def run_config_processor():
             error['errorCode'] = e.returncode
         abort(make_response(jsonify(error), 400))
 
-    input_model = model.read_model()
+    input_model = model.read_cached_model()
     cloud_name = input_model['inputModel']['cloud']['name']
 
     generated = os.path.join(output_dir, cloud_name, '2.0', 'stage', 'info')
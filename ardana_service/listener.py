@@ -16,13 +16,11 @@ from flask import abort
 from flask import Blueprint
 from flask import jsonify
 from flask import request
-import json
-import os
 from oslo_log import log as logging
 import time
 
+from . import plays
 from . import socketio
-from .playbooks import get_events_file
 
 LOG = logging.getLogger(__name__)
 
@@ -48,24 +46,13 @@ def playbook_event():
 
         # Record event to file so that it can be replayed back to any client
         # that joins while the playbook is already underway
-        events_file = get_events_file(id)
         try:
-            if os.path.exists(events_file):
-                with open(events_file) as f:
-                    events = json.load(f)
-            else:
-                events = []
-
-            events.append({'event': playbook_event,
-                           'playbook': name,
-                           'timestamp': int(time.time())})
-
-            with open(events_file, "w") as f:
-                json.dump(events, f)
-
+            plays.append_event(id, {'event': playbook_event,
+                                    'playbook': name,
+                                    'timestamp': int(time.time())})
             return jsonify(id)
 
-        except IOError as e:
+        except (IOError, OSError) as e:
             LOG.exception(e)
             abort(500, "Unable to write event")
 
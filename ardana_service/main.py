@@ -24,6 +24,7 @@ from flask import request
 from flask_cors import CORS
 
 from ardana_service import admin
+from ardana_service import archiver
 from ardana_service import cobbler
 from ardana_service import compute
 from ardana_service import config  # noqa: F401
@@ -46,6 +47,7 @@ from ardana_service import suse_manager
 from ardana_service import templates
 from ardana_service import ui
 from ardana_service import versions
+from ardana_service import workflows
 
 from keystonemiddleware import auth_token
 # Load keystone options into global config object
@@ -99,6 +101,7 @@ app.register_blueprint(suse_manager.bp)
 app.register_blueprint(templates.bp)
 app.register_blueprint(ui.bp)
 app.register_blueprint(versions.bp)
+app.register_blueprint(workflows.bp)
 
 # Flask logging is broken, and it is a time bomb: by default it does nothing,
 # but the first time an exception happens, it creates a new logger that
@@ -232,6 +235,8 @@ def main():
     if is_running_from_reloader():
         sshagent.sshagent.stop_old_instance()
         sshagent.sshagent.start()
+        archiver.start()
+        playbooks.reattach_plays()
 
     # The 'log' parameter avoids running in debug mode, which suppresses the
     # debug message that is emitted on *every* incoming request.
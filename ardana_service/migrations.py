@@ -0,0 +1,229 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Orchestrates the live migration of the instances of a compute host to
+# another host, such as when draining a host before removing it.  Up to
+# max_concurrent_migrations live migrations (in the [compute] section of the
+# config file) are in progress at once, and each instance is watched until it
+# reaches the target host or its migration fails.
+#
+# The state of each migration is kept in memory.  Clients can fetch it from
+# the compute migration status endpoint, or emit "join_migration" with the
+# migration id to receive it as a "migration" message, followed by a
+# "migration_instance" message whenever the state of an instance changes and
+# a final "migration" message once every instance has been dealt with.
+
+import collections
+import eventlet
+from flask_socketio import emit
+from flask_socketio import join_room
+from novaclient import exceptions as nova_exceptions
+from oslo_config import cfg
+from oslo_log import log as logging
+import threading
+import time
+
+from . import socketio
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# States of each instance
+QUEUED = 'queued'
+MIGRATING = 'migrating'
+MIGRATED = 'migrated'
+FAILED = 'failed'
+
+# States of a migration as a whole
+RUNNING = 'running'
+COMPLETED = 'completed'
+
+HOST_ATTR = 'OS-EXT-SRV-ATTR:host'
+TASK_STATE_ATTR = 'OS-EXT-STS:task_state'
+
+# Number of finished migrations whose status is kept
+MAX_FINISHED = 20
+
+# Migrations by id, oldest first
+_migrations = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+class Migration(object):
+    """The migration of a set of instances from one host to another"""
+
+    def __init__(self, client, source, target, instances):
+        self.id = str(int(1000 * time.time()))
+        self.client = client
+        self.source = source
+        self.target = target
+        self.start_time = int(1000 * time.time())
+        self.end_time = None
+        self.instances = [{'id': getattr(inst, 'id'),
+                           'name': getattr(inst, 'name'),
+                           'status': QUEUED} for inst in instances]
+        self.lock = threading.Lock()
+
+    @property
+    def room(self):
+        return 'migration-%s' % self.id
+
+    def get_status(self):
+        with self.lock:
+            counts = dict((s, 0) for s in (QUEUED, MIGRATING, MIGRATED,
+                                           FAILED))
+            for inst in self.instances:
+                counts[inst['status']] += 1
+
+            return {
+                'id': self.id,
+                'source': self.source,
+                'target': self.target,
+                'status': RUNNING if self.end_time is None else COMPLETED,
+                'startTime': self.start_time,
+                'endTime': self.end_time,
+                'counts': counts,
+                'instances': [dict(inst) for inst in self.instances]
+            }
+
+    def run(self):
+        pool = eventlet.GreenPool(CONF.compute.max_concurrent_migrations)
+        for inst in self.instances:
+            pool.spawn_n(self._migrate, inst)
+        pool.waitall()
+
+        self.end_time = int(1000 * time.time())
+        status = self.get_status()
+        LOG.info("Finished migrating instances of %s to %s: %s", self.source,
+                 self.target, status['counts'])
+        socketio.emit('migration', status, room=self.room)
+
+    def _migrate(self, inst):
+        try:
+            self.client.servers.live_migrate(inst['id'], self.target,
+                                             block_migration='auto')
+        except Exception as e:
+            LOG.error('Failed to start migrating instance of %s id = %s '
+                      'name = %s', self.source, inst['id'], inst['name'])
+            LOG.error(e)
+            self._update(inst, FAILED, str(e))
+            return
+
+        self._update(inst, MIGRATING)
+        try:
+            error = self._wait(inst)
+        except Exception as e:
+            error = str(e)
+
+        if error:
+            LOG.error('Failed to migrate instance of %s id = %s name = %s: '
+                      '%s', self.source, inst['id'], inst['name'], error)
+            self._update(inst, FAILED, error)
+        else:
+            self._update(inst, MIGRATED)
+
+    def _wait(self, inst):
+        # Return once the instance is on the target host, or with the reason
+        # that it will not get there.  Nova clears the task state of the
+        # instance when it is done with it, whether or not the migration
+        # succeeded, and a migration that fails is rolled back, leaving the
+        # instance where it was.  Polls that fail, such as when nova is
+        # briefly unavailable, are retried until the timeout
+        timeout = CONF.compute.migration_timeout_minutes * 60
+        deadline = time.time() + timeout if timeout else None
+        busy = False
+        while True:
+            socketio.sleep(CONF.compute.migration_poll_seconds)
+
+            try:
+                server = self.client.servers.get(inst['id'])
+            except nova_exceptions.NotFound:
+                return 'Instance no longer exists'
+            except Exception as e:
+                LOG.warning('Failed to get the state of instance of %s id = '
+                            '%s name = %s, retrying: %s', self.source,
+                            inst['id'], inst['name'], e)
+                server = None
+
+            if server is not None:
+                status = getattr(server, 'status', None)
+                task_state = getattr(server, TASK_STATE_ATTR, None)
+                host = getattr(server, HOST_ATTR, None)
+
+                if status == 'ERROR':
+                    return 'Instance is in the ERROR state'
+                if task_state is None and status != 'MIGRATING':
+                    if host == self.target:
+                        return
+                    if busy:
+                        return 'Instance remained on %s' % host
+                else:
+                    busy = True
+
+            if deadline and time.time() > deadline:
+                return 'Timed out waiting for the migration to complete'
+
+    def _update(self, inst, status, error=None):
+        with self.lock:
+            inst['status'] = status
+            if error:
+                inst['error'] = error
+            data = dict(inst)
+        socketio.emit('migration_instance', data, room=self.room)
+
+
+def start(client, source, target, instances):
+    """Start migrating the given instances from source to target
+
+    The migration runs in the background using the given nova client.
+    Returns the migration, or None if instances of the source host are
+    already being migrated.
+    """
+    with _lock:
+        for migration in _migrations.values():
+            if migration.source == source and migration.end_time is None:
+                return None
+
+        migration = Migration(client, source, target, instances)
+        while migration.id in _migrations:
+            migration.id = str(int(migration.id) + 1)
+        _migrations[migration.id] = migration
+
+        # Forget the oldest finished migrations
+        finished = [m.id for m in _migrations.values()
+                    if m.end_time is not None]
+        for id in finished[:-MAX_FINISHED]:
+            del _migrations[id]
+
+    LOG.info("Migrating %d instances of %s to %s", len(migration.instances),
+             source, target)
+    socketio.start_background_task(migration.run)
+    return migration
+
+
+def get_migration(id):
+    return _migrations.get(str(id))
+
+
+@socketio.on('join_migration')
+def on_join_migration(id):
+    """Send the status of a migration, and then follow its progress"""
+    migration = get_migration(id)
+    if migration is None:
+        return
+
+    # Join first, so that no change is missed.  Any that are received twice
+    # are superseded by the full status
+    join_room(migration.room)
+    emit('migration', migration.get_status())
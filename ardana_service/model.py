@@ -28,9 +28,14 @@ from oslo_log import log as logging
 import random
 import six
 import subprocess
-import yaml
+import tempfile
+import threading
 
+from . import playbooks
 from . import policy
+from . import socketio
+from . import util
+from . import yaml_io
 
 LOG = logging.getLogger(__name__)
 
@@ -47,6 +52,35 @@ ADDED = 'added'
 
 PASS_THROUGH = 'pass-through'
 
+# Models that have been read are cached here, keyed by the model directory.
+# Each entry records the fingerprint of every file that was used to build the
+# model, so that a subsequent read only has to stat the files (rather than
+# re-parse all of the yaml) in order to determine whether the cached model is
+# still current.
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+# Counters of how often the model, and the individual files within it, could
+# be served from the cache
+_cache_stats = collections.Counter(model_hits=0, model_misses=0,
+                                   file_hits=0, file_misses=0,
+                                   cp_internal_hits=0, cp_internal_misses=0)
+
+# Cache of the parsed json versions of config processor internal files, keyed
+# by json path, each holding the mtime of the file and its contents
+_cp_internal_cache = {}
+_cp_internal_cache_lock = threading.Lock()
+
+# The hostnames returned by get_deployed_hostnames, along with the mtime of
+# the inventory file from which they were obtained
+_deployed_hostnames = {}
+_deployed_hostnames_lock = threading.Lock()
+
+# Locks that permit only one request at a time to convert a given config
+# processor internal file to json, keyed by json path.  Guarded by
+# _cp_internal_cache_lock
+_cp_internal_conversion_locks = {}
+
 
 @bp.route("/api/v2/model", methods=['GET'])
 @policy.enforce('lifecycle:get_model')
@@ -62,7 +96,7 @@ def get_model():
     :status 404: failure to find or read model
     """
     try:
-        return jsonify(read_model())
+        return jsonify(read_cached_model())
     except IOError:
         abort(404)
 
@@ -103,7 +137,7 @@ def get_entity_operations():
 
     """
 
-    model = read_model()
+    model = read_cached_model()
     entity_operations = {}
     for key, val in model['inputModel'].items():
         ops = {}
@@ -121,12 +155,180 @@ def get_entity_operations():
                 url_for('model.update_entity_by_id', entity_name=key, id=':id')
             ops['deleteById'] = 'DELETE ' + \
                 url_for('model.delete_entity_by_id', entity_name=key, id=':id')
+            ops['patchById'] = 'PATCH ' + \
+                url_for('model.patch_entity_by_id', entity_name=key, id=':id')
 
         entity_operations[key] = ops
 
     return jsonify(entity_operations)
 
 
+@bp.route("/api/v2/model/entities", methods=['POST'])
+@policy.enforce('lifecycle:update_model')
+def update_entities_batch():
+    """Apply a batch of changes to array-type entities
+
+    The body is a list of operations, each of which creates, updates, patches
+    or deletes an individual entry of an array-type entity.  The operations
+    are applied in order to a single copy of the model, which is only written
+    if every operation succeeds; either all of the changes are made or none
+    are.  The result of each operation is returned in the same order.
+
+    Each operation contains an ``op`` (``create``, ``update``, ``patch`` or
+    ``delete``) and the ``entity`` name.  All but ``create`` require the
+    ``id`` of the entry.  ``create`` and ``update`` require the new entry in
+    ``data``, and ``patch`` requires a JSON Patch in ``patch`` (see
+    :http:patch:`/api/v2/model/entities/(entity_name)/(id)`).
+
+    .. :quickref: Model; Apply a batch of changes to array-type entities
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       POST /api/v2/model/entities HTTP/1.1
+       Content-Type: application/json
+
+       [
+           {"op": "create", "entity": "servers",
+            "data": {"id": "comp0002", "role": "COMPUTE-ROLE"}},
+           {"op": "patch", "entity": "servers", "id": "comp0001",
+            "patch": [{"op": "replace", "path": "/role",
+                       "value": "COMPUTE-ROLE"}]},
+           {"op": "delete", "entity": "servers", "id": "comp0003"}
+       ]
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       [
+           {"op": "create", "entity": "servers", "id": "comp0002",
+            "status": "success"},
+           {"op": "patch", "entity": "servers", "id": "comp0001",
+            "status": "success"},
+           {"op": "delete", "entity": "servers", "id": "comp0003",
+            "status": "success"}
+       ]
+
+    :status 200: all operations were applied and the model was written
+    :status 400: one or more operations failed (see the ``error`` of those
+                 results) and the model was left unchanged
+    """
+    operations = request.get_json()
+    if not isinstance(operations, list):
+        abort(400, 'Body must be a list of operations')
+
+    model = read_model()
+    results = apply_entity_operations(model, operations)
+    if any(r['status'] != 'success' for r in results):
+        return jsonify(results), 400
+
+    write_model(model)
+    return jsonify(results)
+
+
+def apply_entity_operations(model, operations):
+    """Apply a list of entity operations to the model in memory
+
+    See update_entities_batch for the format of the operations.  Operations
+    that fail leave the model unchanged, and do not prevent the subsequent
+    operations from being applied.  Returns a list of per-operation results.
+    """
+
+    # Lookup tables of entity name -> (key field, {id: position}), built as
+    # each entity is first used.  Deleted entries are replaced by None in the
+    # entity lists until all operations have been applied, so that the
+    # positions remain valid
+    lookups = {}
+    results = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            operation = {}
+
+        result = {'op': operation.get('op'),
+                  'entity': operation.get('entity'),
+                  'id': operation.get('id')}
+        try:
+            result['id'] = _apply_entity_operation(model, lookups, operation)
+            result['status'] = 'success'
+        except ValueError as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+        results.append(result)
+
+    for entity_name in lookups:
+        model['inputModel'][entity_name] = \
+            [e for e in model['inputModel'][entity_name] if e is not None]
+
+    return results
+
+
+def _apply_entity_operation(model, lookups, operation):
+    # Apply a single operation, returning the id of the affected entry, or
+    # raise a ValueError if it cannot be applied
+
+    op = operation.get('op')
+    entity_name = operation.get('entity')
+
+    if entity_name not in lookups:
+        entities = model['inputModel'].get(entity_name)
+        if not entities or not isinstance(entities, list):
+            raise ValueError('Unknown entity %s' % entity_name)
+        key_field = get_key_field(entities[0])
+        lookups[entity_name] = (key_field, {e.get(key_field): pos
+                                            for pos, e in enumerate(entities)})
+
+    entities = model['inputModel'][entity_name]
+    key_field, positions = lookups[entity_name]
+
+    if op == 'create':
+        new_entity = operation.get('data')
+        if not isinstance(new_entity, dict) or key_field not in new_entity:
+            raise ValueError('data must be an object containing %s' %
+                             key_field)
+        new_id = new_entity[key_field]
+        if new_id in positions:
+            raise ValueError('%s %s already exists' % (entity_name, new_id))
+
+        positions[new_id] = len(entities)
+        entities.append(new_entity)
+        return new_id
+
+    id = operation.get('id')
+    if id not in positions:
+        raise ValueError('%s %s does not exist' % (entity_name, id))
+    pos = positions[id]
+
+    if op == 'delete':
+        del positions[id]
+        entities[pos] = None
+        return id
+
+    if op == 'update':
+        new_entity = operation.get('data')
+    elif op == 'patch':
+        new_entity = util.apply_patch(copy.deepcopy(entities[pos]),
+                                      operation.get('patch'))
+    else:
+        raise ValueError('Unsupported operation %s' % op)
+
+    if not isinstance(new_entity, dict):
+        raise ValueError('Entity must be an object')
+
+    new_id = new_entity.get(key_field, id)
+    if new_id != id and new_id in positions:
+        raise ValueError('%s %s already exists' % (entity_name, new_id))
+
+    del positions[id]
+    positions[new_id] = pos
+    entities[pos] = new_entity
+    return new_id
+
+
 @bp.route("/api/v2/model/entities/<entity_name>", methods=['GET'])
 @policy.enforce('lifecycle:get_model')
 def get_entities(entity_name):
@@ -139,7 +341,7 @@ def get_entities(entity_name):
     :status 404: failure to read model or find the given entity
     """
 
-    model = read_model()
+    model = read_cached_model()
     try:
         return jsonify(model['inputModel'][entity_name])
     except KeyError:
@@ -166,20 +368,63 @@ def update_entities(entity_name):
     return jsonify('Success')
 
 
-def get_entity_index(entities, id):
-    # Find the index of the given id in the entities list
-    try:
-        key_field = get_key_field(entities[0])
-        for index, e in enumerate(entities):
-            if e[key_field] == id:
-                return index
-        else:
-            abort(404)
+def locate_entity(entity_name, id, model_dir=None):
+    """Find an individual entry of an array-type entity
 
-    except (KeyError, IndexError):
+    Uses the index of the cached model to look up the entry, returning the
+    model cache entry along with the location of the entity (see
+    add_doc_to_model).  Aborts with a 404 if there is no such entry.
+    """
+    entry = _read_cache_entry(model_dir)
+    try:
+        return entry, entry['index'][entity_name][id]
+    except KeyError:
         abort(404)
 
 
+def write_entity(entry, entity_name, location, new_entity=None):
+    """Replace or remove an individual entry in the file that contains it
+
+    Only the file that contains the entity is rewritten, rather than the
+    entire model.  If new_entity is None the entry is removed, and the file
+    itself is removed if nothing but the product section remains in it.
+    """
+    model_dir = entry['model']['fileInfo']['directory']
+    relname = location['file']
+
+    # Copy the containers to be modified, since the doc is shared with the
+    # cached model
+    doc = dict(entry['docs'][relname]['doc'])
+    entities = list(doc[entity_name])
+    if new_entity is None:
+        del entities[location['filePosition']]
+    else:
+        entities[location['filePosition']] = new_entity
+
+    if entities:
+        doc[entity_name] = entities
+    else:
+        doc.pop(entity_name)
+
+    if [k for k in doc.keys() if k != 'product']:
+        write_file(model_dir, relname, doc, False, entry['docs'])
+    else:
+        LOG.info("Deleting obsolete file %s", relname)
+        os.unlink(os.path.join(model_dir, relname))
+
+    invalidate_model_cache(model_dir, [relname])
+
+
+def check_entity_rename(entry, entity_name, id, new_entity):
+    # Abort if an update of the given entity would change its id to one that
+    # is already used by another entry
+    key_field = get_key_field(new_entity)
+    new_id = new_entity.get(key_field) if key_field else None
+    if new_id is not None and new_id != id and \
+            new_id in entry['index'].get(entity_name, {}):
+        abort(400, '%s %s already exists' % (entity_name, new_id))
+
+
 @bp.route("/api/v2/model/entities/<entity_name>/<id>", methods=['GET'])
 @policy.enforce('lifecycle:get_model')
 def get_entity_by_id(entity_name, id):
@@ -193,14 +438,9 @@ def get_entity_by_id(entity_name, id):
     :status 404: failure to read model or find the given entity
     """
 
-    model = read_model()
-    try:
-        entities = model['inputModel'][entity_name]
-        index = get_entity_index(entities, id)
-        return jsonify(entities[index])
-
-    except (KeyError, IndexError):
-        abort(404)
+    entry, location = locate_entity(entity_name, id)
+    return jsonify(
+        entry['model']['inputModel'][entity_name][location['position']])
 
 
 @bp.route("/api/v2/model/entities/<entity_name>/<id>", methods=['PUT'])
@@ -209,6 +449,7 @@ def update_entity_by_id(entity_name, id):
     """Update an individual entry by id
 
     Update an individual entry by id (name or index) from an array-type entity.
+    Only the file containing the entry is rewritten.
 
     .. :quickref: Model; Update an individual entity in the input model
 
@@ -216,17 +457,64 @@ def update_entity_by_id(entity_name, id):
     :param id: id of the individual entity
     """
 
-    model = read_model()
     new_entity = request.get_json()
+    if not isinstance(new_entity, dict):
+        abort(400, 'Entity must be an object')
+
+    entry, location = locate_entity(entity_name, id)
+    check_entity_rename(entry, entity_name, id, new_entity)
+    write_entity(entry, entity_name, location, new_entity)
+    return jsonify('Success')
+
+
+@bp.route("/api/v2/model/entities/<entity_name>/<id>", methods=['PATCH'])
+@policy.enforce('lifecycle:update_model')
+def patch_entity_by_id(entity_name, id):
+    """Apply a JSON patch to an individual entry by id
+
+    Applies a JSON Patch (`RFC 6902 <https://tools.ietf.org/html/rfc6902>`_)
+    to an individual entry of an array-type entity.  Paths in the patch are
+    relative to the entry itself.  Only the file containing the entry is
+    rewritten.
+
+    .. :quickref: Model; Apply a JSON patch to an individual entity
+
+    :param entity_name: Name of the entity
+    :param id: id of the individual entity
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       PATCH /api/v2/model/entities/servers/comp0001 HTTP/1.1
+       Content-Type: application/json-patch+json
+
+       [
+           {"op": "replace", "path": "/ip-addr", "value": "192.168.10.8"},
+           {"op": "remove", "path": "/ilo-password"}
+       ]
+
+    :status 200: success
+    :status 400: the patch is invalid or could not be applied
+    :status 404: failure to read model or find the given entity
+    """
+
+    operations = request.get_json(force=True)
+
+    entry, location = locate_entity(entity_name, id)
+    entity = copy.deepcopy(
+        entry['model']['inputModel'][entity_name][location['position']])
     try:
-        entities = model['inputModel'][entity_name]
-        index = get_entity_index(entities, id)
-        entities[index] = new_entity
-        write_model(model)
-        return jsonify('Success')
+        entity = util.apply_patch(entity, operations)
+    except ValueError as e:
+        abort(400, str(e))
 
-    except (KeyError, IndexError):
-        abort(404)
+    if not isinstance(entity, dict):
+        abort(400, 'Entity must be an object')
+
+    check_entity_rename(entry, entity_name, id, entity)
+    write_entity(entry, entity_name, location, entity)
+    return jsonify('Success')
 
 
 @bp.route("/api/v2/model/entities/<entity_name>/<id>", methods=['DELETE'])
@@ -234,23 +522,17 @@ def update_entity_by_id(entity_name, id):
 def delete_entity_by_id(entity_name, id):
     """Delete an individual entry by id
 
-    Delete an individual entry by ID (name or index) from an array-type entity
+    Delete an individual entry by ID (name or index) from an array-type entity.
+    Only the file containing the entry is rewritten.
 
     .. :quickref: Model; Delete an individual entry by id
 
     :param entity_name: Name of the entity
     :param id: id of the individual entity
     """
-    model = read_model()
-    try:
-        entities = model['inputModel'][entity_name]
-        index = get_entity_index(entities, id)
-        del(entities[index])
-        write_model(model)
-        return jsonify('Success')
-
-    except (KeyError, IndexError):
-        abort(404)
+    entry, location = locate_entity(entity_name, id)
+    write_entity(entry, entity_name, location)
+    return jsonify('Success')
 
 
 @bp.route("/api/v2/model/entities/<entity_name>", methods=['POST'])
@@ -262,20 +544,21 @@ def create_entity(entity_name):
 
     :param entity_name: Name of the entity
     """
-    model = read_model()
     new_entity = request.get_json()
 
-    key_field = get_key_field(new_entity)
-    entities = model['inputModel'][entity_name]
+    # Make sure it does not already exist
+    entry = _read_cache_entry()
+    if entity_name not in entry['index']:
+        abort(404)
     try:
-        # Make sure it does not already exist
-        for e in entities:
-            if e[key_field] == new_entity[key_field]:
-                abort(400)
-    except (KeyError, IndexError):
+        new_id = new_entity[get_key_field(new_entity)]
+    except (KeyError, TypeError):
         abort(404)
+    if new_id in entry['index'][entity_name]:
+        abort(400)
 
-    entities.append(new_entity)
+    model = read_model()
+    model['inputModel'][entity_name].append(new_entity)
     write_model(model)
     return jsonify('Success')
 
@@ -385,8 +668,8 @@ def update_model_file(name):
 
     # Verify that it is valid yaml before accepting it
     try:
-        yaml.safe_load(data)
-    except yaml.YAMLError:
+        yaml_io.safe_load(data)
+    except yaml_io.YAMLError:
         LOG.exception("Invalid yaml data")
         abort(400)
 
@@ -395,6 +678,7 @@ def update_model_file(name):
     try:
         with open(filename, "w") as f:
             f.write(data)
+        invalidate_model_cache(filenames=[os.path.normpath(name)])
         return jsonify('Success')
     except Exception as e:
         LOG.exception(e)
@@ -441,6 +725,40 @@ def get_encrypted():
         abort(404)
 
 
+@bp.route("/api/v2/model/cache", methods=['GET'])
+@policy.enforce('lifecycle:get_model')
+def get_model_cache_stats():
+    """Returns the hit and miss counters of the input model cache
+
+    ``model_hits`` counts the reads that were satisfied entirely from the
+    cache, ``model_misses`` those where at least one file had to be read.
+    ``file_hits`` and ``file_misses`` count, for the latter, how many files
+    could be reused and how many had to be re-parsed.  ``cp_internal_hits``
+    and ``cp_internal_misses`` count the reads of config processor internal
+    files that could be served from the cache and those that had to be
+    parsed.
+
+    .. :quickref: Model; Returns the input model cache counters
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+           "cp_internal_hits": 20,
+           "cp_internal_misses": 1,
+           "file_hits": 58,
+           "file_misses": 31,
+           "model_hits": 112,
+           "model_misses": 3
+       }
+    """
+    return jsonify(get_cache_stats())
+
+
 @bp.route("/api/v2/model/cp_output")
 @policy.enforce('lifecycle:get_model')
 def list_cp_output():
@@ -586,8 +904,50 @@ def get_cp_internal_file(name):
        {
            "baremetal": "... and so on"
        }
+
+    Since these files can be very large, the response can be limited to
+    selected parts of the document with the ``fields`` query parameter, which
+    is a comma-separated list of dotted paths.  The selected values are
+    returned nested within their enclosing objects.  A path may select an
+    element of a list by its index, in which case the element is returned
+    within an object keyed by that index, e.g. ``servers.0.name`` gives
+    ``{"servers": {"0": {"name": ...}}}``.
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       GET /api/v2/model/cp_internal/CloudModel.yaml?fields=internal HTTP/1.1
+       Content-Type: application/json
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+           "internal": {
+               "servers": ["... and so on"],
+               "... and so on"
+           }
+       }
+
+    :query fields: comma-separated list of dotted paths to return
+    :status 200: success
+    :status 400: a requested field does not exist
     """
 
+    fields = request.args.get('fields')
+    if fields:
+        contents = read_cp_internal_json(name)
+        try:
+            return jsonify(util.project(
+                contents, [f.strip() for f in fields.split(',')]))
+        except ValueError as e:
+            abort(400, str(e))
+
     (internal_dir, json_filename, contents) = \
         get_cp_internal_contents_or_path(name)
 
@@ -863,30 +1223,111 @@ def get_cp_internal_contents_or_path(name):
     json_path = safe_join(internal_dir, json_filename)
 
     contents = {}
-    if not os.path.exists(json_path) or \
-            os.path.getmtime(json_path) < os.path.getmtime(yaml_path):
-        contents = read_yml_file(internal_dir, filename, trusted=True)
-        with open(json_path, "w") as f:
-            json.dump(contents, f)
+    if _is_json_stale(json_path, yaml_path):
+        with _cp_internal_cache_lock:
+            lock = _cp_internal_conversion_locks.setdefault(json_path,
+                                                            threading.Lock())
+
+        # Only one request converts the file; any others wait for it to
+        # finish and then use its result
+        with lock:
+            if _is_json_stale(json_path, yaml_path):
+                contents = read_yml_file(internal_dir, filename, trusted=True)
+                _write_json_file(json_path, contents)
+
+                with _cp_internal_cache_lock:
+                    _cp_internal_cache[json_path] = {
+                        'mtime': os.path.getmtime(json_path),
+                        'contents': contents}
 
     return internal_dir, json_filename, contents
 
 
-# read the json output file of an internal cp file
+def _is_json_stale(json_path, yaml_path):
+    return not os.path.exists(json_path) or \
+        os.path.getmtime(json_path) < os.path.getmtime(yaml_path)
+
+
+def _write_json_file(json_path, contents):
+    # Write to a temporary file in the same directory and rename it into
+    # place, so that readers never see a partially written file
+    (fd, temp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(json_path),
+        prefix='.%s.' % os.path.basename(json_path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(contents, f)
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, json_path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def prewarm_cp_internal():
+    # Convert all of the config processor internal files to json, and parse
+    # the CloudModel, so that the first requests for them are fast
+    internal_dir = CONF.paths.cp_internal_dir
+    try:
+        filenames = os.listdir(internal_dir)
+    except OSError:
+        return
+
+    for filename in filenames:
+        if filename.startswith('.') or \
+                not filename.endswith(('.yml', '.yaml')):
+            continue
+        try:
+            if filename == 'CloudModel.yaml':
+                read_cp_internal_json(filename)
+            else:
+                get_cp_internal_contents_or_path(filename)
+        except Exception:
+            LOG.exception("Failed to convert %s to json", filename)
+
+    LOG.info("Converted config processor internal files in %s", internal_dir)
+
+
+def _on_config_processor_run(play_id):
+    socketio.start_background_task(prewarm_cp_internal)
+
+
+# read the json output file of an internal cp file.  The parsed contents are
+# cached until the json file changes, and are shared by all callers, so they
+# must not be modified
 def read_cp_internal_json(name):
 
     (internal_dir, json_filename, contents) = \
         get_cp_internal_contents_or_path(name)
 
-    if not contents:
-        json_path = safe_join(internal_dir, json_filename)
-        try:
-            with open(json_path) as f:
-                contents = json.load(f)
-        except Exception as e:
-            LOG.exception("Failed to read %s", json_path)
-            LOG.exception(e)
-            abort(500, "Failed to read %s", json_path)
+    # Freshly converted from yaml (and already cached)
+    if contents:
+        return contents
+
+    json_path = safe_join(internal_dir, json_filename)
+    try:
+        mtime = os.path.getmtime(json_path)
+    except OSError:
+        mtime = None
+
+    with _cp_internal_cache_lock:
+        cached = _cp_internal_cache.get(json_path)
+
+    if cached and mtime is not None and cached['mtime'] == mtime:
+        _cache_stats['cp_internal_hits'] += 1
+        return cached['contents']
+
+    _cache_stats['cp_internal_misses'] += 1
+    try:
+        with open(json_path) as f:
+            contents = json.load(f)
+    except Exception as e:
+        LOG.exception("Failed to read %s", json_path)
+        LOG.exception(e)
+        abort(500, "Failed to read %s", json_path)
+
+    with _cp_internal_cache_lock:
+        _cp_internal_cache[json_path] = {'mtime': mtime, 'contents': contents}
 
     return contents
 
@@ -905,22 +1346,51 @@ def get_deployed_hostnames():
         with open(json_file) as f:
             return json.load(f)
 
-    hostnames = []
     vb_option = CONF.paths.playbooks_dir + '/hosts/verb_hosts'
     try:
-        p = subprocess.Popen(
-            ['ansible', 'resources', '-i', vb_option, '--list-hosts'],
-            stdout=subprocess.PIPE)
-        names_lines = p.communicate()[0].decode('utf-8').split('\n')
-        # clean up the output
-        if names_lines:
-            hostnames = [name.strip() for name in names_lines if len(name) > 0]
-    except OSError as e:
-        LOG.exception("Failed to run ansible resources list-hosts command")
-        LOG.exception(e)
-        abort(500, "Failed to run ansible resources list-hosts command")
+        mtime = os.path.getmtime(vb_option)
+    except OSError:
+        mtime = None
 
-    return hostnames
+    # Running ansible takes several seconds, so the results are reused until
+    # the inventory changes.  Holding the lock while running it also prevents
+    # concurrent requests from each running their own copy
+    with _deployed_hostnames_lock:
+        if mtime is not None and _deployed_hostnames.get('mtime') == mtime:
+            return list(_deployed_hostnames['hostnames'])
+
+        hostnames = []
+        try:
+            p = subprocess.Popen(
+                ['ansible', 'resources', '-i', vb_option, '--list-hosts'],
+                stdout=subprocess.PIPE)
+            names_lines = p.communicate()[0].decode('utf-8').split('\n')
+            # clean up the output
+            if names_lines:
+                hostnames = [name.strip() for name in names_lines
+                             if len(name) > 0]
+        except OSError as e:
+            LOG.exception("Failed to run ansible resources list-hosts command")
+            LOG.exception(e)
+            abort(500, "Failed to run ansible resources list-hosts command")
+
+        _deployed_hostnames.clear()
+        if p.returncode == 0:
+            _deployed_hostnames.update(mtime=mtime, hostnames=hostnames)
+
+    return list(hostnames)
+
+
+def invalidate_deployed_hostnames(play_id=None):
+    # Discard the cached hostnames, e.g. after the inventory is regenerated
+    with _deployed_hostnames_lock:
+        _deployed_hostnames.clear()
+
+
+playbooks.add_completion_hook(playbooks.CONFIG_PROCESSOR_RUN_PLAYBOOK,
+                              _on_config_processor_run)
+playbooks.add_completion_hook(playbooks.READY_DEPLOYMENT_PLAYBOOK,
+                              invalidate_deployed_hostnames)
 
 
 def read_yml_file(dir, name, trusted=False):
@@ -934,13 +1404,13 @@ def read_yml_file(dir, name, trusted=False):
         with open(filename) as f:
             # Files that are generated programatically, such as those from
             # the config processor, may contain special python tags that can
-            # only be deserialized using yaml.load() -- yaml.safe_load()
+            # only be deserialized using yaml_io.load() -- yaml_io.safe_load()
             # should be used on those files that can be directly manipulated by
             # user input.
             if trusted:
-                contents = yaml.load(f)
+                contents = yaml_io.load(f)
             else:
-                contents = yaml.safe_load(f)
+                contents = yaml_io.safe_load(f)
 
         return contents
 
@@ -948,7 +1418,7 @@ def read_yml_file(dir, name, trusted=False):
         LOG.error("Unable to read %s", filename)
         abort(404)
 
-    except yaml.YAMLError:
+    except yaml_io.YAMLError:
         # If the generated file is not valid yml, there is some problem with
         # the config processor
         LOG.error("%s is not a valid yaml file", filename)
@@ -979,10 +1449,148 @@ def read_model(model_dir=None):
     Reads all of the yaml files from the given directory and loads them into a
     single giant dictionary.  The dictionary includes tracking information to
     capture where each entry was loaded, so that the object can be written back
-    out to the appropriate files
+    out to the appropriate files.
+
+    The returned dictionary is a private copy that the caller is free to
+    modify.  Callers that only need to inspect the model should use
+    read_cached_model() instead, which avoids making the copy.
     """
+    return copy.deepcopy(read_cached_model(model_dir))
 
+
+def read_cached_model(model_dir=None):
+    """Returns the shared, cached copy of the input model
+
+    The model is only rebuilt when the fingerprint (mtime, size and inode) of
+    any of its files has changed, or when files have been added or removed,
+    since it was last read.  Even then, only the files whose fingerprints have
+    changed are re-parsed; the parsed contents of all other files are reused.
+    The returned dictionary is shared between all callers and must therefore
+    never be modified; use read_model() to obtain a copy that can be modified.
+    """
+
+    return _read_cache_entry(model_dir)['model']
+
+
+def _read_cache_entry(model_dir=None):
+    # Return the cache entry for the model dir, which contains the model, the
+    # parsed contents of its files, and the index of its entities; refreshing
+    # the entry first if any of the files have changed
+
+    model_dir = model_dir or CONF.paths.model_dir
+    fingerprints = _get_fingerprints(model_dir)
+
+    with _model_cache_lock:
+        cached = _model_cache.get(model_dir) or {}
+        if cached.get('model') and cached['fingerprints'] == fingerprints:
+            _cache_stats['model_hits'] += 1
+            return cached
+        _cache_stats['model_misses'] += 1
+        docs = dict(cached.get('docs', {}))
+
+    # Note that the fingerprints were captured before reading the files, so
+    # a file that is modified while being read will cause a re-read next time
+    model, docs, index = _load_model(model_dir, fingerprints, docs)
+
+    entry = {'fingerprints': fingerprints,
+             'model': model,
+             'docs': docs,
+             'index': index}
+    with _model_cache_lock:
+        _model_cache[model_dir] = entry
+    return entry
+
+
+def invalidate_model_cache(model_dir=None, filenames=None):
+    """Discards cached model data for the given directory
+
+    Changes to the model files are detected automatically by their
+    fingerprints, but functions that modify the files explicitly discard the
+    cache as well, in case a file is rewritten with the same size within the
+    resolution of the file system's timestamps.  If a list of filenames
+    (relative to the model dir) is given, only the parsed contents of those
+    files are discarded; otherwise everything is.
+    """
     model_dir = model_dir or CONF.paths.model_dir
+    with _model_cache_lock:
+        if filenames is None:
+            _model_cache.pop(model_dir, None)
+            return
+
+        cached = _model_cache.get(model_dir)
+        if cached:
+            # Replace rather than modify the entry, since it may be in use
+            docs = {k: v for k, v in cached['docs'].items()
+                    if k not in filenames}
+            _model_cache[model_dir] = dict(cached, model=None, docs=docs)
+
+
+def _get_cached_docs(model_dir):
+    # Return the parsed contents of the files of the given model dir as of the
+    # last time that the model was read, keyed by the relative filename
+    with _model_cache_lock:
+        cached = _model_cache.get(model_dir) or {}
+        return dict(cached.get('docs', {}))
+
+
+def get_cache_stats():
+    # Return a snapshot of the model cache counters
+    with _model_cache_lock:
+        return dict(_cache_stats)
+
+
+def _get_fingerprints(model_dir):
+    # Return an ordered dict of relative filename -> (mtime, size, inode) for
+    # all of the files in the model dir that contribute to the model, in the
+    # order in which they are to be processed
+    fingerprints = collections.OrderedDict()
+    for root, dirs, files in os.walk(model_dir):
+        for file in files:
+            if not file.endswith('.yml') and not file.startswith('README'):
+                continue
+
+            filename = os.path.join(root, file)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            relname = os.path.relpath(filename, model_dir)
+            fingerprints[relname] = _fingerprint(st)
+
+    return fingerprints
+
+
+def _fingerprint(st):
+    # Return the fingerprint used to detect changes to a file from its stat
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _read_doc(model_dir, relname, fingerprint, old_docs, new_docs):
+    # Return the parsed contents of the given file, re-using the contents
+    # from old_docs when its fingerprint is unchanged.  Successfully parsed
+    # contents are recorded in new_docs.  README files are returned as text.
+    cached = old_docs.get(relname)
+    if cached and cached['fingerprint'] == fingerprint:
+        _cache_stats['file_hits'] += 1
+        doc = cached['doc']
+    else:
+        _cache_stats['file_misses'] += 1
+        with open(os.path.join(model_dir, relname)) as f:
+            if relname.endswith('.yml'):
+                doc = yaml_io.safe_load(f)
+            else:
+                doc = ''.join(f.readlines())
+
+    new_docs[relname] = {'fingerprint': fingerprint, 'doc': doc}
+    return doc
+
+
+def _load_model(model_dir, fingerprints, old_docs):
+    # Build the model from the files in the model dir, only parsing those
+    # files whose contents are not already available in old_docs.  Returns the
+    # model along with the parsed contents of all files and the index of the
+    # entities in the array-type sections (see add_doc_to_model)
 
     # First read and process the top-level cloud config file
     cloud_config_file = os.path.join(model_dir, CLOUD_CONFIG)
@@ -993,19 +1601,18 @@ def read_model(model_dir=None):
              'fileInfo': {},
              'errors': [],
              }
+    docs = {}
+    index = {}
 
-    with open(cloud_config_file) as f:
-        try:
-            doc = yaml.safe_load(f)
-        except yaml.YAMLError:
-            LOG.exception("Invalid yaml file")
-            raise
-        except IOError:
-            LOG.exception("Unable to read yaml file")
-            raise
+    try:
+        doc = _read_doc(model_dir, CLOUD_CONFIG,
+                        fingerprints.get(CLOUD_CONFIG), old_docs, docs)
+    except yaml_io.YAMLError:
+        LOG.exception("Invalid yaml file")
+        raise
 
     if not doc:
-        return model
+        return model, docs, index
 
     try:
         model['version'] = doc['product']['version']
@@ -1024,45 +1631,50 @@ def read_model(model_dir=None):
         'files': [relname],
         'sections': collections.defaultdict(list),
         'fileSectionMap': collections.defaultdict(list),
-        'mtime': int(1000 * os.stat(cloud_config_file).st_mtime),
+        'mtime': int(1000 * fingerprints[CLOUD_CONFIG][0]),
         '_object_data': collections.defaultdict(list),
     }
     model['inputModel'] = {}
 
-    add_doc_to_model(model, doc, relname)
+    add_doc_to_model(model, doc, relname, index)
 
-    # Now read and process all yml files in the dir tree below
-    for root, dirs, files in os.walk(model_dir):
-        for file in files:
-            # avoid processing top-level cloud config again
-            if file == CLOUD_CONFIG:
-                continue
+    # Now process all other files in the dir tree below
+    for relname, fingerprint in fingerprints.items():
+        file = os.path.basename(relname)
 
-            relname = os.path.relpath(os.path.join(root, file), model_dir)
-            filename = os.path.join(root, file)
-            if file.endswith('.yml'):
-                model['fileInfo']['files'].append(relname)
-                with open(filename) as f:
-                    try:
-                        doc = yaml.safe_load(f)
-                        add_doc_to_model(model, doc, relname)
-                    except yaml.YAMLError:
-                        LOG.exception("Invalid yaml file")
-
-            elif file.startswith('README'):
-                ext = file[7:]
-                with open(filename) as f:
-                    lines = f.readlines()
-                model['readme'][ext] = ''.join(lines)
+        # avoid processing top-level cloud config again
+        if file == CLOUD_CONFIG:
+            continue
+
+        if file.endswith('.yml'):
+            model['fileInfo']['files'].append(relname)
+            try:
+                doc = _read_doc(model_dir, relname, fingerprint, old_docs,
+                                docs)
+                add_doc_to_model(model, doc, relname, index)
+            except yaml_io.YAMLError:
+                LOG.exception("Invalid yaml file")
+
+        else:
+            ext = file[7:]
+            model['readme'][ext] = _read_doc(model_dir, relname, fingerprint,
+                                             old_docs, docs)
 
     # Update metadata related to pass-through, if necessary
     update_pass_through(model)
 
-    return model
+    return model, docs, index
 
 
-def add_doc_to_model(model, doc, relname):
+def add_doc_to_model(model, doc, relname, index=None):
 
+    # If an index dict is supplied, it is populated with the location of each
+    # entry of array-type sections, i.e.
+    #    section: {
+    #        id: {'file': relname,
+    #             'position': <position in the inputModel list>,
+    #             'filePosition': <position in the list in the file>}
+    #    }
     for section, value in doc.items():
         # Add to fileInfo / sections
         model['fileInfo']['sections'][section].append(relname)
@@ -1083,6 +1695,15 @@ def add_doc_to_model(model, doc, relname):
             # Add to inputModel
             if section not in model['inputModel']:
                 model['inputModel'][section] = []
+
+            if index is not None:
+                start = len(model['inputModel'][section])
+                section_index = index.setdefault(section, {})
+                for pos, e in enumerate(value):
+                    section_index[e[key_field]] = {'file': relname,
+                                                   'position': start + pos,
+                                                   'filePosition': pos}
+
             model['inputModel'][section].extend(value)
 
         elif isinstance(value, dict) and section == PASS_THROUGH:
@@ -1134,14 +1755,115 @@ def update_pass_through(model):
 # Functions to write the model
 #
 
+def _get_changes(model_dir, model):
+    # Return the sections of the input model that differ from those of the
+    # cached model, as a dict of section name -> set of the ids of the changed
+    # entries of a keyed list, or None if the section changed as a whole.
+    # None is returned if the cached model cannot be compared with, since it
+    # is out of date or was read with a different layout of files
+    fingerprints = _get_fingerprints(model_dir)
+    with _model_cache_lock:
+        cached = _model_cache.get(model_dir) or {}
+        cached_model = cached.get('model')
+        if not cached_model or cached['fingerprints'] != fingerprints:
+            return None
+
+    if cached_model['fileInfo'] != model['fileInfo']:
+        return None
+
+    old_input = cached_model['inputModel']
+    new_input = model['inputModel']
+    changes = {}
+    for section_name in set(old_input) | set(new_input):
+        old_section = old_input.get(section_name)
+        new_section = new_input.get(section_name)
+        if old_section == new_section:
+            continue
+
+        # The entries of a list are only tracked individually when they are
+        # spread across several files, since a file that holds the entire
+        # list is affected by entries being added to it
+        key_field = None
+        if isinstance(old_section, list) and isinstance(new_section, list) \
+                and len(model['fileInfo']['sections'].get(section_name,
+                                                          [])) > 1:
+            key_field = get_section_key_field(model, section_name)
+        if not key_field:
+            changes[section_name] = None
+            continue
+
+        try:
+            old_items = {item[key_field]: item for item in old_section}
+            new_items = {item[key_field]: item for item in new_section}
+        except (KeyError, TypeError):
+            changes[section_name] = None
+            continue
+
+        changes[section_name] = set(
+            id for id in set(old_items) | set(new_items)
+            if old_items.get(id) != new_items.get(id))
+
+    return changes
+
+
+def _is_file_unchanged(sections, changes):
+    # Return whether none of the given sections of a file (an entry in the
+    # fileSectionMap) contain any of the given changes
+    if changes is None:
+        return False
+
+    for section in sections:
+        if isinstance(section, six.string_types):
+            if section in changes:
+                return False
+            continue
+
+        section_name = [k for k in section.keys()
+                        if k not in ('type', 'keyField')][0]
+        if section_name not in changes:
+            continue
+
+        changed_ids = changes[section_name]
+        if changed_ids is None or section['type'] != 'array' or \
+                changed_ids.intersection(section[section_name]):
+            return False
+
+    return True
+
+
 # This function is long and should be modularized
 def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
+    """Writes the input model back out to the files of the model dir
+
+    The sections and list entries of the model that differ from those of the
+    cached model (i.e. as last read) are determined first, and files that
+    contain none of them are left alone without being compared or re-read.
+    The contents of the remaining files are compared with their cached (or,
+    if changed on disk, freshly read) contents, and only those that differ
+    are written.  Returns a dict of filename -> {data, status} describing
+    what was written.
+    """
 
     model_dir = model_dir or CONF.paths.model_dir
 
-    # Create a deep copy of the model to avoid munging the model that was
-    # passed in
-    model = copy.deepcopy(in_model)
+    # Create a copy of the model to avoid munging the model that was passed
+    # in.  Only the containers that are modified below (the inputModel dict
+    # and the pass-through dicts) need to be copied, which avoids the cost of
+    # deep-copying the entire model
+    model = dict(in_model)
+    model['inputModel'] = dict(in_model['inputModel'])
+    pass_through = model['inputModel'].get(PASS_THROUGH)
+    if isinstance(pass_through, dict):
+        model['inputModel'][PASS_THROUGH] = {
+            k: dict(v) if isinstance(v, dict) else v
+            for k, v in pass_through.items()}
+
+    # The parsed contents of the files as of the last read of the model, which
+    # avoids having to re-read and parse every file in order to determine
+    # whether it has changed, and the parts of the model that have changed
+    # since then, which avoids comparing files that contain none of them
+    old_docs = _get_cached_docs(model_dir)
+    changes = _get_changes(model_dir, model)
 
     # Keep track of what was written, by creating a dict with this format:
     #    filename: {
@@ -1277,7 +1999,11 @@ def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
 
         real_keys = [k for k in new_content.keys() if k != 'product']
         if real_keys:
-            status = write_file(model_dir, filename, new_content, dry_run)
+            if _is_file_unchanged(sections, changes):
+                status = IGNORED
+            else:
+                status = write_file(model_dir, filename, new_content,
+                                    dry_run, old_docs)
             written_files[filename] = {'data': new_content, 'status': status}
 
     # Write portion of input model that remain -- these have not been written
@@ -1300,7 +2026,8 @@ def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
             filename = basename + '.yml'
 
             data[section_name] = contents
-            status = write_file(model_dir, filename, data, dry_run)
+            status = write_file(model_dir, filename, data, dry_run,
+                                old_docs)
             written_files[filename] = {'data': data, 'status': status}
 
         elif isinstance(contents, list):
@@ -1313,14 +2040,16 @@ def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
                     data[section_name] = [elt]
 
                     filename = "%s_%s.yml" % (basename, elt[key_field])
-                    status = write_file(model_dir, filename, data, dry_run)
+                    status = write_file(model_dir, filename, data, dry_run,
+                                        old_docs)
                     written_files[filename] = {'data': data, 'status': status}
             else:
                 # place all elements of the list into a single file
                 data[section_name] = contents
                 filename = "%s_%s.yml" % (basename,
                                           contents[0][key_field])
-                status = write_file(model_dir, filename, data, dry_run)
+                status = write_file(model_dir, filename, data, dry_run,
+                                    old_docs)
                 written_files[filename] = {'data': data, 'status': status}
         else:
             # Not a list, so therefore it must be pass-through data that did
@@ -1330,7 +2059,8 @@ def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
             filename = "%s_%s.yml" % (basename,
                                       '%4x' % random.randrange(2 ** 32))
 
-            status = write_file(model_dir, filename, data, dry_run)
+            status = write_file(model_dir, filename, data, dry_run,
+                                old_docs)
             written_files[filename] = {'data': data, 'status': status}
 
     # Remove any existing files in the output directory that are obsolete
@@ -1338,6 +2068,12 @@ def write_model(in_model, model_dir=None, dry_run=False):  # noqa: C901
     for filename in removed:
         written_files[filename] = {'data': None, 'status': DELETED}
 
+    if not dry_run:
+        invalidate_model_cache(model_dir,
+                               [filename for filename, info in
+                                written_files.items()
+                                if info['status'] != IGNORED])
+
     return written_files
 
 
@@ -1370,7 +2106,7 @@ def get_section_key_field(model, section_name):
                 pass
 
 
-def write_file(model_dir, filename, new_content, dry_run):
+def write_file(model_dir, filename, new_content, dry_run, old_docs=None):
 
     filepath = os.path.join(model_dir, filename)
 
@@ -1384,11 +2120,19 @@ def write_file(model_dir, filename, new_content, dry_run):
     try:
         if os.access(filepath, os.R_OK):
             existed = True
-            with open(filepath) as f:
-                old_content = yaml.safe_load(f)
-    except yaml.YAMLError:
+
+            # Use the parsed contents from the model cache if the file has
+            # not changed since then, otherwise read it
+            cached = (old_docs or {}).get(filename)
+            if cached and \
+                    cached['fingerprint'] == _fingerprint(os.stat(filepath)):
+                old_content = cached['doc']
+            else:
+                with open(filepath) as f:
+                    old_content = yaml_io.safe_load(f)
+    except yaml_io.YAMLError:
         LOG.exception("Invalid yaml file %s", filepath)
-    except IOError as e:
+    except (IOError, OSError) as e:
         LOG.error(e)
 
     # Avoid writing the file if the contents have not changes.  This preserves
@@ -1399,10 +2143,10 @@ def write_file(model_dir, filename, new_content, dry_run):
         LOG.info("Writing file %s", filename)
         if not dry_run:
             with open(filepath, "w") as f:
-                yaml.safe_dump(new_content, f,
-                               indent=2,
-                               default_flow_style=False,
-                               canonical=False)
+                yaml_io.safe_dump(new_content, f,
+                                  indent=2,
+                                  default_flow_style=False,
+                                  canonical=False)
 
     # Return an indication of whether a file was written (vs ignored)
     status = CHANGED if existed else ADDED
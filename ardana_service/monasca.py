@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import clients
 from . import policy
 from datetime import datetime
 from datetime import timedelta
@@ -34,6 +35,9 @@ STATUS_UP = 'up'
 STATUS_DOWN = 'down'
 STATUS_UNKNOWN = 'unknown'
 
+# How long a monasca client is reused for
+MONASCA_CLIENT_TTL_SECONDS = 15 * 60
+
 
 def get_monasca_endpoint():
     """Get the keystone endpoint for Monasca
@@ -57,23 +61,30 @@ def get_monasca_client():
     """Instantiates and returns an instance of the monasca python client"""
 
     monasca_endpoint = get_monasca_endpoint()
-    # Monasca client v1.7.1 used in pike is old, so get its client via
-    # old-fashioned way (credentials)
-    # the pike version also cannot reliably discover its own endpoint,
-    # so it is specified here
-    mon_client = Mon_client(
-        api_version="2_0",
-        endpoint=monasca_endpoint,
-        auth_url=CONF.keystone_authtoken.auth_url,
-        username=CONF.keystone_authtoken.username,
-        password=CONF.keystone_authtoken.password,
-        project_name=CONF.keystone_authtoken.project_name,
-        project_domain_name=CONF.keystone_authtoken.project_domain_name,
-        user_domain_name=CONF.keystone_authtoken.user_domain_name,
-        insecure=CONF.keystone_authtoken.insecure
-    )
-
-    return mon_client
+
+    def create():
+        # Monasca client v1.7.1 used in pike is old, so get its client via
+        # old-fashioned way (credentials)
+        # the pike version also cannot reliably discover its own endpoint,
+        # so it is specified here
+        return Mon_client(
+            api_version="2_0",
+            endpoint=monasca_endpoint,
+            auth_url=CONF.keystone_authtoken.auth_url,
+            username=CONF.keystone_authtoken.username,
+            password=CONF.keystone_authtoken.password,
+            project_name=CONF.keystone_authtoken.project_name,
+            project_domain_name=CONF.keystone_authtoken.project_domain_name,
+            user_domain_name=CONF.keystone_authtoken.user_domain_name,
+            insecure=CONF.keystone_authtoken.insecure
+        )
+
+    # The client authenticates when it is created, so it is reused for a
+    # while rather than authenticating on every call.  Its lifetime is well
+    # within that of keystone tokens, since the old client cannot renew its
+    # token
+    return clients.get_service_client(('monasca', monasca_endpoint), create,
+                                      MONASCA_CLIENT_TTL_SECONDS)
 
 
 @bp.route("/api/v2/monasca/service_status", methods=['GET'])
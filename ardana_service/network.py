@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import clients
 from . import policy
 
 from flask import abort
@@ -19,8 +20,6 @@ from flask import Blueprint
 from flask import jsonify
 from flask import request
 import json
-from keystoneauth1 import loading
-from keystoneauth1 import session
 from neutronclient.v2_0 import client as neutronClient
 import os
 from oslo_config import cfg
@@ -33,19 +32,13 @@ CONF = cfg.CONF
 
 def get_network_client(req):
 
+    def create(sess, auth):
+        return neutronClient.Client(session=sess, auth=auth,
+                                    endpoint_type="internalURL")
+
     try:
-        loader = loading.get_plugin_loader('v3token')
-        auth = loader.load_from_options(
-            auth_url=CONF.keystone_authtoken.auth_url,
-            token=req.headers.get('X-Auth-Token'),
-            project_name=CONF.keystone_authtoken.project_name,
-            project_domain_name=CONF.keystone_authtoken.project_domain_name
-        )
-        sess = session.Session(auth=auth,
-                               verify=not CONF.keystone_authtoken.insecure)
-        network_client = neutronClient.Client(session=sess,
-                                              endpoint_type="internalURL")
-        return network_client
+        return clients.get_token_client(
+            'network', req.headers.get('X-Auth-Token'), create)
 
     except Exception as e:
         LOG.error(e)
@@ -13,11 +13,11 @@
 # limitations under the License.
 
 from .playbooks import run_playbook
-from .plays import get_metadata_file
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
 from flask import request
+from flask import url_for
 import itertools
 import json
 import os
@@ -28,9 +28,9 @@ from oslo_config import cfg
 from oslo_log import log as logging
 import re
 import subprocess
+import threading
 
 from . import policy
-from time import sleep
 
 LOG = logging.getLogger(__name__)
 bp = Blueprint('packages', __name__)
@@ -38,6 +38,13 @@ PKG_CACHE_FILE = cfg.CONF.paths.packages_cache
 HOST_PKGS_FILE = cfg.CONF.paths.packages_hosts_data
 PACKAGES_PLAY = "_ardana-service-get-pkgdata"
 
+# The most recent scan of the packages on all hosts, which is shared by all
+# requests made while it runs, and the package list from the last one that
+# succeeded
+_scan = None
+_last_result = None
+_scan_lock = threading.Lock()
+
 
 @bp.route("/api/v2/packages", methods=['GET'])
 @policy.enforce('lifecycle:list_packages')
@@ -47,8 +54,22 @@ def get_packages():
     This caches the ardana and venv-openstack packages installed on the
     deployer and returns a list of ardana packages.
 
+    The packages on the hosts of the cloud are found by running a playbook,
+    which can take a long time.  Only one such scan runs at a time, and
+    requests made while it runs receive its result.  With ``async=true``, the
+    result of the last scan is returned if there is one; otherwise a scan is
+    started (unless one is running) and its play id is returned with status
+    202, after which the same request returns the result once the play ends.
+    If that scan fails, the same request returns status 404 with the play id
+    in its message, without starting another scan, until ``refresh=true`` is
+    given.
+
     .. :quickref: Packages; list ardana packages and openstack venv versions
 
+    :query boolean async: ``true`` to return without waiting for a scan
+    :query boolean refresh: ``true`` to scan again even if a previous result
+                            is available, when ``async`` is ``true``
+
     **Example Request**:
 
     .. sourcecode:: http
@@ -87,33 +108,94 @@ def get_packages():
         with open(json_file) as f:
             return jsonify(json.load(f))
 
-    installed_os_pkgs, os_pkg_cache = update_openstack_pkg_cache()
-
-    # Run the playbook to get package data from all the hosts in the model
-    proc_info = {}
-    try:
-        vars = {
-            "extra-vars": {
-                "host_pkgs_file": HOST_PKGS_FILE
-            }
-        }
-        # encrypt is needed to run playbook if cloud config is encrypted.
-        # It is passed in as a header because there is no body in HTTP GET
-        # API.
-        encrypt = request.headers.get('encrypt')
-        if encrypt:
-            vars['extra-vars']['encrypt'] = encrypt
-        play_id = run_playbook(PACKAGES_PLAY, vars)["id"]
-        # Poll for "code" and ignore its value because some hosts may be down.
-        while 'code' not in proc_info:
-            with open(get_metadata_file(play_id)) as f:
-                proc_info = json.load(f)
-            if 'code' not in proc_info:
-                sleep(1)
-    except Exception as e:
-        LOG.error("Could not get remote package information: %s" % e)
+    run_async = request.args.get('async') == 'true'
+    refresh = request.args.get('refresh') == 'true'
+
+    if run_async and not refresh:
+        scan = _scan
+        if scan is not None and scan.done.is_set() and scan.error:
+            abort(404, "Remote package information unavailable (play %s)" %
+                  scan.id)
+        if _last_result is not None:
+            return jsonify(_last_result)
+
+    # encrypt is needed to run playbook if cloud config is encrypted.
+    # It is passed in as a header because there is no body in HTTP GET
+    # API.
+    scan = start_scan(request.headers.get('encrypt'))
+
+    if run_async:
+        return jsonify({'id': scan.id}), 202, \
+            {'Location': url_for('plays.get_play', id=scan.id)}
+
+    # Wait for the scan without polling; only this green thread is blocked
+    scan.done.wait()
+    if scan.error:
         abort(404, "Remote package information unavailable")
+    return jsonify(scan.result)
+
+
+class _Scan(object):
+    # A run of the packages playbook, and the package list built from it
+    def __init__(self, id):
+        self.id = id
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
 
+
+def start_scan(encrypt=None):
+    """Start a scan of the packages on all hosts, unless one is running
+
+    Returns the running scan.  Its ``done`` event is set once its ``result``
+    (or ``error``) is available.
+    """
+    global _scan
+
+    with _scan_lock:
+        if _scan is not None and not _scan.done.is_set():
+            return _scan
+
+        try:
+            installed_os_pkgs, os_pkg_cache = update_openstack_pkg_cache()
+
+            # Run the playbook to get package data from all the hosts in the
+            # model
+            vars = {
+                "extra-vars": {
+                    "host_pkgs_file": HOST_PKGS_FILE
+                }
+            }
+            if encrypt:
+                vars['extra-vars']['encrypt'] = encrypt
+            play = run_playbook(PACKAGES_PLAY, vars)
+        except Exception as e:
+            LOG.error("Could not get remote package information: %s" % e)
+            abort(404, "Remote package information unavailable")
+
+        scan = _Scan(play["id"])
+
+        def finish(value):
+            # The outcome of the play is ignored because some hosts may be
+            # down
+            global _last_result
+            try:
+                scan.result = get_package_list(installed_os_pkgs,
+                                               os_pkg_cache)
+                _last_result = scan.result
+            except Exception as e:
+                LOG.error("Could not get remote package information: %s", e)
+                scan.error = e
+            finally:
+                scan.done.set()
+
+        _scan = scan
+        play["promise"].then(finish, finish)
+        return scan
+
+
+def get_package_list(installed_os_pkgs, os_pkg_cache):
+    """Build the package list from the data gathered by the playbook"""
     # host_pkgs example structure created by PACKAGES_PLAY playbook run:
     # {
     #     "host1": {
@@ -136,7 +218,7 @@ def get_packages():
     except Exception as e:
         LOG.error("Could not retrieve remote host pkg data from %s: %s"
                   % (HOST_PKGS_FILE, e))
-        abort(404, "Remote package information unavailable")
+        raise
     finally:
         if exists(HOST_PKGS_FILE):
             os.remove(HOST_PKGS_FILE)
@@ -175,7 +257,7 @@ def get_packages():
     # systems
     pkgs_dict = {}
     for host in host_pkgs.values():
-        for name, version in host['zypper_cloud_pkgs'].iteritems():
+        for name, version in host['zypper_cloud_pkgs'].items():
             if name not in pkgs_dict:
                 pkgs_dict[name] = [version]
             elif version not in pkgs_dict[name]:
@@ -193,7 +275,7 @@ def get_packages():
         'cloud_installed_packages': cip
     }
 
-    return jsonify(response)
+    return response
 
 
 def update_openstack_pkg_cache():
@@ -246,7 +328,8 @@ def update_openstack_pkg_cache():
                     p = subprocess.Popen(
                         ['rpm', '--query', '--list', name_vers],
                         stdout=subprocess.PIPE)
-                    rpm_lines = p.communicate()[0].split('\n')
+                    rpm_lines = \
+                        p.communicate()[0].decode('utf-8').split('\n')
                     project = os_match.group('name')
                     re_ts_pkg = \
                         re.compile(r"/(?P<name_ts>%s-\d+T\d+Z).tgz$" % project)
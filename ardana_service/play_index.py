@@ -0,0 +1,270 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Index of play metadata, used to answer queries about plays without reading
+# every metadata file in the log dir.  The metadata files remain the
+# authoritative record of each play; the index is an sqlite database in the
+# log dir that is rebuilt from those files whenever it is missing or damaged.
+
+from contextlib import closing
+import json
+import os
+from oslo_config import cfg
+from oslo_log import log as logging
+import sqlite3
+import threading
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+INDEX_FILE = 'plays.db'
+META_EXT = '.json'
+
+# Version of the schema below, which is stored in the index so that indexes
+# created with an older schema are rebuilt
+SCHEMA_VERSION = 2
+
+# Play statuses that can be queried
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+KILLED = 'killed'
+
+_STATUS_CLAUSES = {
+    QUEUED: 'end_time IS NULL AND queued = 1',
+    RUNNING: 'end_time IS NULL AND queued = 0',
+    SUCCEEDED: 'end_time IS NOT NULL AND killed = 0 AND code = 0',
+    FAILED: 'end_time IS NOT NULL AND killed = 0 AND '
+            '(code IS NULL OR code != 0)',
+    KILLED: 'killed = 1',
+}
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS plays (
+        id TEXT PRIMARY KEY,
+        playbook TEXT,
+        start_time INTEGER,
+        end_time INTEGER,
+        code INTEGER,
+        killed INTEGER NOT NULL DEFAULT 0,
+        queued INTEGER NOT NULL DEFAULT 0,
+        metadata TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS plays_start_time ON plays (start_time);
+    CREATE INDEX IF NOT EXISTS plays_playbook ON plays (playbook, start_time);
+"""
+
+# Index files that have been verified to exist (or been rebuilt) by this
+# process
+_ready = set()
+_lock = threading.Lock()
+
+
+def get_index_file():
+    return os.path.join(CONF.paths.log_dir, INDEX_FILE)
+
+
+def playbook_name(playbook):
+    # Plays are indexed by the basename of their playbook, without the .yml
+    # suffix
+    if not playbook:
+        return playbook
+
+    name = os.path.basename(playbook)
+    if name.endswith('.yml'):
+        name = name[:-4]
+    return name
+
+
+def _connect(index_file):
+    return closing(sqlite3.connect(index_file, timeout=30))
+
+
+def _row(play):
+    return (str(play['id']),
+            playbook_name(play.get('playbook')),
+            play.get('startTime'),
+            play.get('endTime'),
+            play.get('code'),
+            1 if play.get('killed') else 0,
+            1 if play.get('queued') else 0,
+            json.dumps(play))
+
+
+def _insert(conn, plays):
+    conn.executemany('INSERT OR REPLACE INTO plays VALUES (?,?,?,?,?,?,?,?)',
+                     [_row(play) for play in plays])
+
+
+def rebuild():
+    """Recreate the index from the metadata files in the log dir"""
+    index_file = get_index_file()
+    with _lock:
+        _rebuild(index_file)
+
+
+def _rebuild(index_file):
+    LOG.info("Rebuilding play index %s", index_file)
+    if os.path.exists(index_file):
+        os.unlink(index_file)
+
+    plays = []
+    for filename in os.listdir(CONF.paths.log_dir):
+        if not filename.endswith(META_EXT):
+            continue
+        try:
+            with open(os.path.join(CONF.paths.log_dir, filename)) as f:
+                play = json.load(f)
+            if 'id' in play:
+                plays.append(play)
+        except (IOError, OSError, ValueError):
+            LOG.warning("Unable to index play metadata %s", filename)
+
+    with _connect(index_file) as conn:
+        with conn:
+            conn.executescript(_SCHEMA)
+            conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            _insert(conn, plays)
+
+    _ready.add(index_file)
+
+
+def _ensure_index():
+    # Return the path of the index, building it first if necessary
+    index_file = get_index_file()
+    if index_file not in _ready:
+        with _lock:
+            if index_file not in _ready:
+                version = None
+                if os.path.exists(index_file):
+                    with _connect(index_file) as conn:
+                        version = conn.execute(
+                            'PRAGMA user_version').fetchone()[0]
+                if version == SCHEMA_VERSION:
+                    _ready.add(index_file)
+                else:
+                    _rebuild(index_file)
+    return index_file
+
+
+def _discard(index_file):
+    # The index is damaged, so remove it in order for it to be rebuilt
+    LOG.exception("Play index %s is unusable; it will be rebuilt", index_file)
+    with _lock:
+        _ready.discard(index_file)
+        try:
+            os.unlink(index_file)
+        except OSError:
+            pass
+
+
+def update(play):
+    """Add or update the metadata of the given play in the index
+
+    Failures are logged rather than raised, since the play's metadata file is
+    its authoritative record and the index can be rebuilt from it.
+    """
+    try:
+        index_file = _ensure_index()
+    except (sqlite3.Error, IOError, OSError):
+        LOG.exception("Unable to open play index")
+        return
+
+    try:
+        with _connect(index_file) as conn:
+            with conn:
+                _insert(conn, [play])
+    except sqlite3.Error:
+        _discard(index_file)
+
+
+def remove(ids):
+    """Remove the plays with the given ids from the index"""
+    ids = [str(id) for id in ids]
+    if not ids:
+        return
+
+    index_file = _ensure_index()
+    try:
+        with _connect(index_file) as conn:
+            with conn:
+                conn.executemany('DELETE FROM plays WHERE id = ?',
+                                 [(id,) for id in ids])
+    except sqlite3.Error:
+        _discard(index_file)
+
+
+def query(playbook=None, status=None, ids=None, min_end_time=None,
+          max_end_time=None, started_after=None, started_before=None,
+          offset=0, limit=None, ascending=False):
+    """Return the metadata of plays matching the given criteria
+
+    Plays are sorted by start time, newest first unless ascending is given.
+    Returns a tuple of the list of plays between offset and offset + limit,
+    and the total number of plays that match.  Plays that have not ended are
+    always considered to satisfy min_end_time, and never max_end_time.
+    """
+    clauses = []
+    params = []
+
+    if playbook:
+        clauses.append('playbook = ?')
+        params.append(playbook_name(playbook))
+
+    if status:
+        clauses.append('(%s)' % _STATUS_CLAUSES[status])
+
+    if ids is not None:
+        ids = [str(id) for id in ids]
+        if not ids:
+            return [], 0
+        clauses.append('id IN (%s)' % ','.join('?' * len(ids)))
+        params.extend(ids)
+
+    if min_end_time is not None:
+        clauses.append('(end_time IS NULL OR end_time >= ?)')
+        params.append(min_end_time)
+
+    if max_end_time is not None:
+        clauses.append('end_time < ?')
+        params.append(max_end_time)
+
+    if started_after is not None:
+        clauses.append('start_time >= ?')
+        params.append(started_after)
+
+    if started_before is not None:
+        clauses.append('start_time < ?')
+        params.append(started_before)
+
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    order = 'ASC' if ascending else 'DESC'
+
+    for attempt in range(2):
+        index_file = _ensure_index()
+        try:
+            with _connect(index_file) as conn:
+                total = conn.execute('SELECT COUNT(*) FROM plays' + where,
+                                     params).fetchone()[0]
+                order_by = ' ORDER BY start_time %s, id %s' % (order, order)
+                sql = 'SELECT metadata FROM plays' + where + order_by
+                rows = conn.execute(
+                    sql + ' LIMIT ? OFFSET ?',
+                    params + [-1 if limit is None else limit, offset])
+                return [json.loads(row[0]) for row in rows], total
+        except sqlite3.Error:
+            if attempt:
+                raise
+            _discard(index_file)
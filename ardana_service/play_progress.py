@@ -0,0 +1,169 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Parser that turns the output of ansible-playbook into a stream of structured
+# progress events, so that clients can follow the progress of each host
+# without having to scan the whole log themselves.  The events of each play
+# are stored as json lines in its .progress file and sent to the play's
+# socketIO room along with its log (see playbooks.LogForwarder).
+#
+# Events are dicts with an 'event' key of:
+#
+#   play      a PLAY header, with its 'name'
+#   task      a TASK header, with its 'name' and the 'play' it belongs to
+#   result    the 'status' of a task on a 'host': ok, changed, skipping,
+#             failed or unreachable.  Results of loops also have the 'item'
+#   ignored   a failed result on a 'host' that is being ignored
+#   recap     the final counts of a 'host' from the PLAY RECAP, such as 'ok',
+#             'changed', 'unreachable' and 'failed'
+#
+# All events have the 'timestamp' at which they were parsed, in seconds since
+# the epoch like the events of the callback plugin.  The output of both
+# ansible 1.9 and 2.x is understood.
+
+import re
+import six
+import time
+
+PLAY = 'play'
+TASK = 'task'
+RESULT = 'result'
+IGNORED = 'ignored'
+RECAP = 'recap'
+
+# Escape sequences used when ansible colors its output
+_COLOR_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+# PLAY [name] ****
+_PLAY_RE = re.compile(r'^PLAY \[(?P<name>.*)\] \*+\s*$')
+
+# TASK: [name] **** (ansible 1.9), TASK [name] **** (ansible 2), and the
+# equivalent handler headers
+_TASK_RE = re.compile(
+    r'^(?:TASK|NOTIFIED|RUNNING HANDLER):? \[(?P<name>.*)\] \*+\s*$')
+
+_RECAP_RE = re.compile(r'^PLAY RECAP \*+\s*$')
+
+# status: [host] optionally followed by "-> delegate", ": FAILED!",
+# "=> (item=...)" and "=> {result}"
+_RESULT_RE = re.compile(
+    r'^(?P<status>ok|changed|skipping|failed|fatal|unreachable): '
+    r'\[(?P<host>[^\]]+)\]'
+    r'(?: -> \S+)?'
+    r'(?:: (?P<error>[A-Z]+)!)?'
+    r'(?: => \(item=(?P<item>.*?)\))?'
+    r'(?:$|\s|:| =>)')
+
+_IGNORING_RE = re.compile(r'^\.\.\.ignoring\s*$')
+
+# host : ok=1 changed=0 unreachable=0 failed=0 ...
+_HOST_STATS_RE = re.compile(r'^(?P<host>\S+)\s*:\s+(?P<stats>ok=\d+.*)$')
+_STAT_RE = re.compile(r'(\w+)=(\d+)')
+
+
+class ProgressParser(object):
+    """Incrementally parses the output of ansible-playbook
+
+    Output is passed to feed() as it arrives, in arbitrary pieces, and the
+    events from each complete line are returned.  Call finish() once the
+    output ends to parse any final unterminated line.
+    """
+
+    def __init__(self):
+        self.play = None
+        self.task = None
+        self.in_recap = False
+        self.last_failed = None
+        self.partial = b''
+
+    def feed(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+
+        events = []
+        for line in lines:
+            event = self.parse_line(line.decode('utf-8', 'replace'))
+            if event:
+                events.append(event)
+        return events
+
+    def finish(self):
+        line = self.partial
+        self.partial = b''
+        event = self.parse_line(line.decode('utf-8', 'replace'))
+        return [event] if event else []
+
+    def parse_line(self, line):
+        """Return the event for a single line of output, if any"""
+        line = _COLOR_RE.sub('', line).strip()
+        if not line:
+            return
+
+        match = _PLAY_RE.match(line)
+        if match:
+            self.play = match.group('name')
+            self.task = None
+            self.in_recap = False
+            return self._event(PLAY, name=self.play)
+
+        match = _TASK_RE.match(line)
+        if match:
+            self.task = match.group('name')
+            self.last_failed = None
+            return self._event(TASK, name=self.task, play=self.play)
+
+        if _RECAP_RE.match(line):
+            self.in_recap = True
+            return
+
+        if self.in_recap:
+            match = _HOST_STATS_RE.match(line)
+            if match:
+                event = self._event(RECAP, host=match.group('host'))
+                for (key, value) in _STAT_RE.findall(match.group('stats')):
+                    event[key] = int(value)
+                return event
+            return
+
+        match = _RESULT_RE.match(line)
+        if match:
+            status = match.group('status')
+            if match.group('error') == 'UNREACHABLE':
+                status = 'unreachable'
+            elif status == 'fatal':
+                status = 'failed'
+
+            # Ansible 2 shows delegation as [host -> delegate]
+            host = match.group('host').split(' -> ')[0]
+            self.last_failed = host if status == 'failed' else None
+
+            event = self._event(RESULT, host=host, status=status,
+                                task=self.task)
+            if match.group('item') is not None:
+                event['item'] = match.group('item')
+            return event
+
+        if _IGNORING_RE.match(line) and self.last_failed:
+            host = self.last_failed
+            self.last_failed = None
+            return self._event(IGNORED, host=host, task=self.task)
+
+    @staticmethod
+    def _event(event, **kwargs):
+        kwargs['event'] = event
+        kwargs['timestamp'] = int(time.time())
+        return kwargs
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import OrderedDict
+import collections
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
@@ -27,13 +27,18 @@ import os
 from oslo_config import cfg
 from oslo_log import log as logging
 from promise import Promise
+import six
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
+from . import play_index
+from . import play_progress
 from . import plays
 from . import policy
+from . import scheduler
 from . import socketio
 from . import sshagent
 
@@ -74,9 +79,13 @@ STATIC_PLAYBOOKS = {
     OS_PROVISION_PLAYBOOK,
     PRE_DEPLOYMENT_PLAYBOOK}
 
-# TODO(gary) Consider creating a function to archive old plays (create a tgz
-#    of log and metadata).  This feature is not mentioned anywhere, but the
-#    old version did something similar to this
+# Shortest time to wait between checks of the log of a running play for
+# more output
+MIN_POLL_INTERVAL = 0.01
+
+# Functions to call when a playbook completes successfully, keyed by the
+# basename of the playbook.  See add_completion_hook
+_completion_hooks = collections.defaultdict(list)
 
 
 @bp.route("/api/v2/playbooks")
@@ -206,6 +215,13 @@ def run_playbook_rest(name):
            "encryption-key": "admin123456!",
        }
 
+    Plays are started immediately unless that would exceed the limits set by
+    the ``max_running_plays``, ``playbook_limits`` and ``playbook_groups``
+    settings in the ``[plays]`` section of the config file, such as when
+    ``site`` is already running.  Such plays are queued until the plays
+    preventing them from running finish, and their metadata indicates their
+    position in the queue.  Queued plays can be cancelled by deleting them.
+
     **Changes for v2**:
 
     * No mapping between '_' and '-' will take place in playbook names; the
@@ -238,14 +254,6 @@ def run_playbook(name, payload=None, play_id=None):
 
     args = get_command_args(payload, cwd)
 
-    # Prevent some special playbooks from multiple concurrent invocations
-    if name in (SITE_PLAYBOOK, CONFIG_PROCESSOR_RUN_PLAYBOOK,
-                CONFIG_PROCESSOR_CLEAN_PLAYBOOK, READY_DEPLOYMENT_PLAYBOOK,
-                OS_PROVISION_PLAYBOOK, WIPE_DISKS_PLAYBOOK,
-                ARDANA_GEN_HOSTS_FILE_PLAYBOOK, MONASCA_DEPLOY_PLAYBOOK):
-        if get_running_playbook_id(name):
-            abort(403, "Already running")
-
     try:
         name += ".yml"
         for filename in os.listdir(cwd):
@@ -266,11 +274,11 @@ def run_playbook(name, payload=None, play_id=None):
         if vault_file:
             cleanup = functools.partial(remove_temp_vault_pwd_file, vault_file)
 
-        return start_playbook(name,
-                              args=args,
-                              cwd=cwd,
-                              cleanup=cleanup,
-                              play_id=play_id)
+        return schedule_playbook(name,
+                                 args=args,
+                                 cwd=cwd,
+                                 cleanup=cleanup,
+                                 play_id=play_id)
 
     except OSError as e:
         LOG.exception(e)
@@ -372,7 +380,70 @@ def remove_temp_vault_pwd_file(filename):
         pass
 
 
-def start_playbook(playbook, args={}, cwd=None, cleanup=None, play_id=None):
+def schedule_playbook(playbook, args={}, cwd=None, cleanup=None,
+                      play_id=None):
+    # Start the playbook once the scheduler permits it to run.  Plays that
+    # cannot start immediately are queued, and their metadata is recorded
+    # with the queued flag set until they start
+
+    submit_time = int(1000 * time.time())
+    id = play_id if play_id is not None else str(submit_time)
+    promise = Promise()
+
+    play = {
+        "id": id,
+        "startTime": submit_time,
+        "commandString": ' '.join(build_command_line(
+            'ansible-playbook', playbook, scrub_passwords(args))),
+        'killed': False,
+        'playbook': playbook
+    }
+
+    def start():
+        try:
+            start_playbook(playbook, args, cwd, cleanup, id, promise)
+        except Exception as e:
+            # A play that fails to start immediately fails the request, but
+            # one that was queued can only be marked as having failed
+            if play.get('queued'):
+                on_cancel(e)
+            raise
+
+    def on_queued():
+        play['queued'] = True
+        try:
+            plays.write_metadata(play)
+        except (IOError, OSError) as e:
+            LOG.exception(e)
+            abort(500, "Unable to write metadata")
+
+    def on_cancel(reason=None):
+        play.pop('queued', None)
+        play['endTime'] = int(1000 * time.time())
+        play['killed'] = reason is None
+        try:
+            plays.write_metadata(play)
+        except (IOError, OSError):
+            LOG.exception("Unable to write metadata of play %s", id)
+
+        if cleanup:
+            cleanup()
+
+        # Notify listeners that joined the play while it was queued
+        if reason is None:
+            socketio.emit("killed", room=id)
+        socketio.emit("end", room=id)
+        socketio.close_room(id)
+        promise.do_reject(reason or Exception("Play %s cancelled" % id))
+
+    scheduler.submit(id, playbook, start, on_queued, on_cancel)
+
+    return {"id": id,
+            "url": url_for('plays.get_play', id=id),
+            "promise": promise}
+
+
+def start_playbook(playbook, args, cwd, cleanup, id, promise):
 
     # Create processes with the subprocess module rather
     # than using a more advanced mechanism like Celery
@@ -384,7 +455,6 @@ def start_playbook(playbook, args={}, cwd=None, cleanup=None, play_id=None):
     cmd = build_command_line('ansible-playbook', playbook, args)
 
     start_time = int(1000 * time.time())
-    id = play_id if play_id is not None else str(start_time)
 
     # Prevent python programs from buffering their output.  Buffering causes
     # the output to be delayed, making it more difficult to determine the
@@ -395,15 +465,22 @@ def start_playbook(playbook, args={}, cwd=None, cleanup=None, play_id=None):
     env['NOTIFY_URL'] = CONF.url
     env.update(sshagent.sshagent.get_instance().agent_env)
 
-    if sys.version_info.major < 3:
-        ps = subprocess.Popen(cmd, cwd=cwd, env=env,
-                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    else:
+    # The output is written to the log by the process itself rather than
+    # piped through this one, and the process is run in a session of its own,
+    # so that the play is unaffected if this service restarts.  The shell
+    # records the exit code of the play for the same reason (see PlayProcess)
+    log_file = get_log_file(id)
+    rc_file = plays.get_play_file(id, plays.RC_EXT)
+    if os.path.exists(rc_file):
+        os.unlink(rc_file)
+    offset = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+
+    cmd = ['sh', '-c', '"$@"; rc=$?; echo $rc > "$0"; exit $rc',
+           rc_file] + cmd
+    with open(log_file, 'ab') as f:
         ps = subprocess.Popen(cmd, cwd=cwd, env=env,
-                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                              universal_newlines=True)
-
-    meta_file = plays.get_metadata_file(id)
+                              stdout=f, stderr=subprocess.STDOUT,
+                              preexec_fn=os.setsid)
 
     scrubbed = scrub_passwords(args)
     logged_cmd = build_command_line('ansible-playbook', playbook, scrubbed)
@@ -417,29 +494,111 @@ def start_playbook(playbook, args={}, cwd=None, cleanup=None, play_id=None):
         'playbook': playbook
     }
     try:
-        with open(meta_file, "w") as f:
-            json.dump(play, f)
+        plays.write_metadata(play)
+        plays.register_running(id, {
+            'pid': ps.pid,
+            'playbook': playbook,
+            'vaultFile': args.get('--vault-password-file')})
     except (IOError, OSError) as e:
         LOG.exception(e)
         abort(500, "Unable to write metadata")
 
-    # Create a promise to be returned for clients interested in the promise
-    promise = Promise()
+    follow_play(id, playbook, PlayProcess(id, ps.pid, ps), cleanup, promise,
+                offset)
+
+    LOG.debug("Spawned thread with play %s", id)
 
-    # Use a thread to read the pipe to avoid blocking this process.  Since
-    # the thread will interact with socketio, we have to use that library's
-    # function for creating threads
+
+def follow_play(id, playbook, process, cleanup, promise, offset=0):
+    # Use a thread to follow the output of the play to avoid blocking this
+    # process.  Since the thread will interact with socketio, we have to use
+    # that library's function for creating threads.  The events of any
+    # earlier playbooks of the same play (such as a chain of playbooks run
+    # under one play id, or a play that is being reattached) carry over, so
+    # that clients that join get the last event of each of them
     running = plays.get_running_plays()
+    last_events = collections.OrderedDict(plays.get_last_events(id))
     running[id] = {'task': socketio.start_background_task(monitor_output,
-                                                          ps, id, cleanup,
-                                                          promise),
-                   'playbook': playbook}
+                                                          process, id,
+                                                          cleanup, promise,
+                                                          offset),
+                   'playbook': playbook,
+                   'last_events': last_events}
 
-    LOG.debug("Spawned thread with play %s", id)
 
-    return {"id": id,
-            "url": url_for('plays.get_play', id=id),
-            "promise": promise}
+def reattach_plays():
+    """Resume following the plays started by an earlier run of the service
+
+    Plays that were still running when the service stopped continue to
+    write their logs, and are followed again as though they had been started
+    by this run.  Plays that finished in the meantime are completed as soon
+    as their remaining output has been processed.
+    """
+    for id, info in plays.read_running_registry().items():
+        if id in plays.get_running_plays():
+            continue
+
+        LOG.info("Reattaching to play %s", id)
+        cleanup = None
+        if info.get('vaultFile'):
+            cleanup = functools.partial(remove_temp_vault_pwd_file,
+                                        info['vaultFile'])
+
+        scheduler.add_running(id, info.get('playbook'))
+
+        # The progress of the play is parsed again from the start of its log,
+        # since the state of the parser was lost
+        follow_play(id, info.get('playbook'), PlayProcess(id, info['pid']),
+                    cleanup, Promise(), offset=0)
+
+    # Queued plays cannot be resumed, since their requests are gone
+    now = int(1000 * time.time())
+    queued, total = play_index.query(status=play_index.QUEUED)
+    for play in queued:
+        LOG.info("Abandoning play %s that was queued", play['id'])
+        play.pop('queued', None)
+        play['endTime'] = now
+        try:
+            plays.write_metadata(play)
+        except (IOError, OSError):
+            LOG.exception("Unable to write metadata of play %s", play['id'])
+
+
+class PlayProcess(object):
+    """The process running a play
+
+    Plays are run by a shell that writes the exit code of ansible-playbook to
+    the play's .rc file.  For plays started by this run of the service, the
+    process is also a child that must be waited for; those started by an
+    earlier run can only be followed by their pid and that file.
+    """
+
+    def __init__(self, id, pid, popen=None):
+        self.id = id
+        self.pid = pid
+        self.popen = popen
+
+    def poll(self):
+        """Return True if the process has finished"""
+        if self.popen is not None:
+            return self.popen.poll() is not None
+        return not plays.is_running(self.pid) or \
+            self.read_returncode() is not None
+
+    def read_returncode(self):
+        try:
+            with open(plays.get_play_file(self.id, plays.RC_EXT)) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return None
+
+    @property
+    def returncode(self):
+        # Processes that were killed do not get to write the file
+        code = self.read_returncode()
+        if code is None and self.popen is not None:
+            code = self.popen.returncode
+        return code
 
 
 def build_command_line(command, playbook=None, args={}):
@@ -517,51 +676,74 @@ def scrub_passwords(args):
     return scrubbed
 
 
-def monitor_output(ps, id, cleanup, promise):
-    # Monitor the piped output of the running process, forwarding each message
-    # received to listening socketIO clients
+def monitor_output(process, id, cleanup, promise, offset=0):
+    # Follow the log of the running process from the given offset,
+    # forwarding the output written to it to listening socketIO clients
 
     log_file = get_log_file(id)
+    progress_file = plays.get_play_file(id, plays.PROGRESS_EXT)
+    interval = max(CONF.plays.log_batch_interval_ms / 1000.0,
+                   MIN_POLL_INTERVAL)
+
+    with open(log_file, 'rb') as f, \
+            open(progress_file, 'ab' if offset else 'wb') as progress:
+        f.seek(offset)
+        forwarder = LogForwarder(id, offset, progress)
+        plays.get_running_plays().get(id, {})['forwarder'] = forwarder
+
+        pending = b''
+        while True:
+            # Check for the end of the process before reading, so that all
+            # of its output is read once it has ended
+            finished = process.poll()
+            data = f.read(CONF.plays.log_batch_bytes)
+            if not data:
+                if finished:
+                    break
+                socketio.sleep(interval)
+                continue
+
+            # Hold back any partial line until the rest of it is written, so
+            # that lines (and multi-byte characters) are not split between
+            # batches
+            data = pending + data
+            end = data.rfind(b'\n') + 1
+            if end or len(data) < CONF.plays.log_batch_bytes:
+                pending = data[end:]
+                data = data[:end]
+            else:
+                pending = b''
 
-    with open(log_file, 'a') as f:
-        # Reading subprocess line by line varies in python2 vs python3.  See
-        # https://stackoverflow.com/a/17698359/190597
-        #
-        # Can use this in python3: for line in ps.stdout:
-        if sys.version_info.major < 3:
-            with ps.stdout:
-                for line in iter(ps.stdout.readline, b''):
-                    if isinstance(line, bytes):
-                        f.write(line)
-                    else:
-                        f.write(line.encode("utf-8"))
-                    f.flush()
-                    socketio.emit("log", line, room=id)
-        else:
-            for line in ps.stdout:
-                f.write(line)
-                f.flush()
-                socketio.emit("log", line, room=id)
+            if data:
+                forwarder.send(data)
+
+        if pending:
+            forwarder.send(pending)
+        forwarder.close()
 
     # Notify listeners that the process has ended
+    running = plays.get_running_plays()
+    if running.get(id, {}).get('killed'):
+        socketio.emit("killed", room=id)
     socketio.emit("end", room=id)
     socketio.close_room(id)
-    ps.wait()
 
     # Update the metadata now that the process has finished.
-    meta_file = plays.get_metadata_file(id)
-    running = plays.get_running_plays()
-    running.pop(id, None)
+    playbook = running.pop(id, {}).get('playbook')
+    scheduler.finished(id)
+    returncode = process.returncode
 
     try:
-        with open(meta_file) as f:
-            play = json.load(f)
-
+        play = plays.read_metadata(id)
         play['endTime'] = int(1000 * time.time())
-        play['code'] = ps.returncode
+        play['code'] = returncode
         play['logSize'] = os.stat(log_file).st_size
-        with open(meta_file, "w") as f:
-            json.dump(play, f)
+        plays.write_metadata(play)
+        plays.unregister_running(id)
+
+        rc_file = plays.get_play_file(id, plays.RC_EXT)
+        if os.path.exists(rc_file):
+            os.unlink(rc_file)
 
         # Call the cleanup function passed in, if any
         if cleanup:
@@ -570,12 +752,84 @@ def monitor_output(ps, id, cleanup, promise):
     except (IOError, OSError):
         pass
 
-    if ps.returncode == 0:
+    if returncode == 0:
+        run_completion_hooks(playbook, id)
         promise.do_resolve('Success')
     else:
         promise.do_reject(Exception("Play %s failed" % id))
 
 
+class LogForwarder(object):
+    """Sends the output of a play to its socketIO room
+
+    The output is read from the play's log in batches of up to
+    CONF.plays.log_batch_bytes, since sending every line individually
+    overwhelms the event loop (and the clients) when playbooks produce
+    hundreds of thousands of lines.  Each batch is sent along with the
+    offset in the log at which the next batch starts, so that clients can
+    resume from that point (see on_join).
+
+    If a progress file is given, the output is also parsed into progress
+    events (see play_progress), which are appended to that file as json lines
+    and sent as ``progress`` messages with each batch, along with the number
+    of events written so far.
+    """
+
+    def __init__(self, id, offset=0, progress=None):
+        self.id = id
+        self.offset = offset
+        self.progress = progress
+        self.parser = play_progress.ProgressParser() if progress else None
+        self.num_events = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def send(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        # The lock is held while sending so that clients cannot join in
+        # between updating the offset and sending the batch
+        with self.lock:
+            self.offset += len(data)
+            socketio.emit("log", data.decode('utf-8', 'replace'),
+                          self.offset, room=self.id)
+            if self.parser:
+                self._send_events(self.parser.feed(data))
+
+    def _send_events(self, events):
+        if not events:
+            return
+
+        self.progress.write(b''.join(
+            json.dumps(e).encode('utf-8') + b'\n' for e in events))
+        self.progress.flush()
+        self.num_events += len(events)
+        socketio.emit("progress", events, self.num_events, room=self.id)
+
+    def close(self):
+        with self.lock:
+            if self.parser:
+                self._send_events(self.parser.finish())
+            self.closed = True
+
+
+def add_completion_hook(playbook, hook):
+    # Register a function to be called with the play id whenever the given
+    # playbook completes successfully.  Hooks are called from the thread that
+    # monitors the play, so any lengthy work should be started in a background
+    # task
+    _completion_hooks[plays.basename(playbook)].append(hook)
+
+
+def run_completion_hooks(playbook, id):
+    for hook in _completion_hooks.get(plays.basename(playbook), []):
+        try:
+            hook(id)
+        except Exception:
+            LOG.exception("Completion hook for play %s failed", id)
+
+
 @socketio.on('connect')
 def on_connect():
     LOG.info("Client connected. sid: %s", request.sid)
@@ -587,69 +841,112 @@ def on_disconnect():
 
 
 @socketio.on('join')
-def on_join(id):
-
-    id = str(id)
-    logfile = get_log_file(id)
-
-    # replay existing log as a single message before joining the room
-    LOG.info("Replaying logs from %s", logfile)
-    with open(logfile) as f:
-        lines = f.readlines()
-
-    emit("log", ''.join(lines))
+def on_join(data):
+    """Replay the log and events of a play, and then follow the live output
+
+    data is either the play id or an object with the play ``id`` and the
+    byte ``offset`` in the log from which to replay, normally the offset
+    received with the last ``log`` message before a reconnect.  The log is
+    replayed in bounded chunks, each sent with the offset following it, just
+    like the live messages.  Live messages are only sent after the replay has
+    caught up with them, so none are missed or duplicated.
+
+    A client that joins a play that is waiting in the queue is sent a
+    ``queued`` message with the play's queue position, and then follows the
+    play's output from the start once it starts.
+    """
 
-    # Replay existing events before joinging the room
-    events_file = get_events_file(id)
-    if os.path.exists(events_file):
-        LOG.info("Replaying events from %s", events_file)
+    offset = 0
+    if isinstance(data, dict):
+        id = str(data.get('id'))
         try:
-            with open(events_file) as f:
-                events = json.load(f)
-
-            # Avoid sending unnecessary events: send only the last event for
-            # each playbook
-            last_events = OrderedDict()
-            for e in events:
-                last_events[e['playbook']] = e['event']
-
-            for playbook, event in last_events.items():
-                emit(event, playbook)
-
-        except IOError:
+            offset = max(0, int(data.get('offset') or 0))
+        except (TypeError, ValueError):
             pass
+    else:
+        id = str(data)
 
-    # It is possible that in the short gap between reading the last line
-    # in the logfile and the upcoming logic that a message may be generated by
-    # the process.  In that case, the message may not be sent to the caller
-    # (although it will still be logged).  If it is critical that absolutely no
-    # message ever be dropped, then some thread synchronization needs to be
-    # introduced (between this thread and the one reading the pipe).  That
-    # would come at a cost in code complexity and performance.
-    running = plays.get_running_plays()
-    if id in running:
-        LOG.info("Client joining room %s", id)
+    # A queued play has no output yet.  Its first output is sent to the room
+    # once it starts
+    position = scheduler.get_queue_positions().get(id)
+    if position is not None:
+        LOG.info("Client joining room %s of queued play", id)
         join_room(id)
-    else:
-        emit("end")
+        emit("queued", position)
+        return
+
+    LOG.info("Replaying logs of play %s from offset %d", id, offset)
+
+    # Replay existing events before joining the room.  Avoid sending
+    # unnecessary events: send only the last event for each playbook
+    last_events = plays.get_last_events(id)
+    if last_events:
+        LOG.info("Replaying events of play %s", id)
+        for playbook, event in list(last_events.items()):
+            emit(event, playbook)
+
+    forwarder = plays.get_running_plays().get(id, {}).get('forwarder')
+    if forwarder:
+        # Replay up to the end of what the forwarder has sent so far, and then
+        # join the room while holding its lock so that no batch can be sent
+        # in between.  Each pass normally leaves less to catch up on
+        while True:
+            with forwarder.lock:
+                if forwarder.closed:
+                    break
+                if offset >= forwarder.offset:
+                    LOG.info("Client joining room %s", id)
+                    join_room(id)
+                    return
+                end = forwarder.offset
+
+            reached = replay_log(id, offset, end)
+            if reached == offset:
+                # The log cannot be read, so just follow the live output
+                join_room(id)
+                return
+            offset = reached
+
+    # The play has finished
+    replay_log(id, offset)
+    emit("end")
+
+
+def replay_log(id, offset, end=None):
+    # Send the log of the play from offset up to end (or the end of the log)
+    # in chunks, each ending at a line boundary where possible.  Returns the
+    # offset reached
+    chunk_size = CONF.plays.log_batch_bytes
+    try:
+        with plays.open_play_file(id, plays.LOG_EXT) as f:
+            f.seek(offset)
+
+            # Compressed logs are only read forwards, so any partial line at
+            # the end of a chunk is kept for the next one
+            pending = b''
+            while True:
+                limit = chunk_size if end is None \
+                    else min(chunk_size, end - offset)
+                data = pending + f.read(max(0, limit - len(pending)))
+                pending = b''
+                if not data:
+                    break
+
+                # Avoid splitting lines (and multi-byte characters) when more
+                # data may follow
+                if len(data) >= limit:
+                    newline = data.rfind(b'\n')
+                    if 0 <= newline < len(data) - 1:
+                        pending = data[newline + 1:]
+                        data = data[:newline + 1]
+
+                offset += len(data)
+                emit("log", data.decode('utf-8', 'replace'), offset)
+    except IOError:
+        LOG.info("Unable to read log of play %s", id)
+
+    return offset
 
 
 def get_log_file(id):
     return os.path.join(CONF.paths.log_dir, str(id) + ".log")
-
-
-def get_events_file(id):
-    return os.path.join(CONF.paths.log_dir, str(id) + ".events")
-
-
-def get_running_playbook_id(playbook):
-    # Determine whether the given playbook is running by looking through the
-    # plays dictionary
-
-    # Just look at the basename of the playbook (without the the .yml suffix)
-    wanted = plays.basename(playbook)
-
-    running = plays.get_running_plays()
-    for id, play in running.items():
-        if plays.basename(play['playbook']) == wanted:
-            return id
@@ -12,26 +12,51 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 from flask import abort
 from flask import Blueprint
 from flask import jsonify
 from flask import request
+from flask import Response
+from flask import safe_join
 from flask import send_from_directory
+from flask import url_for
+import gzip
 import json
 import os
 from oslo_config import cfg
 from oslo_log import log as logging
 import signal
-import sys
+import tempfile
+import threading
 import time
 
+from . import play_index
 from . import policy
+from . import scheduler
+from . import socketio
 
 LOG = logging.getLogger(__name__)
 bp = Blueprint('plays', __name__)
 CONF = cfg.CONF
 
 META_EXT = ".json"
+LOG_EXT = ".log"
+EVENTS_EXT = ".events"
+PROGRESS_EXT = ".progress"
+
+# Exit code of a play, written by the shell that runs it
+RC_EXT = ".rc"
+
+# File in the log dir recording the plays that are running, so that they
+# can be followed again after the service restarts
+RUNNING_FILE = "running-plays"
+
+# Suffix of play files that have been compressed by the archiver
+ARCHIVE_EXT = ".gz"
+
+# Size of the blocks in which portions of logs are read
+LOG_BLOCK_SIZE = 64 * 1024
 
 # Functions to deal with "plays".  Every time an ansible playbook is run,
 # a play is created to track the progress and output of the run.
@@ -39,17 +64,34 @@ META_EXT = ".json"
 # Dictionary of all running plays
 plays = {}
 
+# Ids of the plays being killed
+_killing = set()
+
+# Time in seconds between checks of whether a play being killed has ended
+KILL_INTERVAL = 0.5
+
+_registry_lock = threading.Lock()
+
 
 @bp.route("/api/v2/plays/<id>/log")
 @policy.enforce('lifecycle:get_play')
 def get_log(id):
     """Returns the log for the given ansible play.
 
-    This works on both live and finished plays.
+    This works on both live and finished plays, including those whose logs
+    have been archived.  The whole log is returned unless a portion of it is
+    requested, either with a standard ``Range`` header or with the ``tail``
+    and ``since`` query parameters (archived logs support only the latter).
+    When either of these is given, the ``X-Log-Offset`` header contains the
+    size of the log at the time of the request, which can be passed as
+    ``since`` in the next request in order to fetch only the output added
+    after it.
 
     .. :quickref: Play; Returns the log for the given ansible play
 
     :param id: play id
+    :query int tail: Return at most this many lines from the end of the log
+    :query int since: Return the log from this byte offset onwards
 
     **Example Request**:
 
@@ -64,10 +106,139 @@ def get_log(id):
        HTTP/1.1 200 OK
 
        ... log file from the given play ...
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       GET /api/v2/plays/345835/log?since=48210 HTTP/1.1
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: text/plain
+       X-Log-Offset: 51377
+
+       ... log output added after offset 48210 ...
     """
-    # For security, send_from_directory avoids sending any files
-    # outside of the specified directory
-    return send_from_directory(get_log_dir_abs(), str(id) + ".log")
+    tail = request.args.get("tail", type=_non_negative_int)
+    since = request.args.get("since", type=_non_negative_int)
+
+    if tail is None and since is None:
+        if os.path.exists(get_play_file(id, LOG_EXT)):
+            # For security, send_from_directory avoids sending any files
+            # outside of the specified directory.  Being conditional, it also
+            # handles Range requests
+            return send_from_directory(get_log_dir_abs(), str(id) + LOG_EXT,
+                                       conditional=True)
+
+        # The log has been archived, so send it decompressed
+        since = 0
+
+    try:
+        with open_play_file(id, LOG_EXT) as f:
+            end = get_size(f)
+            start = min(since or 0, end)
+            if tail is not None:
+                if isinstance(f, gzip.GzipFile):
+                    tail_start = find_tail_start_forward(f, end, tail)
+                else:
+                    tail_start = find_tail_start(f, end, tail)
+                start = max(start, tail_start)
+    except IOError:
+        abort(404)
+
+    return Response(read_range(id, start, end),
+                    mimetype='text/plain',
+                    headers={'X-Log-Offset': str(end)})
+
+
+def find_tail_start(f, end, lines):
+    # Return the offset in the file at which the last given number of lines
+    # before end begin, reading backwards from end in blocks
+    if lines == 0:
+        return end
+
+    count = 0
+    pos = end
+    while pos > 0:
+        size = min(LOG_BLOCK_SIZE, pos)
+        pos -= size
+        f.seek(pos)
+        block = f.read(size)
+
+        i = len(block)
+        while True:
+            i = block.rfind(b'\n', 0, i)
+            if i < 0:
+                break
+
+            # The newline terminating the last line does not start a line
+            if pos + i == end - 1:
+                continue
+
+            count += 1
+            if count == lines:
+                return pos + i + 1
+
+    return 0
+
+
+def find_tail_start_forward(f, end, lines):
+    # Equivalent of find_tail_start for compressed files, which can only be
+    # read efficiently from the beginning
+    if lines == 0:
+        return end
+
+    # Offsets of the starts of the last lines seen
+    starts = collections.deque([0], maxlen=lines + 1)
+    f.seek(0)
+    pos = 0
+    while pos < end:
+        block = f.read(min(LOG_BLOCK_SIZE, end - pos))
+        if not block:
+            break
+
+        i = block.find(b'\n')
+        while i >= 0:
+            starts.append(pos + i + 1)
+            i = block.find(b'\n', i + 1)
+        pos += len(block)
+
+    # The newline terminating the last line does not start a line
+    if starts and starts[-1] >= end:
+        starts.pop()
+
+    return starts[-lines] if len(starts) >= lines else 0
+
+
+def get_size(f):
+    # Return the size of the (possibly compressed) file's contents
+    try:
+        f.seek(0, os.SEEK_END)
+        return f.tell()
+    except (IOError, ValueError):
+        # Compressed files in python 2 cannot seek from the end
+        f.seek(0)
+        size = 0
+        for block in iter(lambda: f.read(LOG_BLOCK_SIZE), b''):
+            size += len(block)
+        return size
+
+
+def read_range(id, start, end):
+    # Generate the contents of the log between start and end in blocks
+    with open_play_file(id, LOG_EXT) as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(LOG_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
 
 
 @bp.route("/api/v2/plays")
@@ -75,12 +246,29 @@ def get_log(id):
 def get_plays():
     """Returns the metadata about all ansible plays.
 
-    The list can optionally be limited by specifying query parameters.
+    The list can optionally be limited by specifying query parameters.  Plays
+    are returned in order of their start time, newest first.  The total number
+    of plays matching the query (regardless of ``offset`` and ``maxNumber``) is
+    returned in the ``X-Total-Count`` header.
+
+    Plays that are waiting for others to finish before they can start (see
+    the ``max_running_plays``, ``playbook_limits`` and ``playbook_groups``
+    settings) have ``queued`` set, and their ``queuePosition``, starting at
+    1 for the next play to start.  Their ``startTime`` is the time at which
+    they were queued until they start.
 
     :query int maxNumber: Maximum number of plays to return
+    :query int offset: Number of matching plays to skip
     :query int maxAge: Maximum age in seconds
     :query boolean live: Whether to restrict results to running plays
     :query string playbook: Playbook name
+    :query string status: ``queued``, ``running``, ``succeeded``, ``failed``
+                          or ``killed``
+    :query int startedAfter: Only plays started at or after this time, in
+                             milliseconds since the epoch
+    :query int startedBefore: Only plays started before this time, in
+                              milliseconds since the epoch
+    :query string order: ``desc`` (default) or ``asc`` order of start time
 
     .. :quickref: Play; Returns the metadata about all ansible plays
 
@@ -120,58 +308,63 @@ def get_plays():
          }
        ]
     """
-    max_number = int(request.args.get("maxNumber", sys.maxsize))
-    max_age = int(request.args.get("maxAge", sys.maxsize))
+    # Invalid numbers are ignored, as though they had not been given
+    max_number = request.args.get("maxNumber", type=_non_negative_int)
+    offset = request.args.get("offset", 0, type=_non_negative_int)
+    max_age = request.args.get("maxAge", type=int)
+    started_after = request.args.get("startedAfter", type=int)
+    started_before = request.args.get("startedBefore", type=int)
+
     live_only = request.args.get("live") == "true"
     want_playbook = request.args.get("playbook")
-
-    if want_playbook:
-        want_playbook = basename(want_playbook)
-
-    earliest_end_time = int(time.time()) - max_age
-
-    results = []
-    meta_files = []
-    try:
-        if live_only:
-            for id, play in get_running_plays().items():
-                if not want_playbook or \
-                        basename(play['playbook']) == want_playbook:
-                    meta_files.append(get_metadata_file(id))
-
-        else:
-            for filename in os.listdir(CONF.paths.log_dir):
-                if not filename.endswith(META_EXT):
-                    continue
-
-                path = os.path.join(CONF.paths.log_dir, filename)
-                meta_files.append(path)
-
-        for path in meta_files:
-
-            with open(path) as f:
-                play = json.load(f)
-
-            end_time = play.get('endTime')
-
-            if live_only and end_time:
-                continue
-
-            if end_time and end_time < earliest_end_time:
-                continue
-
-            if want_playbook and \
-                    want_playbook != basename(play.get('playbook')):
-                continue
-
-            results.append(play)
-
-            if len(results) >= max_number:
-                break
-    except IOError:
-        pass
-
-    return jsonify(results)
+    order = request.args.get("order", "desc")
+    status = request.args.get("status")
+
+    if status and status not in (play_index.QUEUED, play_index.RUNNING,
+                                 play_index.SUCCEEDED, play_index.FAILED,
+                                 play_index.KILLED):
+        abort(400, "Invalid status %s" % status)
+    if order not in ("asc", "desc"):
+        abort(400, "Invalid order %s" % order)
+
+    # Restrict live results to the plays being monitored by this process,
+    # since the metadata of plays orphaned by a restart is never completed
+    ids = None
+    if live_only:
+        ids = list(get_running_plays())
+        status = play_index.RUNNING
+
+    # Times in the metadata are in milliseconds
+    min_end_time = None
+    if max_age is not None:
+        min_end_time = int(1000 * (time.time() - max_age))
+
+    results, total = play_index.query(playbook=want_playbook,
+                                      status=status,
+                                      ids=ids,
+                                      min_end_time=min_end_time,
+                                      started_after=started_after,
+                                      started_before=started_before,
+                                      offset=offset,
+                                      limit=max_number,
+                                      ascending=(order == "asc"))
+
+    add_queue_positions(results)
+    return jsonify(results), 200, {'X-Total-Count': str(total)}
+
+
+def add_queue_positions(results):
+    positions = scheduler.get_queue_positions()
+    for play in results:
+        if play.get('queued'):
+            play['queuePosition'] = positions.get(str(play['id']))
+
+
+def _non_negative_int(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
 
 
 @bp.route("/api/v2/plays/<id>")
@@ -209,7 +402,18 @@ def get_play(id):
          "id": 3587323,
          "startTime": 1502161460385
        }
+
+    A play that is queued has ``queued`` set and its ``queuePosition``, as
+    described for ``GET /api/v2/plays``.
     """
+    if str(id) in scheduler.get_queue_positions():
+        try:
+            play = read_metadata(id)
+        except IOError:
+            abort(404)
+        add_queue_positions([play])
+        return jsonify(play)
+
     return send_from_directory(get_log_dir_abs(), str(id) + META_EXT)
 
 
@@ -221,11 +425,42 @@ def is_running(pid):
         return False
 
 
+def is_group_running(pid):
+    # Plays run in a process group led by their process, which lasts as long
+    # as any of the processes that ansible forks.  Plays started before that
+    # was the case are only found by their own pid
+    try:
+        os.killpg(pid, 0)
+        return True
+    except OSError:
+        return is_running(pid)
+
+
+def signal_play(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        os.kill(pid, sig)
+
+
 @bp.route("/api/v2/plays/<id>", methods=['DELETE'])
 @policy.enforce('lifecycle:run_playbook')
 def kill_play(id):
     """Kills the play with the given id if it is still running
 
+    The play and all of the processes it has started are first interrupted,
+    which gives ansible the chance to shut down cleanly, and then killed if
+    they are still running after ``kill_grace_seconds`` (in the ``[plays]``
+    section of the config file).  This happens in the background: the play is
+    marked as killed immediately, and its ``endTime`` is set once all of its
+    processes have ended, at which point a ``killed`` message is sent to
+    socketIO clients that have joined the play.
+
+    A play that is queued is removed from the queue and recorded as having
+    been killed at once, so the response is ``200`` instead of ``202``.
+    Either way the body is a status string and ``Location`` refers to the
+    play.
+
     .. :quickref: Play; Kills the given play
 
     :param id: play id
@@ -240,54 +475,97 @@ def kill_play(id):
 
     .. sourcecode:: http
 
-       HTTP/1.1 200 OK
+       HTTP/1.1 202 ACCEPTED
        Content-Type: application/json
+       Location: http://localhost:9085/api/v2/plays/3587323
+
+       "Accepted"
+
+    :status 200: the play was queued, and has been removed from the queue
+    :status 202: the play is being killed
+    :status 404: the play does not exist
+    :status 410: the play is no longer running
     """
-    meta_file = get_metadata_file(id)
+    location = {'Location': url_for('plays.get_play', id=id)}
+    if scheduler.cancel(id):
+        return jsonify('Success'), 200, location
 
     try:
-        with open(meta_file) as f:
-            play = json.load(f)
-
+        play = read_metadata(id)
     except IOError:
         abort(404, "Unable to find play")
 
-    # play['pid'] is always an int, but cast it just to be safe
-    pid = int(play['pid'])
-    if not is_running(pid):
+    # play['pid'] is always an int, but cast it just to be safe.  Plays that
+    # were queued when the service stopped never started, and have no pid
+    pid = int(play.get('pid') or 0)
+    if not pid or play.get('endTime') or not is_group_running(pid):
         abort(410, 'Process is no longer running')
 
-    try:
-        tries = 5
-        # Use SIGINT to give the process a chance to shut itself down
-        while(is_running(pid) and tries > 0):
-            os.kill(pid, signal.SIGINT)
-            tries -= 1
-            time.sleep(0.5)
-
-        # It refuses to shut down, so use the big hammer (SIGKILL)
-        if is_running(pid):
-            os.kill(pid, signal.SIGKILL)
-
-            tries = 5
-            # Wait a little for the process to die
-            while(is_running(pid) and tries > 0):
-                tries -= 1
-                time.sleep(0.5)
+    if id in _killing:
+        return jsonify('Accepted'), 202, location
 
+    try:
+        signal_play(pid, signal.SIGINT)
     except OSError as e:
-        abort(404, "Unable to kill process %s" % e.message)
+        abort(404, "Unable to kill process %s" % e)
 
     play['killed'] = True
+    write_metadata(play)
 
-    # If the process has finally died, update the endTime
-    if not is_running(pid):
-        play['endTime'] = int(1000 * time.time())
+    running = plays.get(id)
+    if running is not None:
+        running['killed'] = True
 
-    with open(meta_file, "w") as f:
-        json.dump(play, f)
+    _killing.add(id)
+    socketio.start_background_task(finish_killing, id, pid)
+
+    return jsonify('Accepted'), 202, location
+
+
+def finish_killing(id, pid):
+    # Keep interrupting the play until its grace period expires, then kill
+    # it, and wait for all of its processes to end
+    try:
+        deadline = time.time() + CONF.plays.kill_grace_seconds
+        while is_group_running(pid) and time.time() < deadline:
+            socketio.sleep(KILL_INTERVAL)
+            if is_group_running(pid):
+                signal_play(pid, signal.SIGINT)
 
-    return jsonify('Success')
+        if is_group_running(pid):
+            LOG.info("Play %s did not stop when interrupted; killing it", id)
+            signal_play(pid, signal.SIGKILL)
+
+            deadline = time.time() + CONF.plays.kill_grace_seconds
+            while is_group_running(pid) and time.time() < deadline:
+                socketio.sleep(KILL_INTERVAL)
+
+    except OSError:
+        # The play ended between checking and signalling it
+        pass
+
+    finally:
+        _killing.discard(id)
+
+    if is_group_running(pid):
+        LOG.warning("Unable to kill play %s", id)
+        return
+
+    # Plays that are being followed are completed by their monitor once
+    # their output has been read, which sends the killed message along with
+    # the end of the play
+    if id in plays:
+        return
+
+    try:
+        play = read_metadata(id)
+        if not play.get('endTime'):
+            play['endTime'] = int(1000 * time.time())
+            write_metadata(play)
+    except (IOError, OSError):
+        LOG.exception("Unable to update metadata of play %s", id)
+
+    socketio.emit("killed", room=id)
 
 
 @bp.route("/api/v2/plays/<id>/events")
@@ -328,20 +606,227 @@ def get_events(id):
          }
        ]
     """
-    # For security, send_from_directory avoids sending any files
-    # outside of the specified directory
-    return send_from_directory(get_log_dir_abs(), str(id) + ".events",
-                               mimetype="application/json")
+    try:
+        return jsonify(read_events(id))
+    except IOError:
+        abort(404)
+
+
+@bp.route("/api/v2/plays/<id>/progress")
+@policy.enforce('lifecycle:get_play')
+def get_progress(id):
+    """Returns the progress events parsed from the output of an ansible play.
+
+    The output of each play is parsed into ``play``, ``task``, ``result``,
+    ``ignored`` and ``recap`` events (see play_progress), which are also sent
+    to socketIO clients that have joined the play in ``progress`` messages.
+    Each message carries the number of events sent so far, which can be given
+    as the ``offset`` in order to fetch only the events that followed it.
+    This works on both live and finished plays.
+
+    The ``timestamp`` of each event is the time at which it was parsed, in
+    seconds since the epoch like the events received from the callback
+    plugin (unlike the times of plays themselves, which are in milliseconds).
+
+    .. :quickref: Play; Returns the progress events of an ansible play
+
+    :param id: play id
+    :query int offset: Number of events to skip, i.e. only events after the
+                       first ``offset`` events are returned
+    :query string host: Only return the events of this host
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       GET /api/v2/plays/345835/progress HTTP/1.1
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       [
+         {
+           "event": "task",
+           "name": "NOV-CMP | start | Start nova-compute service",
+           "play": "NOV-CMP",
+           "timestamp": 1505151952
+         },
+         {
+           "event": "result",
+           "host": "ardana-cp1-comp0001-mgmt",
+           "status": "changed",
+           "task": "NOV-CMP | start | Start nova-compute service",
+           "timestamp": 1505151955
+         }
+       ]
+    """
+    offset = request.args.get("offset", 0, type=_non_negative_int)
+    host = request.args.get("host")
+
+    try:
+        with open_play_file(id, PROGRESS_EXT) as f:
+            lines = f.read().splitlines()
+    except IOError:
+        abort(404)
+
+    events = []
+    for line in lines[offset:]:
+        try:
+            event = json.loads(line.decode('utf-8'))
+        except ValueError:
+            # A batch of events may be in the middle of being written
+            continue
+        if host is None or event.get('host') == host:
+            events.append(event)
+
+    return jsonify(events)
 
 
 def get_metadata_file(id):
     return os.path.join(CONF.paths.log_dir, str(id) + META_EXT)
 
 
+def get_play_file(id, ext):
+    # For security, safe_join avoids referring to any files outside of the
+    # log dir
+    return safe_join(get_log_dir_abs(), str(id) + ext)
+
+
+def open_play_file(id, ext):
+    # Open the given file of a play for reading in binary mode, transparently
+    # decompressing it if it has been archived
+    path = get_play_file(id, ext)
+    try:
+        return open(path, 'rb')
+    except IOError:
+        if not os.path.exists(path + ARCHIVE_EXT):
+            raise
+        return gzip.open(path + ARCHIVE_EXT, 'rb')
+
+
+def append_event(id, event):
+    """Record an event of a play
+
+    Events are appended to the play's events file as json lines.  Each is
+    written with a single write to a file opened for appending, which the OS
+    performs atomically, so concurrent events need no locking and never
+    require the file to be rewritten.  The last event of each playbook of a
+    running play is also kept in memory for replaying to clients that join
+    (see get_last_events).
+    """
+    line = json.dumps(event).encode('utf-8') + b'\n'
+    fd = os.open(get_play_file(id, EVENTS_EXT),
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+    play = plays.get(str(id))
+    if play is not None:
+        play.setdefault('last_events', collections.OrderedDict())[
+            event['playbook']] = event['event']
+
+
+def read_events(id):
+    """Return the list of events recorded for a play
+
+    Events files written before events were stored as json lines hold a
+    single json array, which is still understood.
+    """
+    with open_play_file(id, EVENTS_EXT) as f:
+        data = f.read().decode('utf-8')
+
+    if data.lstrip().startswith('['):
+        return json.loads(data)
+
+    events = []
+    for line in data.splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            # An event may be in the middle of being written
+            pass
+    return events
+
+
+def get_last_events(id):
+    """Return an OrderedDict of the last event of each playbook of a play"""
+    play = plays.get(str(id))
+    if play is not None and 'last_events' in play:
+        return play['last_events']
+
+    last_events = collections.OrderedDict()
+    try:
+        for e in read_events(id):
+            last_events[e['playbook']] = e['event']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return last_events
+
+
+def read_metadata(id):
+    with open(get_metadata_file(id)) as f:
+        return json.load(f)
+
+
+def write_metadata(play):
+    # The metadata file is the authoritative record of the play; the index is
+    # updated from it for use by queries
+    with open(get_metadata_file(play['id']), "w") as f:
+        json.dump(play, f)
+
+    play_index.update(play)
+
+
 def get_running_plays():
     return plays
 
 
+def read_running_registry():
+    """Return the dict of play id to the details of each running play
+
+    The registry outlives the service, and so includes the plays that were
+    running when it last stopped.
+    """
+    try:
+        with open(os.path.join(CONF.paths.log_dir, RUNNING_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def register_running(id, info):
+    with _registry_lock:
+        registry = read_running_registry()
+        registry[str(id)] = info
+        _write_running_registry(registry)
+
+
+def unregister_running(id):
+    with _registry_lock:
+        registry = read_running_registry()
+        if registry.pop(str(id), None) is not None:
+            _write_running_registry(registry)
+
+
+def _write_running_registry(registry):
+    # Replace the file atomically so that it is never seen partially written
+    (fd, temp_path) = tempfile.mkstemp(dir=CONF.paths.log_dir,
+                                       prefix='.' + RUNNING_FILE)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(registry, f)
+        os.rename(temp_path, os.path.join(CONF.paths.log_dir, RUNNING_FILE))
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
 def basename(playbook):
     # Handle playbooks that are missing or None
     if not playbook:
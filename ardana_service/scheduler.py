@@ -0,0 +1,180 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Decides when plays may start.  A play is started immediately if that keeps
+# the number of running plays within the limits in the [plays] section of the
+# config file, and is otherwise queued until enough running plays finish:
+#
+#   max_running_plays  limits the number of plays running at once
+#   playbook_limits    limits the number of plays of individual playbooks
+#   playbook_groups    places playbooks into groups of which only one play
+#                      may run at a time
+#
+# Queued plays are started in the order in which they were submitted, except
+# that a play that may start is not held up by an earlier one that may not
+# (because its playbook or group is busy).
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import threading
+
+from . import play_index
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# Requests that are waiting to start, in order of submission
+_queue = []
+
+# Playbook names of the plays that have been started, keyed by play id
+_running = {}
+
+_lock = threading.Lock()
+
+
+class _Request(object):
+    def __init__(self, id, playbook, start, on_cancel):
+        self.id = str(id)
+        self.playbook = play_index.playbook_name(playbook)
+        self.start = start
+        self.on_cancel = on_cancel
+
+
+def submit(id, playbook, start, on_queued=None, on_cancel=None):
+    """Start a play now, or queue it if it would exceed any limit
+
+    start is called without arguments to start the play, either immediately
+    (in which case any exception it raises is propagated) or later from the
+    thread that calls finished().  on_queued is called while the scheduler is
+    locked if the play is queued, and an exception from it prevents the play
+    from being queued.  on_cancel is called if a queued play is cancelled.
+
+    Returns True if the play was started, or False if it was queued.
+    """
+    request = _Request(id, playbook, start, on_cancel)
+    with _lock:
+        # Queued plays are started as soon as they are able to, so a play
+        # that may start now is not held up by them
+        if not _can_start(request.playbook):
+            if on_queued:
+                on_queued()
+            _queue.append(request)
+            LOG.info("Queued play %s of %s at position %d", request.id,
+                     request.playbook, len(_queue))
+            return False
+
+        _running[request.id] = request.playbook
+
+    try:
+        start()
+    except Exception:
+        finished(request.id)
+        raise
+    return True
+
+
+def add_running(id, playbook):
+    """Record that a play which was not submitted is running
+
+    This accounts for plays started by an earlier run of the service.
+    """
+    with _lock:
+        _running[str(id)] = play_index.playbook_name(playbook)
+
+
+def finished(id):
+    """Record that a play has finished, and start any queued plays"""
+    with _lock:
+        _running.pop(str(id), None)
+        runnable = _take_runnable()
+        for request in runnable:
+            _running[request.id] = request.playbook
+
+    _start_all(runnable)
+
+
+def cancel(id):
+    """Remove a queued play from the queue
+
+    Returns True if the play was queued.
+    """
+    id = str(id)
+    with _lock:
+        for request in _queue:
+            if request.id == id:
+                _queue.remove(request)
+                break
+        else:
+            return False
+
+    LOG.info("Cancelled queued play %s", id)
+    if request.on_cancel:
+        try:
+            request.on_cancel()
+        except Exception:
+            LOG.exception("Failed to cancel play %s", id)
+    return True
+
+
+def get_queue_positions():
+    """Return a dict of the 1-based queue position of each queued play id"""
+    with _lock:
+        return dict((r.id, i + 1) for i, r in enumerate(_queue))
+
+
+def _can_start(playbook, running=None):
+    if running is None:
+        running = list(_running.values())
+
+    max_running = CONF.plays.max_running_plays
+    if max_running and len(running) >= max_running:
+        return False
+
+    limit = CONF.plays.playbook_limits.get(playbook)
+    if limit is not None and running.count(playbook) >= int(limit):
+        return False
+
+    group = CONF.plays.playbook_groups.get(playbook)
+    if group is not None:
+        for other in running:
+            if CONF.plays.playbook_groups.get(other) == group:
+                return False
+
+    return True
+
+
+def _take_runnable():
+    # Remove and return the queued requests that may start now, in order.
+    # Must be called with the lock held
+    running = list(_running.values())
+    runnable = []
+    for request in list(_queue):
+        if _can_start(request.playbook, running):
+            _queue.remove(request)
+            runnable.append(request)
+            running.append(request.playbook)
+    return runnable
+
+
+def _start_all(requests):
+    # Start requests taken from the queue, whose slots have already been
+    # reserved in _running
+    for request in requests:
+        LOG.info("Starting queued play %s of %s", request.id,
+                 request.playbook)
+        try:
+            request.start()
+        except Exception:
+            LOG.exception("Failed to start queued play %s", request.id)
+            finished(request.id)
@@ -14,19 +14,19 @@
 
 from flask import abort
 from flask import Blueprint
-from flask import copy_current_request_context
 from flask import jsonify
 from flask import request
+from flask import url_for
 import os
 from oslo_config import cfg
 from oslo_log import log as logging
-import time
-import yaml
 
 from . import model as model_api
 from . import playbooks
 from . import policy
 from . import versions
+from . import workflows
+from . import yaml_io
 
 LOG = logging.getLogger(__name__)
 
@@ -48,8 +48,17 @@ def add_server():
     - run the site playbook
     - run the monasca-deploy playbook
 
+    The steps are run as a workflow whose id is that of its plays.  Its
+    progress can be followed at ``/api/v2/workflows/<id>``, and if a step
+    fails the workflow can be resumed from that step with
+    ``/api/v2/workflows/<id>/resume``.
+
     .. :quickref: Server; Add compute node
 
+    Several compute nodes can be added at once by supplying a list of
+    `servers` instead of a single `server`.  They are all added to the model
+    in a single commit, and each playbook is run once for all of them.
+
     **Example Request**:
 
     The request contains two objects: a `server` object containing the
@@ -91,170 +100,64 @@ def add_server():
     playbooks, and it was *always* being supplied by the callers (because it
     makes no sense NOT to use it).  The `--limit` parameter will now
     automatically be supplied.
+
+    **Example Batch Request**:
+
+    .. sourcecode:: http
+
+       POST /api/v2/servers/process HTTP/1.1
+       Content-Type: application/json
+
+       {
+           "servers" : [{
+               "id": "compute4"
+           }, {
+               "id": "compute5"
+           }],
+           "process" : {
+               "encryption-key": "somekey",
+               "commitMessage": "Adding new servers"
+           }
+       }
     """
 
     body = request.get_json()
 
-    # Extract the keys of interest from the request body and normalize the
-    # request arguments
-    keys = ('commitMessage',
-            'encryptionKey',
-            'encryption-key')
-    opts = pick(body.get('process'), keys)
-
-    # rekey is always blank because we will never rekey anything
-    opts['extra-vars'] = {
-        'encrypt': '',
-        'rekey': ''
-    }
-    if 'encryptionKey' in opts:
-        opts['extra-vars']['encrypt'] = opts.pop('encryptionKey')
-    elif 'encryption-key' in opts:
-        opts['extra-vars']['encrypt'] = opts.pop('encryption-key')
+    if 'servers' in body:
+        new_servers = body['servers']
+        if not isinstance(new_servers, list) or not new_servers:
+            abort(400, 'Servers must be a non-empty list')
+    else:
+        new_servers = [body.get('server')]
 
     try:
-        server_id = body['server']['id']
-    except KeyError:
+        server_ids = [s['id'] for s in new_servers]
+    except (KeyError, TypeError):
         abort(400, 'Server id missing')
 
-    if 'commitMessage' not in opts:
-        opts['commitMessage'] = 'Add server %s' % server_id
+    if len(set(server_ids)) != len(server_ids):
+        abort(400, 'Duplicate server ids')
 
     # get the model
     model = model_api.read_model()
 
-    servers = model['inputModel']['servers']
-    # Make sure the server does not already exist in the model
-    if server_id in [s['id'] for s in servers]:
-        abort(400, 'Server %s already exists' % server_id)
-
-    servers.append(body['server'])
-
-    model_api.write_model(model)
-
-    # commit the model
-    versions.commit_model(message=opts['commitMessage'])
-
-    play_id = int(1000 * time.time())
-
-    # The following local functions are all steps that will be run
-    # asynchronously in a series of promises.  In (some) other languages that
-    # support promises, code blocks can be entered directly as an argument
-    # to the 'then' function, but this is not easily done in python.  The
-    # closest thing to them might be multi-line lambda functions, but these
-    # are intentionally unsupported in python:
-    # http://www.artima.com/weblogs/viewpost.jsp?thread=147358
-    #
-    # For clarity, the functions will be defined in the same order that they
-    # are called.  The @copy_current_request_context decorator provided
-    # by flask permits functions to access the http context supplied to the
-    # parent function.
-    @copy_current_request_context
-    def run_config_processor_playbook():
-        LOG.info("Running config processor playbook")
-
-        payload = pick(opts, ('extra-vars',))
-        result = playbooks.run_playbook('config-processor-run', payload,
-                                        play_id)
-        # return the entire result object, including the promise and
-        # other data
-        return result
-
-    @copy_current_request_context
-    def run_ready_deployment_playbook(prev):
-        LOG.info("Running ready deployment playbook")
-
-        result = playbooks.run_playbook('ready-deployment', play_id=play_id)
-        return result['promise']
-
-    @copy_current_request_context
-    def retrieve_hostname(prev):
-        LOG.info("Retrieving hostname from config processor output")
-
-        # Read the CP output and get the hostname
-        try:
-            filename = os.path.join(CONF.paths.cp_ready_output_dir,
-                                    'server_info.yml')
-
-            with open(filename) as f:
-                lines = f.readlines()
-            raw = ''.join(lines)
-
-            servers = yaml.safe_load(raw)
-
-            if server_id in servers:
-                if 'hostname' in servers[server_id]:
-                    opts['limit'] = servers[server_id]['hostname']
-                else:
-                    LOG.info('Server %s has no hostname so skipping --limit' %
-                             server_id)
-            else:
-                LOG.info('Unable to locate server %s so skipping --limit' %
-                         server_id)
-
-        except (OSError, IOError):
-            message = "Unable to read %s" % filename
-            LOG.error(message)
-            raise Exception(message)
-
-        except yaml.YAMLError:
-            # If the generated file is not valid yml, there is some problem
-            # with the config processor
-            message = "%s is not a valid yaml file" % filename
-            LOG.error(message)
-            raise Exception(message)
-
-    @copy_current_request_context
-    def run_site_playbook(prev):
-        LOG.info("Running site playbook")
-
-        # run site playbook, limited to the given hostname if possible
-        payload = pick(opts, ('encryption-key', 'limit'))
-        result = playbooks.run_playbook('site', payload, play_id)
-        return result['promise']
+    # Make sure the servers do not already exist in the model
+    existing = set(s['id'] for s in model['inputModel']['servers'])
+    for server_id in server_ids:
+        if server_id in existing:
+            abort(400, 'Server %s already exists' % server_id)
 
-    @copy_current_request_context
-    def generate_hosts_file(prev):
-        LOG.info("Generating hosts file")
+    (params, secrets) = get_process_opts(body.get('process') or {})
+    params['servers'] = new_servers
+    if 'commitMessage' not in params:
+        params['commitMessage'] = 'Add %s %s' % (
+            'server' if len(server_ids) == 1 else 'servers',
+            ', '.join(server_ids))
 
-        payload = pick(opts, ('encryption-key', ))
-        payload['tags'] = 'generate_hosts_file'
-
-        result = playbooks.run_playbook('site', payload, play_id)
-        return result['promise']
-
-    @copy_current_request_context
-    def update_monasca(prev):
-        LOG.info("Running monasca-deploy playbook")
-
-        payload = pick(opts, ('encryption-key', ))
-        payload['tags'] = 'active_ping_checks'
-
-        result = playbooks.run_playbook('monasca-deploy', payload, play_id)
-        return result['promise']
-
-    @copy_current_request_context
-    def cleanup(prev):
-        LOG.info("Server successfully added")
-
-    @copy_current_request_context
-    def failure(e):
-        LOG.exception(e)
-
-    # Perform all asynchronous functions above in order.  Capture the
-    # promise and other initial results from the first playbook launch in
-    # order to return that info immediately to the caller
-    result = run_config_processor_playbook()
-    result['promise'].then(run_ready_deployment_playbook) \
-        .then(retrieve_hostname) \
-        .then(run_site_playbook) \
-        .then(generate_hosts_file) \
-        .then(update_monasca) \
-        .then(cleanup) \
-        .catch(failure)
-
-    # Note: this returns *before* all of the asynchronus tasks are performed.
-    return jsonify({"id": result['id']}), 202, {'Location': result['url']}
+    # Note: this returns *before* the playbooks have run
+    workflow = workflows.start('add_servers', params, secrets)
+    return jsonify({"id": workflow['id']}), 202, \
+        {'Location': url_for('plays.get_play', id=workflow['id'])}
 
 
 @bp.route("/api/v2/servers/<id>/process", methods=['DELETE'])
@@ -267,6 +170,9 @@ def remove_server(id):
     - update the customer model
     - commit changes to the model
     - run the config processor playbook
+    - run the ready deployment playbook
+
+    Like adding a compute node, the steps are run as a resumable workflow.
 
     .. :quickref: Server; Remove compute node
 
@@ -307,95 +213,234 @@ def remove_server(id):
         body = {}
         LOG.debug('DELETE server got empty json payload - this is probably ok')
 
-    # Extract the keys of interest from the request body and normalize the
-    # request arguments
-    keys = ('commitMessage',
-            'encryptionKey',
-            'encryption-key')
-    opts = pick(body, keys)
+    return delete_servers([id], body or {})
 
-    # rekey is always blank because we will never rekey anything
-    opts['extra-vars'] = {
-        'encrypt': '',
-        'rekey': '',
-        'remove_deleted_servers': 'y',
-        'free_unused_addresses': 'y'
-    }
-    if 'encryptionKey' in opts:
-        opts['extra-vars']['encrypt'] = opts.pop('encryptionKey')
-    elif 'encryption-key' in opts:
-        opts['extra-vars']['encrypt'] = opts.pop('encryption-key')
 
-    if 'commitMessage' not in opts:
-        opts['commitMessage'] = 'Remove server %s' % id
+@bp.route("/api/v2/servers/process", methods=['DELETE'])
+@policy.enforce('lifecycle:run_playbook')
+def remove_servers():
+    """Remove several compute nodes
+
+    Removes the given compute nodes in the same way as removing a single one,
+    except that they are all removed from the model in a single commit and
+    each playbook is run once for all of them.
+
+    .. :quickref: Server; Remove several compute nodes
+
+    **Example Request**:
+
+    The request contains the `ids` of the servers to remove, along with the
+    same values as when removing a single server.
+
+    .. sourcecode:: http
+
+       DELETE /api/v2/servers/process HTTP/1.1
+       Content-Type: application/json
+
+       {
+           "ids": ["compute4", "compute5"],
+           "process" : {
+               "encryption-key": "somekey",
+               "commitMessage": "Deleting old servers"
+           }
+       }
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 202 ACCEPTED
+       Content-Type: application/json
+       Location: http://localhost:9085/api/v2/plays/6858
+
+       {
+           "id": 6858
+       }
+    """
+
+    body = request.get_json() or {}
+    ids = body.get('ids')
+    if not isinstance(ids, list) or not ids:
+        abort(400, 'Server ids must be a non-empty list')
+
+    return delete_servers(ids, body.get('process') or {})
+
+
+def delete_servers(ids, body):
+    # Remove the servers with the given ids from the model and run the
+    # playbooks that reconfigure the cloud without them, using the values in
+    # body for the process
+    if len(set(ids)) != len(ids):
+        abort(400, 'Duplicate server ids')
 
     # get the model
     model = model_api.read_model()
 
+    # Make sure the servers exist in the model
+    existing = set(s['id'] for s in model['inputModel']['servers'])
+    for id in ids:
+        if id not in existing:
+            abort(404, 'Server %s does not exist' % id)
+
+    (params, secrets) = get_process_opts(body)
+    params['ids'] = ids
+    if 'commitMessage' not in params:
+        params['commitMessage'] = 'Remove %s %s' % (
+            'server' if len(ids) == 1 else 'servers', ', '.join(ids))
+
+    # Note: this returns *before* the playbooks have run
+    workflow = workflows.start('remove_servers', params, secrets)
+    return jsonify({"id": workflow['id']}), 202, \
+        {'Location': url_for('plays.get_play', id=workflow['id'])}
+
+
+def get_process_opts(process):
+    # Split the values of interest from the process object of a request into
+    # the params of a workflow and its secrets, which are not saved
+    params = pick(process, ('commitMessage',))
+    secrets = {}
+    if 'encryptionKey' in process:
+        secrets['encrypt'] = process['encryptionKey']
+    elif 'encryption-key' in process:
+        secrets['encrypt'] = process['encryption-key']
+    return params, secrets
+
+
+# The steps of the workflows that add and remove servers, each of which is
+# checkpointed so that a workflow that fails can be resumed from the step that
+# failed (see the workflows module).  The plays run by the steps of a
+# workflow all have the id of the workflow
+
+def add_to_model(id, params, secrets):
+    model = model_api.read_model()
     servers = model['inputModel']['servers']
 
-    # Make sure the server does not already exist in the model
-    if id not in [s['id'] for s in servers]:
-        abort(404, 'Server %s does not exist' % id)
+    # Servers already in the model were added by an earlier attempt
+    existing = set(s['id'] for s in servers)
+    servers.extend(s for s in params['servers'] if s['id'] not in existing)
+
+    model_api.write_model(model)
+
 
-    # Filter out the server to delete
-    model['inputModel']['servers'] = [s for s in servers if s['id'] != id]
+def remove_from_model(id, params, secrets):
+    model = model_api.read_model()
+    model['inputModel']['servers'] = [
+        s for s in model['inputModel']['servers']
+        if s['id'] not in params['ids']]
 
     model_api.write_model(model)
 
-    # commit the model
-    versions.commit_model(message=opts['commitMessage'])
-
-    play_id = int(1000 * time.time())
-
-    # The following local functions are all steps that will be run
-    # asynchronously in a series of promises.  In (some) other languages that
-    # support promises, code blocks can be entered directly as an argument
-    # to the 'then' function, but this is not easily done in python.  The
-    # closest thing to them might be multi-line lambda functions, but these
-    # are intentionally unsupported in python:
-    # http://www.artima.com/weblogs/viewpost.jsp?thread=147358
-    #
-    # For clarity, the functions will be defined in the same order that they
-    # are called.  The @copy_current_request_context decorator provided
-    # by flask permits functions to access the http context supplied to the
-    # parent function.
-    @copy_current_request_context
-    def run_config_processor_playbook():
-        LOG.info("Running config processor playbook")
-
-        payload = pick(opts, ('extra-vars',))
-        result = playbooks.run_playbook('config-processor-run', payload,
-                                        play_id)
-        # return the entire result object, including the promise and
-        # other data
-        return result
-
-    @copy_current_request_context
-    def run_ready_deployment_playbook(prev):
-        LOG.info("Running ready deployment playbook")
-
-        result = playbooks.run_playbook('ready-deployment', play_id=play_id)
-        return result['promise']
-
-    @copy_current_request_context
-    def cleanup(prev):
-        LOG.info("Server successfully removed")
-
-    @copy_current_request_context
-    def failure(e):
-        LOG.exception(e)
-
-    # Perform all asynchronous functions above in order.  Capture the
-    # promise and other initial results from the first playbook launch in
-    # order to return that info immediately to the caller
-    result = run_config_processor_playbook()
-    result['promise'].then(run_ready_deployment_playbook) \
-        .then(cleanup) \
-        .catch(failure)
-
-    # Note: this returns *before* all of the asynchronus tasks are performed.
-    return jsonify({"id": result['id']}), 202, {'Location': result['url']}
+
+def commit_model(id, params, secrets):
+    versions.commit_model(message=params['commitMessage'])
+
+
+def run_config_processor_playbook(id, params, secrets):
+    LOG.info("Running config processor playbook")
+
+    # rekey is always blank because we will never rekey anything
+    payload = {
+        'extra-vars': {
+            'encrypt': secrets.get('encrypt', ''),
+            'rekey': ''
+        }
+    }
+    if 'ids' in params:
+        payload['extra-vars']['remove_deleted_servers'] = 'y'
+        payload['extra-vars']['free_unused_addresses'] = 'y'
+
+    return playbooks.run_playbook('config-processor-run', payload, id)
+
+
+def run_ready_deployment_playbook(id, params, secrets):
+    LOG.info("Running ready deployment playbook")
+
+    return playbooks.run_playbook('ready-deployment', play_id=id)
+
+
+def retrieve_hostname(id, params, secrets):
+    LOG.info("Retrieving hostname from config processor output")
+
+    # Read the CP output and get the hostnames.  The playbooks are only
+    # limited if the hostnames of all of the new servers are known, since
+    # otherwise some of them would be skipped
+    try:
+        filename = os.path.join(CONF.paths.cp_ready_output_dir,
+                                'server_info.yml')
+
+        with open(filename) as f:
+            lines = f.readlines()
+        raw = ''.join(lines)
+
+        servers = yaml_io.safe_load(raw)
+
+        hostnames = []
+        for server in params['servers']:
+            server_id = server['id']
+            if server_id not in servers:
+                LOG.info('Unable to locate server %s so skipping --limit' %
+                         server_id)
+                break
+            if 'hostname' not in servers[server_id]:
+                LOG.info('Server %s has no hostname so skipping --limit' %
+                         server_id)
+                break
+            hostnames.append(servers[server_id]['hostname'])
+        else:
+            params['limit'] = ','.join(hostnames)
+
+    except (OSError, IOError):
+        message = "Unable to read %s" % filename
+        LOG.error(message)
+        raise Exception(message)
+
+    except yaml_io.YAMLError:
+        # If the generated file is not valid yml, there is some problem
+        # with the config processor
+        message = "%s is not a valid yaml file" % filename
+        LOG.error(message)
+        raise Exception(message)
+
+
+def run_site_playbook(id, params, secrets):
+    LOG.info("Running site playbook")
+
+    # run site playbook, limited to the given hostnames if possible
+    payload = pick(params, ('limit',))
+    return playbooks.run_playbook('site', payload, id)
+
+
+def generate_hosts_file(id, params, secrets):
+    LOG.info("Generating hosts file")
+
+    payload = {'tags': 'generate_hosts_file'}
+    return playbooks.run_playbook('site', payload, id)
+
+
+def update_monasca(id, params, secrets):
+    LOG.info("Running monasca-deploy playbook")
+
+    payload = {'tags': 'active_ping_checks'}
+    return playbooks.run_playbook('monasca-deploy', payload, id)
+
+
+workflows.register('add_servers', [
+    ('update-model', add_to_model),
+    ('commit-model', commit_model),
+    ('config-processor-run', run_config_processor_playbook),
+    ('ready-deployment', run_ready_deployment_playbook),
+    ('retrieve-hostnames', retrieve_hostname),
+    ('site', run_site_playbook),
+    ('generate-hosts-file', generate_hosts_file),
+    ('monasca-deploy', update_monasca),
+])
+
+workflows.register('remove_servers', [
+    ('update-model', remove_from_model),
+    ('commit-model', commit_model),
+    ('config-processor-run', run_config_processor_playbook),
+    ('ready-deployment', run_ready_deployment_playbook),
+])
 
 
 def pick(source_dict, keys):
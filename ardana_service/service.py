@@ -20,9 +20,9 @@ from flask import request
 import os
 from oslo_config import cfg
 from oslo_log import log as logging
-import yaml
 
 from . import policy
+from . import yaml_io
 
 LOG = logging.getLogger(__name__)
 bp = Blueprint('service', __name__)
@@ -209,7 +209,7 @@ def load_yaml(path):
     content = None
     try:
         with open(path) as f:
-            content = yaml.safe_load(f)
+            content = yaml_io.safe_load(f)
     except Exception:
         LOG.error("Unable to read %s", path)
     return content
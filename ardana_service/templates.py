@@ -181,7 +181,7 @@ def get_template(name):
 
     model_dir = os.path.join(CONF.paths.templates_dir, name)
     try:
-        return jsonify(model.read_model(model_dir))
+        return jsonify(model.read_cached_model(model_dir))
     except Exception as e:
         LOG.exception(e)
         abort(400, "Unable to read model")
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import copy
 from functools import reduce
 import ipaddress
 import operator
@@ -60,6 +61,45 @@ def find(element, dictionary):
     return reduce(operator.getitem, element.split('.'), dictionary)
 
 
+def project(doc, paths):
+    """Return the parts of doc selected by a list of dotted paths
+
+    Each selected value is returned nested within the same keys as in doc,
+    e.g. projecting 'a.b' from {'a': {'b': 1, 'c': 2}} gives {'a': {'b': 1}}.
+    Numeric path elements index into lists.  Since only some elements of a
+    list may be selected, a list is returned as a dict keyed by the string
+    form of the selected indexes, e.g. projecting 'a.1' from {'a': [5, 6]}
+    gives {'a': {'1': 6}}.  The selected values are not copied.  A ValueError
+    is raised if a path does not exist in doc.
+    """
+    result = {}
+    selected = set()
+
+    # Process shorter paths first so that any path within an already selected
+    # value can be skipped
+    for path in sorted(set(paths), key=lambda p: p.count('.')):
+        keys = path.split('.')
+        if any(tuple(keys[:i]) in selected for i in range(1, len(keys))):
+            continue
+
+        value = doc
+        try:
+            for key in keys:
+                if isinstance(value, list):
+                    key = int(key)
+                value = value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise ValueError('Field %s does not exist' % path)
+
+        target = result
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+        selected.add(tuple(keys))
+
+    return result
+
+
 def is_ipv6(address):
 
     # ipaddress requires unicode arguments (all strings in python3 are already
@@ -80,3 +120,111 @@ def url_address(host_or_ip):
         return '[' + host_or_ip + ']'
 
     return host_or_ip
+
+
+def apply_patch(doc, operations):
+    """Apply a list of JSON Patch (RFC 6902) operations to doc
+
+    Supports the add, remove, replace, move, copy and test operations.  The
+    given doc is modified in place, and the (possibly replaced) document is
+    returned.  A ValueError is raised for any malformed or failing operation.
+    """
+    if not isinstance(operations, list):
+        raise ValueError('Patch must be a list of operations')
+
+    for operation in operations:
+        try:
+            op = operation['op']
+            path = operation['path']
+        except (KeyError, TypeError):
+            raise ValueError('Patch operation requires "op" and "path"')
+
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise ValueError('Patch operation %s requires "value"' % op)
+
+        if op == 'add':
+            doc = _patch_add(doc, path, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            doc = _patch_remove(doc, path)[0]
+        elif op == 'replace':
+            doc = _patch_remove(doc, path)[0]
+            doc = _patch_add(doc, path, copy.deepcopy(operation['value']))
+        elif op in ('move', 'copy'):
+            if 'from' not in operation:
+                raise ValueError('Patch operation %s requires "from"' % op)
+            if op == 'move':
+                doc, value = _patch_remove(doc, operation['from'])
+            else:
+                value = copy.deepcopy(_patch_get(doc, operation['from']))
+            doc = _patch_add(doc, path, value)
+        elif op == 'test':
+            if _patch_get(doc, path) != operation['value']:
+                raise ValueError('Patch test failed for %s' % path)
+        else:
+            raise ValueError('Unsupported patch operation %s' % op)
+
+    return doc
+
+
+def _split_pointer(pointer):
+    # Split a JSON pointer (RFC 6901) into its list of unescaped tokens
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError('Invalid JSON pointer %s' % pointer)
+    return [t.replace('~1', '/').replace('~0', '~')
+            for t in pointer[1:].split('/')]
+
+
+def _resolve_token(container, token, allow_end=False):
+    # Convert a pointer token into a key or index valid for the container
+    if isinstance(container, list):
+        if allow_end and token == '-':
+            return len(container)
+        try:
+            index = int(token)
+        except ValueError:
+            raise ValueError('Invalid list index %s' % token)
+        limit = len(container) + (1 if allow_end else 0)
+        if index < 0 or index >= limit:
+            raise ValueError('List index %s out of range' % token)
+        return index
+    elif isinstance(container, dict):
+        if not allow_end and token not in container:
+            raise ValueError('Key %s not found' % token)
+        return token
+
+    raise ValueError('Cannot traverse into %s' % token)
+
+
+def _patch_get(doc, pointer, tokens=None):
+    value = doc
+    for token in _split_pointer(pointer) if tokens is None else tokens:
+        value = value[_resolve_token(value, token)]
+    return value
+
+
+def _patch_add(doc, pointer, value):
+    tokens = _split_pointer(pointer)
+    if not tokens:
+        return value
+
+    parent = _patch_get(doc, None, tokens[:-1])
+    key = _resolve_token(parent, tokens[-1], allow_end=True)
+    if isinstance(parent, list):
+        parent.insert(key, value)
+    else:
+        parent[key] = value
+    return doc
+
+
+def _patch_remove(doc, pointer):
+    # Remove the value at the given pointer, returning the updated doc and
+    # the removed value
+    tokens = _split_pointer(pointer)
+    if not tokens:
+        return None, doc
+
+    parent = _patch_get(doc, None, tokens[:-1])
+    key = _resolve_token(parent, tokens[-1])
+    return doc, parent.pop(key)
@@ -21,6 +21,7 @@ import os
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from . import model
 from . import policy
 
 LOG = logging.getLogger(__name__)
@@ -45,6 +46,9 @@ def reset(dir=None):
     for f in repo.untracked_files:
         path = os.path.join(dir, f.a_path)
         os.unlink(path)
+
+    # The reset may have replaced model files with older versions
+    model.invalidate_model_cache()
     return jsonify('Success')
 
 
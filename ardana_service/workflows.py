@@ -0,0 +1,474 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Workflows run a series of steps, such as updating the input model and
+# running playbooks, one after the other.  The state of each workflow is
+# checkpointed to a file in the workflows subdirectory of the log dir as each
+# step starts and ends, along with the play id and outcome of each step, so
+# that a workflow that failed, or that was interrupted by a restart of the
+# service, can be resumed from the step that did not complete without
+# repeating the expensive steps before it.
+#
+# The steps of each type of workflow are registered with register().  Each
+# step is a function that is called with the id of the workflow (which is
+# also the id of the plays it runs), its params and its secrets.  A step
+# either completes before returning, or returns the result of run_playbook,
+# in which case it completes when the play ends.  Steps may add values to the
+# params dict for use by later steps, and these are checkpointed with the
+# workflow.  Secrets, such as encryption keys, are never written to disk, and
+# so must be supplied again when a workflow is resumed.
+
+from flask import abort
+from flask import Blueprint
+from flask import copy_current_request_context
+from flask import jsonify
+from flask import request
+from flask import safe_join
+from flask import url_for
+import json
+import os
+from oslo_config import cfg
+from oslo_log import log as logging
+import tempfile
+import threading
+import time
+from werkzeug.exceptions import HTTPException
+
+from . import plays
+from . import policy
+
+LOG = logging.getLogger(__name__)
+bp = Blueprint('workflows', __name__)
+CONF = cfg.CONF
+
+WORKFLOWS_DIR = 'workflows'
+WORKFLOW_EXT = '.json'
+
+# Statuses of workflows.  A workflow is interrupted if it was running when the
+# service stopped
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+INTERRUPTED = 'interrupted'
+
+# Statuses of individual steps, in addition to the above
+PENDING = 'pending'
+
+# List of (name, function) of the steps of each type of workflow
+_types = {}
+
+# Secrets of the workflows running in this process, keyed by workflow id
+_active = {}
+
+_lock = threading.Lock()
+
+
+@bp.route("/api/v2/workflows", methods=['GET'])
+@policy.enforce('lifecycle:get_play')
+def get_workflows():
+    """List workflows
+
+    Returns the workflows that have been run, newest first.
+
+    .. :quickref: Workflow; List workflows
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       GET /api/v2/workflows HTTP/1.1
+       Content-Type: application/json
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       [{
+           "id": "1534180830476",
+           "type": "add_servers",
+           "status": "succeeded",
+           ...
+       }]
+    """
+    results = []
+    dir = get_workflows_dir()
+    if os.path.isdir(dir):
+        for filename in os.listdir(dir):
+            if filename.endswith(WORKFLOW_EXT):
+                try:
+                    results.append(read_workflow(
+                        filename[:-len(WORKFLOW_EXT)]))
+                except (IOError, OSError, ValueError):
+                    LOG.warning("Unable to read workflow %s", filename)
+
+    results.sort(key=lambda w: w.get('startTime', 0), reverse=True)
+    return jsonify(results)
+
+
+@bp.route("/api/v2/workflows/<id>", methods=['GET'])
+@policy.enforce('lifecycle:get_play')
+def get_workflow(id):
+    """Get the status of a workflow
+
+    The status of the workflow is one of ``running``, ``succeeded``,
+    ``failed`` or ``interrupted`` (when the service was restarted while it
+    was running), and each of its steps is ``pending``, ``running``,
+    ``succeeded`` or ``failed``.  Steps that run a playbook have the id of
+    their play.
+
+    .. :quickref: Workflow; Get the status of a workflow
+
+    :param id: workflow id
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       GET /api/v2/workflows/1534180830476 HTTP/1.1
+       Content-Type: application/json
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+       {
+           "id": "1534180830476",
+           "type": "add_servers",
+           "status": "failed",
+           "startTime": 1534180830476,
+           "endTime": 1534181430721,
+           "params": {
+               "servers": [{"id": "compute4"}],
+               ...
+           },
+           "steps": [{
+               "name": "update-model",
+               "status": "succeeded",
+               "startTime": 1534180830476,
+               "endTime": 1534180830502
+           }, {
+               ...
+           }, {
+               "name": "site",
+               "status": "failed",
+               "playId": "1534180830476",
+               "startTime": 1534180901130,
+               "endTime": 1534181430721,
+               "error": "Play 1534180830476 failed"
+           }, {
+               "name": "generate-hosts-file",
+               "status": "pending"
+           }, ...]
+       }
+    """
+    try:
+        return jsonify(read_workflow(id))
+    except (IOError, OSError, ValueError):
+        abort(404, "Workflow %s not found" % id)
+
+
+@bp.route("/api/v2/workflows/<id>/resume", methods=['POST'])
+@policy.enforce('lifecycle:run_playbook')
+def resume_workflow(id):
+    """Resume a workflow that failed or was interrupted
+
+    The workflow continues from the step that did not complete; the steps
+    before it are not repeated.  A step whose play was interrupted by a
+    restart of the service but then went on to succeed is not repeated
+    either.  Secrets used by the workflow, such as the encryption key, are
+    not saved, so they must be supplied again.
+
+    .. :quickref: Workflow; Resume a workflow
+
+    :param id: workflow id
+
+    **Example Request**:
+
+    .. sourcecode:: http
+
+       POST /api/v2/workflows/1534180830476/resume HTTP/1.1
+       Content-Type: application/json
+
+       {
+           "encryption-key": "somekey"
+       }
+
+    **Example Response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 202 ACCEPTED
+       Content-Type: application/json
+       Location: http://localhost:9085/api/v2/workflows/1534180830476
+
+       {
+           "id": "1534180830476"
+       }
+
+    :status 202: the workflow has resumed, and is running a play
+    :status 400: the workflow has already succeeded, or is of unknown type
+    :status 403: the workflow, or the play of its interrupted step, is still
+                 running
+    :status 404: the workflow does not exist
+    :status 409: a step failed again before any play was started; the
+                 message carries the error recorded for the step
+    """
+    body = request.get_json(silent=True) or {}
+    secrets = {}
+    for key in ('encryptionKey', 'encryption-key'):
+        if key in body:
+            secrets['encrypt'] = body[key]
+
+    resume(id, secrets)
+    return jsonify({"id": id}), 202, \
+        {'Location': url_for('workflows.get_workflow', id=id)}
+
+
+def register(type, steps):
+    """Register the list of (name, function) of the steps of a workflow"""
+    _types[type] = steps
+
+
+def get_workflows_dir():
+    return os.path.join(CONF.paths.log_dir, WORKFLOWS_DIR)
+
+
+def get_workflow_file(id):
+    # For security, safe_join avoids referring to any files outside of the
+    # workflows dir
+    return safe_join(os.path.abspath(get_workflows_dir()),
+                     str(id) + WORKFLOW_EXT)
+
+
+def read_workflow(id):
+    with open(get_workflow_file(id)) as f:
+        workflow = json.load(f)
+
+    if workflow['status'] == RUNNING and workflow['id'] not in _active:
+        workflow['status'] = INTERRUPTED
+    return workflow
+
+
+def write_workflow(workflow):
+    dir = get_workflows_dir()
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+
+    # Replace the file atomically so that it is never seen partially written
+    (fd, temp_path) = tempfile.mkstemp(dir=dir, prefix='.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(workflow, f)
+        os.rename(temp_path, get_workflow_file(workflow['id']))
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def start(type, params, secrets=None, id=None):
+    """Start a new workflow of the given type
+
+    The steps are run until one of them starts a play, after which this
+    returns the workflow and the remaining steps are run in the background.
+    If a step fails before then, its failure is recorded so that the
+    workflow can be resumed, and the request is aborted: with the error of
+    the step if it aborted, otherwise with status 409 and the error recorded
+    for the step.
+    """
+    id = str(id) if id is not None else str(int(1000 * time.time()))
+    workflow = {
+        'id': id,
+        'type': type,
+        'status': RUNNING,
+        'startTime': int(1000 * time.time()),
+        'params': params,
+        'steps': [{'name': name, 'status': PENDING}
+                  for (name, func) in _types[type]]
+    }
+
+    with _lock:
+        _active[id] = secrets or {}
+    try:
+        write_workflow(workflow)
+    except (IOError, OSError) as e:
+        _active.pop(id, None)
+        LOG.exception(e)
+        abort(500, "Unable to write workflow")
+
+    _run_steps(workflow, 0)
+    return workflow
+
+
+def resume(id, secrets=None):
+    """Resume a workflow from the step that did not complete
+
+    Like start(), the request is aborted if a step fails before the first
+    play is started.
+    """
+    try:
+        workflow = read_workflow(id)
+    except (IOError, OSError, ValueError):
+        abort(404, "Workflow %s not found" % id)
+
+    if workflow['type'] not in _types:
+        abort(400, "Unknown type of workflow %s" % workflow['type'])
+
+    with _lock:
+        if id in _active:
+            abort(403, "Workflow %s is already running" % id)
+        if workflow['status'] == SUCCEEDED:
+            abort(400, "Workflow %s has already succeeded" % id)
+
+        index = next((i for (i, s) in enumerate(workflow['steps'])
+                      if s['status'] != SUCCEEDED), len(workflow['steps']))
+        step = workflow['steps'][index] if index < len(workflow['steps']) \
+            else {}
+
+        # The play of an interrupted step may have carried on without the
+        # service, in which case its outcome determines whether it needs to
+        # be repeated
+        if step.get('status') == RUNNING and step.get('playId'):
+            play = _get_play(step)
+            if play is not None and 'endTime' not in play:
+                abort(403, "Step %s of workflow %s is still running" %
+                      (step['name'], id))
+            if play is not None and play.get('code') == 0 and \
+                    not play.get('killed'):
+                LOG.info("Step %s of workflow %s succeeded while it was "
+                         "interrupted", step['name'], id)
+                step['status'] = SUCCEEDED
+                step['endTime'] = play['endTime']
+                index += 1
+
+        _active[id] = secrets or {}
+
+    LOG.info("Resuming workflow %s at step %d", id, index + 1)
+    workflow['status'] = RUNNING
+    workflow.pop('endTime', None)
+    _run_steps(workflow, index)
+    return workflow
+
+
+def _get_play(step):
+    # Return the metadata of the play started by the step, if it has any.
+    # The plays of all of the steps of a workflow share an id, so plays that
+    # started before the step belong to earlier steps
+    if step['playId'] in plays.get_running_plays():
+        return {}
+
+    try:
+        play = plays.read_metadata(step['playId'])
+    except (IOError, OSError, ValueError):
+        return None
+
+    if play.get('startTime', 0) < step['startTime']:
+        return None
+    return play
+
+
+def _save(workflow):
+    # Failing to checkpoint a workflow does not stop it, though it may then
+    # not be possible to resume it from where it stopped
+    try:
+        write_workflow(workflow)
+    except (IOError, OSError):
+        LOG.exception("Unable to write workflow %s", workflow['id'])
+
+
+def _run_steps(workflow, index):
+    # Run the steps of the workflow from the given index, until one of them
+    # starts a play.  The remaining steps are run once the play ends
+    id = workflow['id']
+    steps = _types[workflow['type']]
+
+    while index < len(steps):
+        (name, func) = steps[index]
+        step = workflow['steps'][index]
+        step.clear()
+        step.update(name=name, status=RUNNING,
+                    startTime=int(1000 * time.time()))
+        _save(workflow)
+
+        LOG.info("Running step %s of workflow %s", name, id)
+        try:
+            result = func(id, workflow['params'], _active.get(id, {}))
+        except Exception as e:
+            _fail(workflow, index, e)
+            if isinstance(e, HTTPException):
+                raise
+            abort(409, "Step %s of workflow %s failed: %s" %
+                  (name, id, step['error']))
+
+        if result is not None:
+            step['playId'] = result['id']
+            _save(workflow)
+            _follow(workflow, index, result['promise'])
+            return
+
+        _succeed(workflow, index)
+        index += 1
+
+    _finish(workflow, SUCCEEDED)
+
+
+def _follow(workflow, index, promise):
+    # The callbacks run when the play ends, in the thread that follows it.
+    # They need the request context since later steps start plays
+    @copy_current_request_context
+    def on_success(value):
+        _succeed(workflow, index)
+        try:
+            _run_steps(workflow, index + 1)
+        except Exception:
+            # Already recorded in the workflow
+            pass
+
+    @copy_current_request_context
+    def on_failure(e):
+        _fail(workflow, index, e)
+
+    promise.then(on_success, on_failure)
+
+
+def _succeed(workflow, index):
+    step = workflow['steps'][index]
+    step['status'] = SUCCEEDED
+    step['endTime'] = int(1000 * time.time())
+    _save(workflow)
+
+
+def _fail(workflow, index, e):
+    step = workflow['steps'][index]
+    LOG.error("Step %s of workflow %s failed: %s", step['name'],
+              workflow['id'], e)
+    step['status'] = FAILED
+    step['endTime'] = int(1000 * time.time())
+    # Errors raised with abort() have a more useful description
+    step['error'] = getattr(e, 'description', None) or str(e)
+    _finish(workflow, FAILED)
+
+
+def _finish(workflow, status):
+    workflow['status'] = status
+    workflow['endTime'] = int(1000 * time.time())
+    _save(workflow)
+    with _lock:
+        _active.pop(workflow['id'], None)
+    LOG.info("Workflow %s %s", workflow['id'], status)
@@ -0,0 +1,54 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Central place for reading and writing yaml.  The libyaml-based C loaders
+# and dumpers are several times faster than the pure python ones, which
+# matters for the large files produced by the config processor, so they are
+# used whenever PyYAML was built with libyaml support.
+
+import yaml
+
+YAMLError = yaml.YAMLError
+
+try:
+    from yaml import CLoader as Loader
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+    HAS_LIBYAML = True
+except ImportError:
+    from yaml import Loader
+    from yaml import SafeDumper
+    from yaml import SafeLoader
+    HAS_LIBYAML = False
+
+
+def safe_load(stream):
+    """Parse yaml from a string or file, permitting only standard tags"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load(stream):
+    """Parse yaml from a trusted string or file
+
+    Files that are generated programatically, such as those from the config
+    processor, may contain special python tags that can only be deserialized
+    by the full loader.  Use safe_load for anything that can be directly
+    manipulated by user input.
+    """
+    return yaml.load(stream, Loader=Loader)
+
+
+def safe_dump(data, stream=None, **kwargs):
+    """Serialize data as yaml to a stream, or return it if no stream given"""
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
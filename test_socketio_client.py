@@ -37,7 +37,9 @@ logging.getLogger('socketIO-client').setLevel(logging.DEBUG)
 logging.basicConfig()
 
 
-def on_log(message):
+def on_log(message, offset=None):
+    # offset is the position in the log following this message, which can be
+    # passed when joining again in order to resume from this point
     print(message, end='')
 
 
@@ -0,0 +1,152 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from flask import Flask
+import os
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+from oslo_serialization import jsonutils
+import testtools
+import time
+
+from ardana_service import archiver
+from ardana_service import config  # noqa: F401
+from ardana_service import play_index
+from ardana_service import plays
+
+app = Flask(__name__)
+app.register_blueprint(plays.bp)
+
+HOUR = 3600 * 1000
+
+
+class TestArchiver(testtools.TestCase):
+
+    def setUp(self):
+        super(TestArchiver, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.conf.config(group='plays', archive_after_hours=1)
+        self.client = app.test_client()
+        self.useFixture(fixtures.MockPatchObject(archiver, 'socketio'))
+
+        # Plays that ended 48, 20, 12 hours ago and one that has just ended
+        now = int(1000 * time.time())
+        self.ids = []
+        for hours in (48, 20, 12, 0):
+            id = str(now - hours * HOUR - 1000)
+            self.write_play(id, now - hours * HOUR)
+            self.ids.append(id)
+
+    def write_play(self, id, end_time):
+        plays.write_metadata({'id': id, 'startTime': int(id),
+                              'endTime': end_time, 'code': 0})
+        with open(plays.get_play_file(id, plays.LOG_EXT), 'wb') as f:
+            f.write(b''.join(b'line %d\n' % i for i in range(1000)))
+        with open(plays.get_play_file(id, plays.EVENTS_EXT), 'wb') as f:
+            f.write(b'[{"event": "playbook-start", "playbook": "site.yml"}]')
+
+    def exists(self, id, ext):
+        return os.path.exists(plays.get_play_file(id, ext))
+
+    def test_compression(self):
+        archiver.archive_plays()
+
+        for id in self.ids[:3]:
+            self.assertFalse(self.exists(id, plays.LOG_EXT))
+            self.assertTrue(self.exists(id, plays.LOG_EXT + '.gz'))
+            self.assertTrue(self.exists(id, plays.EVENTS_EXT + '.gz'))
+            self.assertTrue(self.exists(id, plays.META_EXT))
+
+        self.assertTrue(self.exists(self.ids[3], plays.LOG_EXT))
+
+        # Archived files are read transparently
+        url = '/api/v2/plays/%s' % self.ids[0]
+        resp = self.client.get(url + '/log')
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.data.startswith(b'line 0\nline 1\n'))
+        self.assertEqual(b'line 998\nline 999\n',
+                         self.client.get(url + '/log?tail=2').data)
+        self.assertEqual(b'line 999\n',
+                         self.client.get(url + '/log?since=%d' %
+                                         (len(resp.data) - 9)).data)
+
+        resp = self.client.get(url + '/events')
+        self.assertEqual('playbook-start',
+                         jsonutils.loads(resp.data)[0]['event'])
+
+    def test_retention_count(self):
+        self.conf.config(group='plays', retention_count=2)
+        archiver.archive_plays()
+
+        for id in self.ids[:2]:
+            self.assertEqual([], [f for f in os.listdir(self.log_dir)
+                                  if f.startswith(id)])
+        self.assertEqual(self.ids[:1:-1],
+                         [p['id'] for p in play_index.query()[0]])
+
+    def test_retention_age(self):
+        self.conf.config(group='plays', retention_days=1)
+        archiver.archive_plays()
+        self.assertEqual(self.ids[:0:-1],
+                         [p['id'] for p in play_index.query()[0]])
+
+    def test_retention_size(self):
+        # Leave room for only one play
+        self.conf.config(group='plays', archive_after_hours=0,
+                         retention_megabytes=1)
+        for id in self.ids:
+            with open(plays.get_play_file(id, plays.LOG_EXT), 'wb') as f:
+                f.write(b'x' * 600 * 1024)
+
+        archiver.archive_plays()
+        self.assertEqual([self.ids[3]],
+                         [p['id'] for p in play_index.query()[0]])
+        for id in self.ids[:3]:
+            self.assertEqual([], [f for f in os.listdir(self.log_dir)
+                                  if f.startswith(id)])
+        self.assertTrue(self.exists(self.ids[3], plays.LOG_EXT))
+
+    def test_running_plays_are_kept(self):
+        self.conf.config(group='plays', retention_count=1)
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'plays', {self.ids[0]: {}}))
+        archiver.archive_plays()
+
+        self.assertTrue(self.exists(self.ids[0], plays.LOG_EXT))
+        self.assertEqual([self.ids[0]],
+                         [p['id'] for p in play_index.query()[0]])
+
+    def test_registered_plays_are_kept(self):
+        # A play left running by a previous instance of the service, which has
+        # not been reattached to yet
+        self.conf.config(group='plays', retention_count=1)
+        plays.register_running(self.ids[0], {'pid': 1})
+        archiver.archive_plays()
+
+        self.assertTrue(self.exists(self.ids[0], plays.LOG_EXT))
+        self.assertEqual([self.ids[0]],
+                         [p['id'] for p in play_index.query()[0]])
+
+    def test_queued_plays_are_kept(self):
+        self.conf.config(group='plays', retention_count=1)
+        id = str(int(self.ids[0]) - HOUR)
+        plays.write_metadata({'id': id, 'startTime': int(id),
+                              'queued': True})
+        archiver.archive_plays()
+
+        self.assertEqual([id],
+                         [p['id'] for p in play_index.query()[0]])
@@ -0,0 +1,113 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import datetime
+import fixtures
+import mock
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+import testtools
+import time
+
+from ardana_service import clients
+
+
+class TestClients(testtools.TestCase):
+
+    def setUp(self):
+        super(TestClients, self).setUp()
+        self.useFixture(fixtures.MockPatchObject(
+            clients, '_clients', collections.OrderedDict()))
+        self.session = mock.sentinel.session
+        self.useFixture(fixtures.MockPatchObject(
+            clients, '_session', self.session))
+
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.register_opts([cfg.StrOpt('auth_url'),
+                                 cfg.StrOpt('username'),
+                                 cfg.StrOpt('password'),
+                                 cfg.StrOpt('project_name'),
+                                 cfg.StrOpt('project_domain_name'),
+                                 cfg.StrOpt('user_domain_name')],
+                                group='keystone_authtoken')
+
+        # Tokens last for an hour
+        self.expires = datetime.datetime.utcnow() + \
+            datetime.timedelta(hours=1)
+        loader = self.useFixture(fixtures.MockPatchObject(
+            clients.loading, 'get_plugin_loader')).mock.return_value
+        self.load = loader.load_from_options
+        self.load.side_effect = lambda **kwargs: mock.Mock(**{
+            'token': kwargs['token'],
+            'get_access.return_value.expires': self.expires})
+
+        self.factory = mock.Mock(side_effect=lambda sess, auth: mock.Mock(
+            session=sess, token=auth.token))
+
+    def test_reused_for_token(self):
+        first = clients.get_token_client('compute', 'a', self.factory)
+        self.assertIs(self.session, first.session)
+        self.assertEqual('a', first.token)
+        self.assertIs(first, clients.get_token_client('compute', 'a',
+                                                      self.factory))
+        self.assertEqual(1, self.load.call_count)
+
+        # Other tokens and other clients are separate
+        other = clients.get_token_client('compute', 'b', self.factory)
+        self.assertEqual('b', other.token)
+        network = clients.get_token_client('network', 'a', self.factory)
+        self.assertIsNot(first, network)
+        self.assertEqual(3, self.factory.call_count)
+
+    def test_expiring_token(self):
+        self.expires = datetime.datetime.utcnow() + \
+            datetime.timedelta(seconds=clients.EXPIRY_MARGIN_SECONDS - 1)
+        first = clients.get_token_client('compute', 'a', self.factory)
+        second = clients.get_token_client('compute', 'a', self.factory)
+        self.assertIsNot(first, second)
+
+    def test_max_clients(self):
+        self.useFixture(fixtures.MockPatchObject(clients, 'MAX_CLIENTS', 2))
+        for token in ('a', 'b', 'c'):
+            clients.get_token_client('compute', token, self.factory)
+        self.assertEqual([('compute', 'b'), ('compute', 'c')],
+                         list(clients._clients.keys()))
+
+    def test_service_client(self):
+        factory = mock.Mock(side_effect=lambda: object())
+        first = clients.get_service_client(('monasca', 'url'), factory, 600)
+        self.assertIs(first, clients.get_service_client(('monasca', 'url'),
+                                                        factory, 600))
+
+        with mock.patch.object(clients.time, 'time',
+                               return_value=time.time() + 600):
+            self.assertIsNot(first, clients.get_service_client(
+                ('monasca', 'url'), factory, 600))
+
+    def test_password_client(self):
+        self.conf.config(group='keystone_authtoken', username='ardana',
+                         password='secret')
+        self.load.side_effect = lambda **kwargs: mock.Mock(
+            token=kwargs.get('token'),
+            **{'get_access.return_value.expires': self.expires})
+        first = clients.get_password_client('compute', self.factory, 600)
+        self.assertIs(self.session, first.session)
+        self.assertIs(first, clients.get_password_client(
+            'compute', self.factory, 600))
+        self.assertEqual('secret', self.load.call_args[1]['password'])
+
+        # Separate from the clients of tokens
+        self.assertIsNot(first, clients.get_token_client(
+            'compute', 'a', mock.Mock()))
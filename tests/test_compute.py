@@ -0,0 +1,117 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from flask import Flask
+import mock
+from oslo_serialization import jsonutils
+import testtools
+
+from ardana_service import compute
+from ardana_service import playbooks  # noqa: F401
+
+app = Flask(__name__)
+app.register_blueprint(compute.bp)
+
+
+class FakeAggregate(object):
+    def __init__(self, id, hosts, availability_zone=None):
+        self.id = id
+        self.name = 'agg%d' % id
+        self.availability_zone = availability_zone
+        if hosts is not None:
+            self.hosts = hosts
+
+
+class TestAggregates(testtools.TestCase):
+
+    def setUp(self):
+        super(TestAggregates, self).setUp()
+        self.client = app.test_client()
+        self.useFixture(fixtures.MockPatchObject(
+            compute, '_aggregate_indexes', {}))
+
+        self.compute_client = mock.Mock()
+        self.aggregates = self.compute_client.aggregates
+        self.aggregates.list.return_value = [
+            FakeAggregate(1, ['comp1', 'comp2']),
+            FakeAggregate(2, ['comp2'], 'az1'),
+            FakeAggregate(3, ['comp1']),
+            # Details are fetched only when the listing lacks the hosts
+            FakeAggregate(4, None),
+        ]
+        self.aggregates.get.return_value = FakeAggregate(4, ['comp2'])
+        self.useFixture(fixtures.MockPatchObject(
+            compute, 'get_compute_client', return_value=self.compute_client))
+
+    def test_get_aggregates(self):
+        resp = self.client.get('/api/v2/compute/aggregates/comp2')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([1, 2, 4],
+                         [a['id'] for a in jsonutils.loads(resp.data)])
+        self.assertEqual(1, self.aggregates.get.call_count)
+
+        # The index is shared by later requests made with the same token
+        resp = self.client.get('/api/v2/compute/aggregates/comp1')
+        self.assertEqual([1, 3],
+                         [a['id'] for a in jsonutils.loads(resp.data)])
+        self.assertEqual(1, self.aggregates.list.call_count)
+
+        # But not by those of other tokens
+        self.client.get('/api/v2/compute/aggregates/comp1',
+                        headers={'X-Auth-Token': 'other'})
+        self.assertEqual(2, self.aggregates.list.call_count)
+
+    def test_delete_aggregates(self):
+        # The aggregates are listed again rather than trusting the index
+        self.client.get('/api/v2/compute/aggregates/comp2')
+        self.aggregates.list.return_value.append(FakeAggregate(5, ['comp2']))
+
+        resp = self.client.delete('/api/v2/compute/aggregates/comp2')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([{'id': 1, 'name': 'agg1',
+                           'availability_zone': None},
+                          {'id': 2, 'name': 'agg2',
+                           'availability_zone': 'az1'},
+                          {'id': 4, 'name': 'agg4',
+                           'availability_zone': None},
+                          {'id': 5, 'name': 'agg5',
+                           'availability_zone': None}],
+                         jsonutils.loads(resp.data))
+        self.assertEqual(
+            [mock.call(1, 'comp2'), mock.call(2, 'comp2'),
+             mock.call(4, 'comp2'), mock.call(5, 'comp2')],
+            sorted(self.aggregates.remove_host.call_args_list))
+        self.assertEqual(2, self.aggregates.list.call_count)
+
+        # The aggregates are listed again after changing them
+        self.client.get('/api/v2/compute/aggregates/comp2')
+        self.assertEqual(3, self.aggregates.list.call_count)
+
+    def test_delete_aggregates_failure(self):
+        def remove_host(id, hostname):
+            if id == 3:
+                raise Exception('Internal error')
+
+        self.aggregates.remove_host.side_effect = remove_host
+        resp = self.client.delete('/api/v2/compute/aggregates/comp1')
+        self.assertEqual(500, resp.status_code)
+        contents = jsonutils.loads(resp.data)['contents']
+        self.assertEqual([1], [a['id'] for a in contents['deleted']])
+        self.assertEqual('Internal error', contents['failed'][0]['error'])
+
+    def test_delete_no_aggregates(self):
+        resp = self.client.delete('/api/v2/compute/aggregates/comp9')
+        self.assertEqual(410, resp.status_code)
+        self.aggregates.remove_host.assert_not_called()
@@ -0,0 +1,170 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import eventlet
+import fixtures
+import itertools
+import mock
+from novaclient import exceptions as nova_exceptions
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+import testtools
+
+from ardana_service import config  # noqa: F401
+from ardana_service import migrations
+
+
+class FakeServer(object):
+    def __init__(self, id, host, status='ACTIVE', task_state=None):
+        self.id = id
+        self.name = 'vm-%s' % id
+        self.status = status
+        setattr(self, migrations.HOST_ATTR, host)
+        setattr(self, migrations.TASK_STATE_ATTR, task_state)
+
+
+class FakeServers(object):
+    # Instances move to the target host after being polled a couple of times,
+    # except for those that are to fail
+    def __init__(self, reject=(), roll_back=(), unavailable=()):
+        self.reject = reject
+        self.roll_back = roll_back
+        self.unavailable = unavailable
+        self.polls = collections.defaultdict(int)
+        self.in_progress = 0
+        self.max_in_progress = 0
+
+    def live_migrate(self, id, host, block_migration=None):
+        if id in self.reject:
+            raise Exception('No valid host')
+        self.target = host
+        self.in_progress += 1
+        self.max_in_progress = max(self.max_in_progress, self.in_progress)
+
+    def get(self, id):
+        self.polls[id] += 1
+        if id in self.unavailable and self.polls[id] == 1:
+            raise Exception('Service Unavailable')
+        if self.polls[id] < 3:
+            return FakeServer(id, 'src', 'MIGRATING', 'migrating')
+
+        if self.polls[id] == 3:
+            self.in_progress -= 1
+        if id in self.roll_back:
+            return FakeServer(id, 'src')
+        return FakeServer(id, self.target)
+
+
+class TestMigrations(testtools.TestCase):
+
+    def setUp(self):
+        super(TestMigrations, self).setUp()
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='compute', max_concurrent_migrations=2)
+        self.useFixture(fixtures.MockPatchObject(
+            migrations, '_migrations', collections.OrderedDict()))
+
+        # Run the migration to completion when it starts, letting the
+        # migrations of the instances take turns
+        self.socketio = self.useFixture(fixtures.MockPatchObject(
+            migrations, 'socketio')).mock
+        self.socketio.start_background_task.side_effect = \
+            lambda func, *args: func(*args)
+        self.socketio.sleep.side_effect = lambda seconds: eventlet.sleep(0)
+
+    def migrate(self, servers, count=5):
+        client = mock.Mock()
+        client.servers = servers
+        instances = [FakeServer(str(i), 'src') for i in range(count)]
+        return migrations.start(client, 'src', 'dst', instances)
+
+    def test_migrate(self):
+        servers = FakeServers()
+        migration = self.migrate(servers)
+
+        status = migration.get_status()
+        self.assertEqual('completed', status['status'])
+        self.assertEqual({'queued': 0, 'migrating': 0, 'migrated': 5,
+                          'failed': 0}, status['counts'])
+        self.assertEqual(2, servers.max_in_progress)
+
+        # Progress is sent to the room of the migration
+        emitted = [c[0][0] for c in self.socketio.emit.call_args_list]
+        self.assertEqual(11, len(emitted))
+        self.assertEqual('migration', emitted[-1])
+        for c in self.socketio.emit.call_args_list:
+            self.assertEqual(migration.room, c[1]['room'])
+
+        self.assertIs(migration, migrations.get_migration(migration.id))
+
+    def test_failures(self):
+        servers = FakeServers(reject=('1',), roll_back=('3',))
+        migration = self.migrate(servers)
+
+        status = migration.get_status()
+        self.assertEqual({'queued': 0, 'migrating': 0, 'migrated': 3,
+                          'failed': 2}, status['counts'])
+        instances = dict((i['id'], i) for i in status['instances'])
+        self.assertEqual('No valid host', instances['1']['error'])
+        self.assertEqual('Instance remained on src', instances['3']['error'])
+        self.assertNotIn('error', instances['0'])
+
+    def test_failed_polls_are_retried(self):
+        servers = FakeServers(unavailable=('0', '2'))
+        migration = self.migrate(servers)
+
+        status = migration.get_status()
+        self.assertEqual({'queued': 0, 'migrating': 0, 'migrated': 5,
+                          'failed': 0}, status['counts'])
+
+    def test_deleted_instance(self):
+        servers = FakeServers()
+        servers.get = mock.Mock(side_effect=nova_exceptions.NotFound(404))
+        migration = self.migrate(servers, 1)
+
+        instance = migration.get_status()['instances'][0]
+        self.assertEqual('failed', instance['status'])
+        self.assertEqual('Instance no longer exists', instance['error'])
+
+    def test_timeout(self):
+        self.conf.config(group='compute', migration_timeout_minutes=1)
+        servers = FakeServers(unavailable=('0',))
+        clock = self.useFixture(fixtures.MockPatchObject(
+            migrations, 'time')).mock
+        clock.time.side_effect = itertools.count(0, 61)
+        migration = self.migrate(servers, 1)
+
+        instance = migration.get_status()['instances'][0]
+        self.assertEqual('failed', instance['status'])
+        self.assertEqual('Timed out waiting for the migration to complete',
+                         instance['error'])
+
+    def test_already_migrating(self):
+        self.socketio.start_background_task.side_effect = None
+        self.assertIsNotNone(self.migrate(FakeServers()))
+        self.assertIsNone(self.migrate(FakeServers()))
+
+    def test_finished_are_forgotten(self):
+        self.useFixture(fixtures.MockPatchObject(migrations, 'MAX_FINISHED',
+                                                 1))
+        first = self.migrate(FakeServers(), 1)
+        second = self.migrate(FakeServers(), 1)
+        self.assertNotEqual(first.id, second.id)
+        self.assertIs(first, migrations.get_migration(first.id))
+
+        third = self.migrate(FakeServers(), 1)
+        self.assertIsNone(migrations.get_migration(first.id))
+        self.assertIs(second, migrations.get_migration(second.id))
+        self.assertIs(third, migrations.get_migration(third.id))
@@ -14,17 +14,29 @@
 
 from contextlib import contextmanager
 import copy
+import eventlet
+import fixtures
+from flask import Flask
+import mock
 import os
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import shutil
 import six
 import testtools
 import yaml
 
 from ardana_service import model
+from ardana_service import yaml_io
 
 TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
 LOG = logging.getLogger(__name__)
 
+app = Flask(__name__)
+app.register_blueprint(model.bp)
+
 
 @contextmanager
 def log_level(level, name):
@@ -62,6 +74,306 @@ class TestReadModels(testtools.TestCase):
         # No exceptions should be thrown
 
 
+class TestModelCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestModelCache, self).setUp()
+        # Work on a private copy of the model since the tests modify files
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.model_dir = os.path.join(tempdir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'one_passthrough'),
+                        self.model_dir)
+
+    def test_cached_model_is_reused(self):
+        first = model.read_cached_model(self.model_dir)
+        second = model.read_cached_model(self.model_dir)
+        self.assertIs(first, second)
+
+    def test_read_model_returns_copy(self):
+        first = model.read_model(self.model_dir)
+        first['inputModel']['servers'].pop()
+
+        second = model.read_model(self.model_dir)
+        self.assertEqual(len(first['inputModel']['servers']) + 1,
+                         len(second['inputModel']['servers']))
+
+    def test_modified_file_is_reread(self):
+        before = model.read_model(self.model_dir)
+
+        filename = os.path.join(self.model_dir, 'data', 'servers.yml')
+        with open(filename) as f:
+            doc = yaml.safe_load(f)
+        doc['servers'].append({'id': 'new-server'})
+        with open(filename, 'w') as f:
+            yaml.safe_dump(doc, f)
+
+        after = model.read_model(self.model_dir)
+        self.assertEqual(len(before['inputModel']['servers']) + 1,
+                         len(after['inputModel']['servers']))
+        self.assertEqual('new-server',
+                         after['inputModel']['servers'][-1]['id'])
+
+    def test_only_modified_file_is_reparsed(self):
+        model.read_model(self.model_dir)
+
+        filename = os.path.join(self.model_dir, 'data', 'servers.yml')
+        with open(filename, 'a') as f:
+            f.write('# trailing comment\n')
+
+        before = model.get_cache_stats()
+        model.read_model(self.model_dir)
+        after = model.get_cache_stats()
+
+        self.assertEqual(1, after['file_misses'] - before['file_misses'])
+        self.assertEqual(1, after['model_misses'] - before['model_misses'])
+
+        # Nothing further has changed, so this is a hit of the entire model
+        model.read_model(self.model_dir)
+        self.assertEqual(after['file_misses'],
+                         model.get_cache_stats()['file_misses'])
+        self.assertEqual(after['model_hits'] + 1,
+                         model.get_cache_stats()['model_hits'])
+
+    def test_removed_file_is_detected(self):
+        before = model.read_model(self.model_dir)
+        self.assertIn('control-planes', before['inputModel'])
+
+        os.unlink(os.path.join(self.model_dir, 'data', 'control_plane.yml'))
+
+        after = model.read_model(self.model_dir)
+        self.assertNotIn('control-planes', after['inputModel'])
+
+
+class TestEntityEndpoints(testtools.TestCase):
+
+    def setUp(self):
+        super(TestEntityEndpoints, self).setUp()
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        self.model_dir = os.path.join(tempdir, 'model')
+        shutil.copytree(os.path.join(TEST_DATA_DIR, 'one_passthrough'),
+                        self.model_dir)
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', model_dir=self.model_dir)
+        self.client = app.test_client()
+
+    def read_file(self, relname):
+        with open(os.path.join(self.model_dir, relname)) as f:
+            return f.read()
+
+    def test_get_by_id(self):
+        resp = self.client.get('/api/v2/model/entities/servers/controller2')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('controller2', jsonutils.loads(resp.data)['id'])
+
+        resp = self.client.get('/api/v2/model/entities/servers/missing')
+        self.assertEqual(404, resp.status_code)
+
+    def test_patch_by_id(self):
+        untouched = self.read_file('data/control_plane.yml')
+
+        patch = [{'op': 'replace', 'path': '/ip-addr', 'value': '10.0.0.9'},
+                 {'op': 'add', 'path': '/foo', 'value': 'bar'}]
+        resp = self.client.patch(
+            '/api/v2/model/entities/servers/controller2',
+            data=jsonutils.dumps(patch),
+            content_type='application/json-patch+json')
+        self.assertEqual(200, resp.status_code)
+
+        server = model.read_model()['inputModel']['servers'][1]
+        self.assertEqual('controller2', server['id'])
+        self.assertEqual('10.0.0.9', server['ip-addr'])
+        self.assertEqual('bar', server['foo'])
+        self.assertEqual(untouched, self.read_file('data/control_plane.yml'))
+
+    def test_patch_invalid(self):
+        patch = [{'op': 'remove', 'path': '/nonexistent'}]
+        resp = self.client.patch(
+            '/api/v2/model/entities/servers/controller2',
+            data=jsonutils.dumps(patch),
+            content_type='application/json-patch+json')
+        self.assertEqual(400, resp.status_code)
+
+    def test_rename_to_existing_id(self):
+        patch = [{'op': 'replace', 'path': '/id', 'value': 'controller1'}]
+        resp = self.client.patch(
+            '/api/v2/model/entities/servers/controller2',
+            data=jsonutils.dumps(patch),
+            content_type='application/json-patch+json')
+        self.assertEqual(400, resp.status_code)
+
+    def test_delete_by_id(self):
+        before = len(model.read_model()['inputModel']['servers'])
+        resp = self.client.delete(
+            '/api/v2/model/entities/servers/controller2')
+        self.assertEqual(200, resp.status_code)
+
+        servers = model.read_model()['inputModel']['servers']
+        self.assertEqual(before - 1, len(servers))
+        self.assertNotIn('controller2', [s['id'] for s in servers])
+
+    def test_batch(self):
+        servers = model.read_model()['inputModel']['servers']
+        before = [s['id'] for s in servers]
+        new_server = dict(servers[0], id='compute8')
+
+        operations = [
+            {'op': 'create', 'entity': 'servers', 'data': new_server},
+            {'op': 'patch', 'entity': 'servers', 'id': 'compute8',
+             'patch': [{'op': 'replace', 'path': '/id',
+                        'value': 'compute9'}]},
+            {'op': 'update', 'entity': 'servers', 'id': 'controller1',
+             'data': dict(servers[0], foo='bar')},
+            {'op': 'delete', 'entity': 'servers', 'id': 'controller2'},
+        ]
+        with mock.patch.object(model, 'write_model',
+                               wraps=model.write_model) as write_model:
+            resp = self.client.post('/api/v2/model/entities',
+                                    data=jsonutils.dumps(operations),
+                                    content_type='application/json')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(1, write_model.call_count)
+
+        results = jsonutils.loads(resp.data)
+        self.assertEqual(['success'] * 4, [r['status'] for r in results])
+        self.assertEqual('compute9', results[1]['id'])
+
+        servers = model.read_model()['inputModel']['servers']
+        ids = [s['id'] for s in servers]
+        expected = [i for i in before if i != 'controller2'] + ['compute9']
+        self.assertEqual(expected, ids)
+        self.assertEqual('bar', servers[0]['foo'])
+
+    def test_batch_is_atomic(self):
+        untouched = self.read_file('data/servers.yml')
+
+        operations = [
+            {'op': 'delete', 'entity': 'servers', 'id': 'controller2'},
+            {'op': 'delete', 'entity': 'servers', 'id': 'missing'},
+            {'op': 'create', 'entity': 'nonexistent', 'data': {'id': 'x'}},
+        ]
+        resp = self.client.post('/api/v2/model/entities',
+                                data=jsonutils.dumps(operations),
+                                content_type='application/json')
+        self.assertEqual(400, resp.status_code)
+
+        results = jsonutils.loads(resp.data)
+        self.assertEqual(['success', 'error', 'error'],
+                         [r['status'] for r in results])
+        self.assertEqual(untouched, self.read_file('data/servers.yml'))
+
+
+class TestCpInternal(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCpInternal, self).setUp()
+        self.internal_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', cp_internal_dir=self.internal_dir)
+        self.client = app.test_client()
+
+        cloud_model = {'internal': {'servers': [{'id': 'controller1'}],
+                                    'control-planes': {}}}
+        with open(os.path.join(self.internal_dir, 'CloudModel.yaml'),
+                  'w') as f:
+            yaml.safe_dump(cloud_model, f)
+
+    def test_parsed_contents_are_cached(self):
+        first = model.read_cp_internal_json('CloudModel.yaml')
+        before = model.get_cache_stats()
+        second = model.read_cp_internal_json('CloudModel.yaml')
+
+        self.assertIs(first, second)
+        self.assertEqual(before['cp_internal_hits'] + 1,
+                         model.get_cache_stats()['cp_internal_hits'])
+
+    def test_conversion_is_single_flight(self):
+        read_yml_file = model.read_yml_file
+
+        def slow_read(*args, **kwargs):
+            eventlet.sleep(0.05)
+            return read_yml_file(*args, **kwargs)
+
+        with mock.patch.object(model, 'read_yml_file',
+                               side_effect=slow_read) as read:
+            pool = eventlet.GreenPool()
+            results = list(pool.imap(model.read_cp_internal_json,
+                                     ['CloudModel.yaml'] * 3))
+
+        self.assertEqual(1, read.call_count)
+        self.assertEqual(['controller1'] * 3,
+                         [r['internal']['servers'][0]['id'] for r in results])
+
+        # Only the json file remains, without any temporary files
+        self.assertEqual(['CloudModel.json', 'CloudModel.yaml'],
+                         sorted(os.listdir(self.internal_dir)))
+
+    def test_prewarm(self):
+        with mock.patch.object(model, 'read_yml_file',
+                               wraps=model.read_yml_file) as read:
+            model.prewarm_cp_internal()
+            model.read_cp_internal_json('CloudModel.yaml')
+
+        self.assertEqual(1, read.call_count)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.internal_dir, 'CloudModel.json')))
+
+    def test_fields(self):
+        resp = self.client.get('/api/v2/model/cp_internal/CloudModel.yaml',
+                               query_string={'fields': 'internal.servers'})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({'internal': {'servers': [{'id': 'controller1'}]}},
+                         jsonutils.loads(resp.data))
+
+        resp = self.client.get('/api/v2/model/cp_internal/CloudModel.yaml',
+                               query_string={'fields': 'internal.foo'})
+        self.assertEqual(400, resp.status_code)
+
+
+class TestDeployedHostnames(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDeployedHostnames, self).setUp()
+        playbooks_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', playbooks_dir=playbooks_dir)
+        os.mkdir(os.path.join(playbooks_dir, 'hosts'))
+        self.inventory = os.path.join(playbooks_dir, 'hosts', 'verb_hosts')
+        with open(self.inventory, 'w') as f:
+            f.write('[resources]\n')
+
+        self.addCleanup(model.invalidate_deployed_hostnames)
+        model.invalidate_deployed_hostnames()
+
+        popen = self.useFixture(fixtures.MockPatchObject(
+            model.subprocess, 'Popen')).mock
+        popen.return_value.communicate.return_value = (b'  host1\n  host2\n',
+                                                       None)
+        popen.return_value.returncode = 0
+        self.popen = popen
+
+    def test_hostnames_are_cached(self):
+        self.assertEqual(['host1', 'host2'], model.get_deployed_hostnames())
+        self.assertEqual(['host1', 'host2'], model.get_deployed_hostnames())
+        self.assertEqual(1, self.popen.call_count)
+
+    def test_inventory_change_invalidates(self):
+        model.get_deployed_hostnames()
+        mtime = os.path.getmtime(self.inventory)
+        os.utime(self.inventory, (mtime + 10, mtime + 10))
+        model.get_deployed_hostnames()
+        self.assertEqual(2, self.popen.call_count)
+
+        model.invalidate_deployed_hostnames()
+        model.get_deployed_hostnames()
+        self.assertEqual(3, self.popen.call_count)
+
+    def test_failure_is_not_cached(self):
+        self.popen.return_value.returncode = 1
+        model.get_deployed_hostnames()
+        model.get_deployed_hostnames()
+        self.assertEqual(2, self.popen.call_count)
+
+
 # Note that this class does not inherit from TestCase, but its descendants do
 class TestWriteModels(object):
 
@@ -72,6 +384,27 @@ class TestWriteModels(object):
                           if v['status'] != model.IGNORED]
         self.assertEqual(0, len(affected_files))
 
+    def test_unchanged_files_are_not_reread(self):
+        with mock.patch.object(model.yaml_io, 'safe_load',
+                               wraps=yaml_io.safe_load) as safe_load:
+            model.write_model(self.data, self.model_dir, dry_run=True)
+        self.assertEqual(0, safe_load.call_count)
+
+    def test_only_files_with_changes_are_compared(self):
+        model.read_cached_model(self.model_dir)
+        disk_model = self.data['inputModel']['disk-models'][0]
+        disk_model['volume-groups'] = []
+
+        with mock.patch.object(model, 'write_file',
+                               wraps=model.write_file) as write_file:
+            changes = model.write_model(self.data, self.model_dir,
+                                        dry_run=True)
+
+        self.assertEqual(1, write_file.call_count)
+        filename = write_file.call_args[0][1]
+        self.assertIn(disk_model, changes[filename]['data']['disk-models'])
+        self.assertEqual(model.CHANGED, changes[filename]['status'])
+
     def test_add_servers(self):
         before_len = len(self.data['inputModel']['servers'])
 
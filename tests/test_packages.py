@@ -0,0 +1,149 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from flask import Flask
+import json
+import os
+from oslo_serialization import jsonutils
+from promise import Promise
+import testtools
+
+from ardana_service import packages
+from ardana_service import plays
+
+app = Flask(__name__)
+app.register_blueprint(packages.bp)
+app.register_blueprint(plays.bp)
+
+HOST_PKGS = {
+    'host1': {
+        'ts_os_pkgs': ['monasca-20180820T190346Z'],
+        'zypper_cloud_pkgs': {'python-pymongo': '3.1.1-1.55'},
+    },
+    'host2': {
+        'ts_os_pkgs': [],
+        'zypper_cloud_pkgs': {'python-pymongo': '3.1.1-1.56'},
+    },
+}
+
+
+class TestGetPackages(testtools.TestCase):
+
+    def setUp(self):
+        super(TestGetPackages, self).setUp()
+        self.client = app.test_client()
+        self.host_pkgs_file = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'host_pkgs')
+        self.useFixture(fixtures.MockPatchObject(
+            packages, 'HOST_PKGS_FILE', self.host_pkgs_file))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_service.packages._scan', None))
+        self.useFixture(fixtures.MonkeyPatch(
+            'ardana_service.packages._last_result', None))
+        self.useFixture(fixtures.MockPatchObject(
+            packages, 'update_openstack_pkg_cache',
+            side_effect=lambda: (
+                {'monasca': {'available': '2.2.1-19.155', 'installed': []}},
+                {'monasca-20180820T190346Z': '2.2.1-19.155'})))
+
+        self.promise = Promise()
+        self.run_playbook = self.useFixture(fixtures.MockPatchObject(
+            packages, 'run_playbook',
+            return_value={'id': '1', 'promise': self.promise})).mock
+
+    def finish_play(self):
+        with open(self.host_pkgs_file, 'w') as f:
+            json.dump(HOST_PKGS, f)
+        self.promise.do_resolve('Success')
+
+    def check_result(self, resp):
+        self.assertEqual(200, resp.status_code)
+        result = jsonutils.loads(resp.data)
+        self.assertEqual([{'name': 'monasca',
+                           'available': '2.2.1-19.155',
+                           'installed': ['2.2.1-19.155']}],
+                         result['openstack_venv_packages'])
+        self.assertEqual([{'name': 'python-pymongo',
+                           'versions': ['3.1.1-1.55', '3.1.1-1.56']}],
+                         sorted(result['cloud_installed_packages'],
+                                key=lambda p: p['name']))
+        self.assertFalse(os.path.exists(self.host_pkgs_file))
+
+    def test_sync(self):
+        self.finish_play()
+        self.check_result(self.client.get('/api/v2/packages'))
+
+    def test_async(self):
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true'})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual({'id': '1'}, jsonutils.loads(resp.data))
+        self.assertTrue(resp.headers['Location'].endswith('/api/v2/plays/1'))
+
+        # Requests made while the scan runs share it
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true'})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(1, self.run_playbook.call_count)
+
+        # The result is kept once the scan is done
+        self.finish_play()
+        for i in range(2):
+            self.check_result(self.client.get(
+                '/api/v2/packages', query_string={'async': 'true'}))
+        self.assertEqual(1, self.run_playbook.call_count)
+
+        # Until a refresh is requested
+        self.promise = Promise()
+        self.run_playbook.return_value = {'id': '2', 'promise': self.promise}
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true',
+                                             'refresh': 'true'})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual({'id': '2'}, jsonutils.loads(resp.data))
+
+    def test_failure(self):
+        # The playbook did not produce any data
+        self.promise.do_reject(Exception('failed'))
+        resp = self.client.get('/api/v2/packages')
+        self.assertEqual(404, resp.status_code)
+
+    def test_async_failure_is_kept(self):
+        self.promise.do_reject(Exception('failed'))
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true'})
+        self.assertEqual(202, resp.status_code)
+
+        # The failure is returned without scanning again
+        for i in range(2):
+            resp = self.client.get('/api/v2/packages',
+                                   query_string={'async': 'true'})
+            self.assertEqual(404, resp.status_code)
+            self.assertIn(b'play 1', resp.data)
+        self.assertEqual(1, self.run_playbook.call_count)
+
+        # Until a refresh is requested
+        self.run_playbook.return_value = {'id': '2', 'promise': Promise()}
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true',
+                                             'refresh': 'true'})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(2, self.run_playbook.call_count)
+
+    def test_playbook_error(self):
+        self.run_playbook.side_effect = Exception('cannot run')
+        resp = self.client.get('/api/v2/packages',
+                               query_string={'async': 'true'})
+        self.assertEqual(404, resp.status_code)
@@ -0,0 +1,137 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import testtools
+
+from ardana_service import play_progress
+
+# Output of ansible 1.9, as produced by the Ardana playbooks
+ANSIBLE_1_OUTPUT = b"""
+PLAY [FND-MDB] ****************************************************************
+
+TASK: [FND-MDB | start | Check if singlenode setup] ***************************
+failed: [ccp-m2] => {"changed": true, "cmd": ["grep"], "rc": 1}
+...ignoring
+changed: [ccp-m1]
+
+TASK: [FND-MDB | start | Restart MDB Master] **********************************
+skipping: [ccp-m1] => (item=mysql)
+ok: [ccp-m2] => (item=mysql) => {"changed": false, "item": "mysql"}
+fatal: [ccp-m3] => SSH Error: data could not be sent to the remote host
+
+PLAY RECAP ********************************************************************
+FND-MDB | start | Restart MDB Master ---------------------------------- 90.41s
+-------------------------------------------------------------------------------
+Total: --------------------------------------------------------------- 90.41s
+ccp-m1                     : ok=12   changed=7    unreachable=0    failed=0
+ccp-m2                     : ok=11   changed=3    unreachable=0    failed=1
+"""
+
+# Output of ansible 2.x
+ANSIBLE_2_OUTPUT = b"""
+PLAY [localhost] **************************************************************
+
+TASK [Gathering Facts] ********************************************************
+ok: [localhost]
+
+TASK [deployer-setup | Copy files] ********************************************
+changed: [localhost -> 127.0.0.1]
+fatal: [remote]: UNREACHABLE! => {"changed": false, "unreachable": true}
+fatal: [other]: FAILED! => {"changed": false, "msg": "oops"}
+...ignoring
+
+RUNNING HANDLER [deployer-setup | restart] ************************************
+\x1b[0;33mchanged: [localhost]\x1b[0m
+
+PLAY RECAP ********************************************************************
+localhost                  : ok=3    changed=2    unreachable=0    failed=0   \
+skipped=1
+"""
+
+
+class TestProgressParser(testtools.TestCase):
+
+    def parse(self, output):
+        events = play_progress.ProgressParser().feed(output)
+        for e in events:
+            self.assertIsInstance(e.pop('timestamp'), int)
+        return events
+
+    def test_ansible_1(self):
+        task1 = 'FND-MDB | start | Check if singlenode setup'
+        task2 = 'FND-MDB | start | Restart MDB Master'
+        self.assertEqual([
+            {'event': 'play', 'name': 'FND-MDB'},
+            {'event': 'task', 'name': task1, 'play': 'FND-MDB'},
+            {'event': 'result', 'host': 'ccp-m2', 'status': 'failed',
+             'task': task1},
+            {'event': 'ignored', 'host': 'ccp-m2', 'task': task1},
+            {'event': 'result', 'host': 'ccp-m1', 'status': 'changed',
+             'task': task1},
+            {'event': 'task', 'name': task2, 'play': 'FND-MDB'},
+            {'event': 'result', 'host': 'ccp-m1', 'status': 'skipping',
+             'task': task2, 'item': 'mysql'},
+            {'event': 'result', 'host': 'ccp-m2', 'status': 'ok',
+             'task': task2, 'item': 'mysql'},
+            {'event': 'result', 'host': 'ccp-m3', 'status': 'failed',
+             'task': task2},
+            {'event': 'recap', 'host': 'ccp-m1', 'ok': 12, 'changed': 7,
+             'unreachable': 0, 'failed': 0},
+            {'event': 'recap', 'host': 'ccp-m2', 'ok': 11, 'changed': 3,
+             'unreachable': 0, 'failed': 1},
+        ], self.parse(ANSIBLE_1_OUTPUT))
+
+    def test_ansible_2(self):
+        task = 'deployer-setup | Copy files'
+        handler = 'deployer-setup | restart'
+        self.assertEqual([
+            {'event': 'play', 'name': 'localhost'},
+            {'event': 'task', 'name': 'Gathering Facts', 'play': 'localhost'},
+            {'event': 'result', 'host': 'localhost', 'status': 'ok',
+             'task': 'Gathering Facts'},
+            {'event': 'task', 'name': task, 'play': 'localhost'},
+            {'event': 'result', 'host': 'localhost', 'status': 'changed',
+             'task': task},
+            {'event': 'result', 'host': 'remote', 'status': 'unreachable',
+             'task': task},
+            {'event': 'result', 'host': 'other', 'status': 'failed',
+             'task': task},
+            {'event': 'ignored', 'host': 'other', 'task': task},
+            {'event': 'task', 'name': handler, 'play': 'localhost'},
+            {'event': 'result', 'host': 'localhost', 'status': 'changed',
+             'task': handler},
+            {'event': 'recap', 'host': 'localhost', 'ok': 3, 'changed': 2,
+             'unreachable': 0, 'failed': 0, 'skipped': 1},
+        ], self.parse(ANSIBLE_2_OUTPUT))
+
+    def test_partial_lines(self):
+        parser = play_progress.ProgressParser()
+        events = parser.feed(b'TASK [one] ***\nok: [ho')
+        self.assertEqual(['task'], [e['event'] for e in events])
+        events = parser.feed(b'st1]\nok: [host2]')
+        self.assertEqual([('result', 'host1')],
+                         [(e['event'], e['host']) for e in events])
+
+        events = parser.finish()
+        self.assertEqual([('result', 'host2')],
+                         [(e['event'], e['host']) for e in events])
+        self.assertEqual([], parser.finish())
+
+    def test_ignores_other_output(self):
+        parser = play_progress.ProgressParser()
+        self.assertEqual([], parser.feed(
+            b'ansible-playbook -i hosts/localhost site.yml\n'
+            b'ok: not a result\n'
+            b'...ignoring\n'
+            b'localhost : ok=1 changed=0 unreachable=0 failed=0\n'))
@@ -12,7 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fixtures
+import gzip
 import json
+import mock
+import os
 from oslo_config import cfg
 from oslo_config import fixture as oslo_fixture
 import testtools
@@ -120,3 +124,264 @@ class TestArgProcessing(testtools.TestCase):
 
         num = cmdline.count('--verbose')
         self.assertTrue(num == 3)
+
+
+class TestCompletionHooks(testtools.TestCase):
+
+    def test_hooks_called_for_matching_playbook(self):
+        calls = []
+        self.patch(playbooks, '_completion_hooks',
+                   playbooks.collections.defaultdict(list))
+        playbooks.add_completion_hook('site', calls.append)
+        playbooks.add_completion_hook('wipe_disks', self.fail)
+
+        playbooks.run_completion_hooks('site.yml', '1234')
+        self.assertEqual(['1234'], calls)
+
+    def test_failing_hook_does_not_stop_others(self):
+        calls = []
+        self.patch(playbooks, '_completion_hooks',
+                   playbooks.collections.defaultdict(list))
+        playbooks.add_completion_hook('site', lambda id: 1 / 0)
+        playbooks.add_completion_hook('site', calls.append)
+
+        playbooks.run_completion_hooks('site.yml', '1234')
+        self.assertEqual(['1234'], calls)
+
+
+class FakeProcess(object):
+    def __init__(self, returncode=0, running=0):
+        self.returncode = returncode
+        self.running = running
+
+    def poll(self):
+        # Report the process as running for the given number of polls
+        self.running -= 1
+        return self.running < 0
+
+
+class TestMonitorOutput(testtools.TestCase):
+
+    def setUp(self):
+        super(TestMonitorOutput, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.socketio = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'socketio')).mock
+        self.useFixture(fixtures.MockPatchObject(playbooks, 'scheduler'))
+        self.useFixture(fixtures.MockPatchObject(playbooks.plays, 'plays',
+                                                 {'1': {}}))
+        self.promise = mock.Mock()
+
+        playbooks.plays.write_metadata({'id': '1', 'startTime': 1})
+        playbooks.plays.register_running('1', {'pid': 1})
+
+    def write_log(self, text):
+        with open(playbooks.get_log_file('1'), 'ab') as f:
+            f.write(text.encode('utf-8'))
+
+    def emitted(self, name='log'):
+        return [c[0][1:] for c in self.socketio.emit.call_args_list
+                if c[0][0] == name]
+
+    def test_batches(self):
+        self.conf.config(group='plays', log_batch_bytes=10)
+        self.write_log(u'one\ntwo\nthree \u2713\nfour')
+
+        playbooks.monitor_output(FakeProcess(), '1', None, self.promise)
+
+        # Lines are not split between batches, except for those longer than
+        # a batch, and the final partial line is sent at the end
+        self.assertEqual([('one\ntwo\n', 8),
+                          (u'three \u2713\n', 18),
+                          ('four', 22)], self.emitted())
+        self.socketio.emit.assert_any_call('end', room='1')
+
+        play = playbooks.plays.read_metadata('1')
+        self.assertEqual(0, play['code'])
+        self.assertEqual(22, play['logSize'])
+        self.assertEqual({}, playbooks.plays.read_running_registry())
+        self.promise.do_resolve.assert_called_once_with('Success')
+
+    def test_follows_output(self):
+        self.write_log('old\n')
+        self.socketio.sleep.side_effect = \
+            lambda interval: self.write_log('TASK [one] ***\nok: [host]\n')
+
+        playbooks.monitor_output(FakeProcess(returncode=2, running=1), '1',
+                                 None, self.promise, offset=4)
+
+        self.assertEqual([('TASK [one] ***\nok: [host]\n', 30)],
+                         self.emitted())
+        self.assertEqual([['task', 'result']],
+                         [[e['event'] for e in events]
+                          for (events, count) in self.emitted('progress')])
+        self.assertEqual(2, playbooks.plays.read_metadata('1')['code'])
+        self.assertTrue(self.promise.do_reject.called)
+
+
+class TestPlayProcess(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPlayProcess, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.rc_file = playbooks.plays.get_play_file('1', '.rc')
+
+    def test_start_playbook(self):
+        self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'build_command_line',
+            return_value=['sh', '-c', 'echo hello; exit 3']))
+        self.useFixture(fixtures.MockPatchObject(
+            playbooks.sshagent.sshagent, 'get_instance'))
+        follow_play = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'follow_play')).mock
+
+        playbooks.start_playbook('site.yml', {}, None, None, '1', None)
+
+        process = follow_play.call_args[0][2]
+        process.popen.wait()
+        self.assertTrue(process.poll())
+        self.assertEqual(3, process.returncode)
+        with open(playbooks.get_log_file('1')) as f:
+            self.assertEqual('hello\n', f.read())
+        self.assertEqual({'pid': process.pid, 'playbook': 'site.yml',
+                          'vaultFile': None},
+                         playbooks.plays.read_running_registry()['1'])
+
+    def test_reattached(self):
+        # A process started by an earlier run of the service is followed
+        # through its pid, and then through the file with its exit code
+        process = playbooks.PlayProcess('1', os.getpid())
+        self.assertFalse(process.poll())
+
+        with open(self.rc_file, 'w') as f:
+            f.write('0\n')
+        self.assertTrue(process.poll())
+        self.assertEqual(0, process.returncode)
+
+    def test_reattach_plays(self):
+        playbooks.plays.register_running('1', {'pid': 1234,
+                                               'playbook': 'site.yml'})
+        playbooks.plays.write_metadata({'id': '2', 'startTime': 2,
+                                        'queued': True})
+        scheduler = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'scheduler')).mock
+        follow_play = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'follow_play')).mock
+
+        playbooks.reattach_plays()
+
+        scheduler.add_running.assert_called_once_with('1', 'site.yml')
+        (id, playbook, process, cleanup, promise) = follow_play.call_args[0]
+        self.assertEqual(('1', 'site.yml', 1234), (id, playbook, process.pid))
+        self.assertEqual(0, follow_play.call_args[1]['offset'])
+
+        # Queued plays are abandoned
+        play = playbooks.plays.read_metadata('2')
+        self.assertNotIn('queued', play)
+        self.assertIn('endTime', play)
+
+
+class TestJoin(testtools.TestCase):
+
+    def setUp(self):
+        super(TestJoin, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.conf.config(group='plays', log_batch_bytes=8)
+        self.emit = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'emit')).mock
+        self.join_room = self.useFixture(fixtures.MockPatchObject(
+            playbooks, 'join_room')).mock
+        self.useFixture(fixtures.MockPatchObject(playbooks, 'socketio'))
+
+        with open(playbooks.get_log_file('1'), 'wb') as f:
+            f.write(b'line 1\nline 2\nline 3\n')
+
+    def emitted(self):
+        return [c[0] for c in self.emit.call_args_list]
+
+    def test_finished_play(self):
+        playbooks.on_join('1')
+        self.assertEqual([('log', 'line 1\n', 7),
+                          ('log', 'line 2\n', 14),
+                          ('log', 'line 3\n', 21),
+                          ('end',)], self.emitted())
+        self.assertFalse(self.join_room.called)
+
+    def test_offset(self):
+        playbooks.on_join({'id': '1', 'offset': 14})
+        self.assertEqual([('log', 'line 3\n', 21), ('end',)], self.emitted())
+
+    def test_events(self):
+        for (event, playbook) in (('start', 'site.yml'),
+                                  ('start', 'osconfig-run.yml'),
+                                  ('stop', 'osconfig-run.yml')):
+            playbooks.plays.append_event('1', {'event': 'playbook-' + event,
+                                               'playbook': playbook})
+
+        playbooks.on_join({'id': '1', 'offset': 21})
+        self.assertEqual([('playbook-start', 'site.yml'),
+                          ('playbook-stop', 'osconfig-run.yml'),
+                          ('end',)], self.emitted())
+
+    def test_events_of_playbook_chain(self):
+        self.useFixture(fixtures.MockPatchObject(playbooks.plays, 'plays',
+                                                 {}))
+        playbooks.follow_play('1', 'site.yml', None, None, None)
+        for event in ('start', 'stop'):
+            playbooks.plays.append_event('1', {'event': 'playbook-' + event,
+                                               'playbook': 'site.yml'})
+
+        # The next playbook of the chain is followed under the same play id
+        playbooks.follow_play('1', 'osconfig-run.yml', None, None, None)
+        playbooks.plays.append_event('1', {'event': 'playbook-start',
+                                           'playbook': 'osconfig-run.yml'})
+
+        playbooks.on_join({'id': '1', 'offset': 21})
+        self.assertEqual([('playbook-stop', 'site.yml'),
+                          ('playbook-start', 'osconfig-run.yml')],
+                         self.emitted()[:2])
+
+    def test_queued_play(self):
+        self.useFixture(fixtures.MockPatchObject(
+            playbooks.scheduler, '_running', {'100': 'site'}))
+        self.useFixture(fixtures.MockPatchObject(
+            playbooks.scheduler, '_queue', []))
+        start = mock.Mock()
+        self.assertFalse(playbooks.scheduler.submit('200', 'site', start))
+
+        playbooks.on_join('200')
+        self.assertEqual([('queued', 1)], self.emitted())
+        self.join_room.assert_called_once_with('200')
+        start.assert_not_called()
+
+    def test_archived_log(self):
+        logfile = playbooks.get_log_file('1')
+        with open(logfile, 'rb') as f, gzip.open(logfile + '.gz', 'wb') as gz:
+            gz.write(f.read())
+        os.unlink(logfile)
+
+        playbooks.on_join({'id': '1', 'offset': 7})
+        self.assertEqual([('log', 'line 2\n', 14),
+                          ('log', 'line 3\n', 21),
+                          ('end',)], self.emitted())
+
+    def test_running_play(self):
+        forwarder = playbooks.LogForwarder('1', offset=21)
+        self.useFixture(fixtures.MockPatchObject(
+            playbooks.plays, 'plays', {'1': {'forwarder': forwarder}}))
+
+        playbooks.on_join({'id': '1', 'offset': 7})
+        self.assertEqual([('log', 'line 2\n', 14),
+                          ('log', 'line 3\n', 21)], self.emitted())
+        self.join_room.assert_called_once_with('1')
+
+        # Live output continues from the replayed offset
+        forwarder.send('line 4\n')
+        playbooks.socketio.emit.assert_called_once_with(
+            'log', 'line 4\n', 28, room='1')
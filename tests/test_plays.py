@@ -0,0 +1,340 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import closing
+import fixtures
+from flask import Flask
+import json
+import os
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+from oslo_serialization import jsonutils
+import signal
+import sqlite3
+import testtools
+
+from ardana_service import config  # noqa: F401
+from ardana_service import play_index
+from ardana_service import plays
+
+app = Flask(__name__)
+app.register_blueprint(plays.bp)
+
+
+class TestGetPlays(testtools.TestCase):
+
+    def setUp(self):
+        super(TestGetPlays, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.client = app.test_client()
+
+        # Five plays of alternating playbooks, started 1000ms apart
+        for i in range(5):
+            play = {'id': str(1000 * (i + 1)),
+                    'startTime': 1000 * (i + 1),
+                    'playbook': 'site.yml' if i % 2 else 'wipe_disks.yml',
+                    'killed': False,
+                    'pid': 1}
+            if i < 4:
+                play['endTime'] = play['startTime'] + 500
+                play['code'] = i % 3
+            plays.write_metadata(play)
+
+    def get_ids(self, query_string=None):
+        resp = self.client.get('/api/v2/plays', query_string=query_string)
+        self.assertEqual(200, resp.status_code)
+        return [p['id'] for p in jsonutils.loads(resp.data)], \
+            int(resp.headers['X-Total-Count'])
+
+    def test_sorted_newest_first(self):
+        self.assertEqual((['5000', '4000', '3000', '2000', '1000'], 5),
+                         self.get_ids())
+
+    def test_pagination(self):
+        self.assertEqual((['4000', '3000'], 5),
+                         self.get_ids({'offset': 1, 'maxNumber': 2}))
+        self.assertEqual((['1000', '2000'], 5),
+                         self.get_ids({'maxNumber': 2, 'order': 'asc'}))
+
+    def test_filters(self):
+        self.assertEqual((['4000', '2000'], 2),
+                         self.get_ids({'playbook': 'site'}))
+        self.assertEqual((['5000'], 1), self.get_ids({'status': 'running'}))
+        self.assertEqual((['4000', '1000'], 2),
+                         self.get_ids({'status': 'succeeded'}))
+        self.assertEqual((['3000', '2000'], 2),
+                         self.get_ids({'startedAfter': 2000,
+                                       'startedBefore': 4000}))
+
+        resp = self.client.get('/api/v2/plays', query_string={'status': 'x'})
+        self.assertEqual(400, resp.status_code)
+
+    def test_update(self):
+        play = plays.read_metadata('5000')
+        play['endTime'] = 6000
+        play['code'] = 2
+        plays.write_metadata(play)
+
+        self.assertEqual((['5000', '3000', '2000'], 3),
+                         self.get_ids({'status': 'failed'}))
+
+    def test_index_is_rebuilt(self):
+        os.unlink(os.path.join(self.log_dir, play_index.INDEX_FILE))
+        play_index._ready.clear()
+
+        # Plays written without updating the index are also found
+        with open(os.path.join(self.log_dir, '6000.json'), 'w') as f:
+            json.dump({'id': '6000', 'startTime': 6000}, f)
+
+        self.assertEqual((['6000', '5000'], 6),
+                         self.get_ids({'maxNumber': 2}))
+
+    def test_old_index_is_rebuilt(self):
+        index_file = os.path.join(self.log_dir, play_index.INDEX_FILE)
+        with closing(sqlite3.connect(index_file)) as conn:
+            conn.execute('PRAGMA user_version = 1')
+        play_index._ready.clear()
+
+        self.assertEqual((['5000'], 1), self.get_ids({'status': 'running'}))
+
+    def test_queued(self):
+        plays.write_metadata({'id': '6000', 'startTime': 6000,
+                              'playbook': 'site.yml', 'queued': True})
+        self.useFixture(fixtures.MockPatchObject(
+            plays.scheduler, 'get_queue_positions',
+            return_value={'6000': 1}))
+
+        self.assertEqual((['6000'], 1), self.get_ids({'status': 'queued'}))
+        self.assertEqual((['5000'], 1), self.get_ids({'status': 'running'}))
+
+        resp = self.client.get('/api/v2/plays/6000')
+        self.assertEqual(1, jsonutils.loads(resp.data)['queuePosition'])
+
+    def test_cancel_queued(self):
+        cancel = self.useFixture(fixtures.MockPatchObject(
+            plays.scheduler, 'cancel', return_value=True)).mock
+
+        resp = self.client.delete('/api/v2/plays/6000')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('Success', jsonutils.loads(resp.data))
+        self.assertTrue(resp.headers['Location'].endswith(
+            '/api/v2/plays/6000'))
+        cancel.assert_called_once_with('6000')
+
+
+class TestGetLog(testtools.TestCase):
+
+    def setUp(self):
+        super(TestGetLog, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.client = app.test_client()
+        self.log = b''.join(b'line %d\n' % i for i in range(1, 6))
+        with open(os.path.join(self.log_dir, '1.log'), 'wb') as f:
+            f.write(self.log)
+
+    def get_log(self, query_string=None, headers=None):
+        return self.client.get('/api/v2/plays/1/log',
+                               query_string=query_string, headers=headers)
+
+    def test_whole_log(self):
+        resp = self.get_log()
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(self.log, resp.data)
+
+    def test_range(self):
+        resp = self.get_log(headers={'Range': 'bytes=7-13'})
+        self.assertEqual(206, resp.status_code)
+        self.assertEqual(b'line 2\n', resp.data)
+
+    def test_tail(self):
+        # Use a small block size to exercise reading multiple blocks
+        self.useFixture(fixtures.MockPatchObject(plays, 'LOG_BLOCK_SIZE', 4))
+
+        resp = self.get_log({'tail': 2})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(b'line 4\nline 5\n', resp.data)
+        self.assertEqual(str(len(self.log)), resp.headers['X-Log-Offset'])
+
+        self.assertEqual(self.log, self.get_log({'tail': 10}).data)
+        self.assertEqual(b'', self.get_log({'tail': 0}).data)
+
+    def test_since(self):
+        resp = self.get_log({'since': 28})
+        self.assertEqual(b'line 5\n', resp.data)
+        self.assertEqual('35', resp.headers['X-Log-Offset'])
+
+        resp = self.get_log({'since': 35})
+        self.assertEqual(b'', resp.data)
+        self.assertEqual('35', resp.headers['X-Log-Offset'])
+
+        # tail does not return anything before since
+        self.assertEqual(b'line 5\n',
+                         self.get_log({'since': 28, 'tail': 3}).data)
+
+    def test_missing_log(self):
+        resp = self.client.get('/api/v2/plays/2/log',
+                               query_string={'tail': 1})
+        self.assertEqual(404, resp.status_code)
+
+
+class TestGetProgress(testtools.TestCase):
+
+    def setUp(self):
+        super(TestGetProgress, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.client = app.test_client()
+        self.events = [{'event': 'task', 'name': 'one'},
+                       {'event': 'result', 'host': 'a', 'status': 'ok'},
+                       {'event': 'result', 'host': 'b', 'status': 'failed'}]
+        with open(os.path.join(self.log_dir, '1.progress'), 'wb') as f:
+            for e in self.events:
+                f.write(json.dumps(e).encode('utf-8') + b'\n')
+            # A batch that is still being written
+            f.write(b'{"event": "res')
+
+    def get_progress(self, query_string=None):
+        resp = self.client.get('/api/v2/plays/1/progress',
+                               query_string=query_string)
+        self.assertEqual(200, resp.status_code)
+        return jsonutils.loads(resp.data)
+
+    def test_progress(self):
+        self.assertEqual(self.events, self.get_progress())
+        self.assertEqual(self.events[2:], self.get_progress({'offset': 2}))
+        self.assertEqual(self.events[1:2], self.get_progress({'host': 'a'}))
+
+    def test_missing_progress(self):
+        resp = self.client.get('/api/v2/plays/2/progress')
+        self.assertEqual(404, resp.status_code)
+
+
+class TestEvents(testtools.TestCase):
+
+    def setUp(self):
+        super(TestEvents, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.client = app.test_client()
+        self.events = [
+            {'event': 'playbook-start', 'playbook': 'site.yml'},
+            {'event': 'playbook-start', 'playbook': 'osconfig-run.yml'},
+            {'event': 'playbook-stop', 'playbook': 'osconfig-run.yml'}]
+
+    def get_events(self):
+        resp = self.client.get('/api/v2/plays/1/events')
+        self.assertEqual(200, resp.status_code)
+        return jsonutils.loads(resp.data)
+
+    def test_append(self):
+        for e in self.events:
+            plays.append_event('1', e)
+
+        with open(os.path.join(self.log_dir, '1.events')) as f:
+            self.assertEqual(3, len(f.readlines()))
+        self.assertEqual(self.events, self.get_events())
+        self.assertEqual([('site.yml', 'playbook-start'),
+                          ('osconfig-run.yml', 'playbook-stop')],
+                         list(plays.get_last_events('1').items()))
+
+    def test_legacy_array(self):
+        with open(os.path.join(self.log_dir, '1.events'), 'w') as f:
+            json.dump(self.events, f)
+
+        self.assertEqual(self.events, self.get_events())
+        self.assertEqual(['site.yml', 'osconfig-run.yml'],
+                         list(plays.get_last_events('1')))
+
+    def test_running_play_index(self):
+        running = {'1': {}}
+        self.useFixture(fixtures.MockPatchObject(plays, 'plays', running))
+
+        plays.append_event('1', self.events[0])
+        self.assertEqual({'site.yml': 'playbook-start'},
+                         running['1']['last_events'])
+
+        # The index is used rather than the file
+        os.unlink(os.path.join(self.log_dir, '1.events'))
+        self.assertEqual({'site.yml': 'playbook-start'},
+                         plays.get_last_events('1'))
+
+    def test_missing_events(self):
+        resp = self.client.get('/api/v2/plays/2/events')
+        self.assertEqual(404, resp.status_code)
+        self.assertEqual({}, plays.get_last_events('2'))
+
+
+class TestKillPlay(testtools.TestCase):
+
+    def setUp(self):
+        super(TestKillPlay, self).setUp()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.conf.config(group='plays', kill_grace_seconds=0)
+        self.client = app.test_client()
+        self.socketio = self.useFixture(fixtures.MockPatchObject(
+            plays, 'socketio')).mock
+        self.signal_play = self.useFixture(fixtures.MockPatchObject(
+            plays, 'signal_play')).mock
+        self.useFixture(fixtures.MockPatchObject(plays, 'KILL_INTERVAL', 0))
+        plays.write_metadata({'id': '1', 'startTime': 1, 'pid': 1234})
+
+    def test_kill(self):
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'is_group_running', return_value=True))
+
+        resp = self.client.delete('/api/v2/plays/1')
+        self.assertEqual(202, resp.status_code)
+        self.signal_play.assert_called_once_with(1234, signal.SIGINT)
+        self.assertTrue(plays.read_metadata('1')['killed'])
+        self.socketio.start_background_task.assert_called_once_with(
+            plays.finish_killing, '1', 1234)
+
+    def test_finish_killing(self):
+        # The play ignores interrupts, but ends when killed
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'is_group_running',
+            side_effect=lambda pid: signal.SIGKILL not in
+            [c[0][1] for c in self.signal_play.call_args_list]))
+
+        plays.finish_killing('1', 1234)
+
+        self.assertEqual(signal.SIGKILL, self.signal_play.call_args[0][1])
+        self.assertIn('endTime', plays.read_metadata('1'))
+        self.socketio.emit.assert_called_once_with('killed', room='1')
+
+    def test_finish_killing_interrupted(self):
+        # Plays being followed are completed by their monitor
+        self.useFixture(fixtures.MockPatchObject(plays, 'plays', {'1': {}}))
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'is_group_running', return_value=False))
+
+        plays.finish_killing('1', 1234)
+
+        self.assertFalse(self.signal_play.called)
+        self.assertNotIn('endTime', plays.read_metadata('1'))
+        self.assertFalse(self.socketio.emit.called)
+
+    def test_finished_play(self):
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'is_group_running', return_value=False))
+        resp = self.client.delete('/api/v2/plays/1')
+        self.assertEqual(410, resp.status_code)
@@ -0,0 +1,104 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+import testtools
+
+from ardana_service import config  # noqa: F401
+from ardana_service import scheduler
+
+
+class TestScheduler(testtools.TestCase):
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.useFixture(fixtures.MockPatchObject(scheduler, '_queue', []))
+        self.useFixture(fixtures.MockPatchObject(scheduler, '_running', {}))
+        self.started = []
+
+    def submit(self, id, playbook, **kwargs):
+        return scheduler.submit(id, playbook,
+                                lambda: self.started.append(id), **kwargs)
+
+    def test_unlimited(self):
+        self.assertTrue(self.submit('1', 'status.yml'))
+        self.assertTrue(self.submit('2', 'status.yml'))
+        self.assertEqual(['1', '2'], self.started)
+
+    def test_playbook_limit(self):
+        self.assertTrue(self.submit('1', 'site.yml'))
+        queued = []
+        self.assertFalse(self.submit('2', 'site.yml',
+                                     on_queued=lambda: queued.append('2')))
+        self.assertEqual(['2'], queued)
+        self.assertEqual({'2': 1}, scheduler.get_queue_positions())
+
+        scheduler.finished('1')
+        self.assertEqual(['1', '2'], self.started)
+        self.assertEqual({}, scheduler.get_queue_positions())
+
+    def test_groups(self):
+        self.assertTrue(self.submit('1', 'site.yml'))
+        self.assertFalse(self.submit('2', 'wipe_disks.yml'))
+        self.assertFalse(self.submit('3', 'ready-deployment.yml'))
+
+        # Plays of other groups are not held up by the queued ones
+        self.assertTrue(self.submit('4', 'config-processor-run.yml'))
+        self.assertEqual({'2': 1, '3': 2}, scheduler.get_queue_positions())
+
+        # Only one of the group is started at a time, in order
+        scheduler.finished('1')
+        self.assertEqual(['1', '4', '2'], self.started)
+        scheduler.finished('2')
+        self.assertEqual(['1', '4', '2', '3'], self.started)
+
+    def test_max_running(self):
+        self.conf.config(group='plays', max_running_plays=2)
+        self.assertTrue(self.submit('1', 'a.yml'))
+        self.assertTrue(self.submit('2', 'b.yml'))
+        self.assertFalse(self.submit('3', 'c.yml'))
+        self.assertFalse(self.submit('4', 'd.yml'))
+
+        scheduler.finished('2')
+        self.assertEqual(['1', '2', '3'], self.started)
+        self.assertEqual({'4': 1}, scheduler.get_queue_positions())
+
+    def test_cancel(self):
+        cancelled = []
+        self.submit('1', 'site.yml')
+        self.submit('2', 'site.yml', on_cancel=lambda: cancelled.append('2'))
+
+        self.assertTrue(scheduler.cancel('2'))
+        self.assertEqual(['2'], cancelled)
+        self.assertFalse(scheduler.cancel('2'))
+
+        scheduler.finished('1')
+        self.assertEqual(['1'], self.started)
+
+    def test_start_failure(self):
+        def fail():
+            raise RuntimeError()
+
+        self.assertRaises(RuntimeError, scheduler.submit, '1', 'site.yml',
+                          fail)
+
+        # The failed play does not hold up others
+        self.assertTrue(self.submit('2', 'site.yml'))
+        self.submit('3', 'site.yml')
+        scheduler._queue[0].start = fail
+        scheduler.finished('2')
+        self.assertEqual({}, scheduler._running)
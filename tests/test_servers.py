@@ -0,0 +1,210 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from flask import Flask
+import os
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+from oslo_serialization import jsonutils
+from promise import Promise
+import testtools
+import yaml
+
+from ardana_service import plays
+from ardana_service import servers
+from ardana_service import workflows
+
+app = Flask(__name__)
+app.register_blueprint(plays.bp)
+app.register_blueprint(servers.bp)
+app.register_blueprint(workflows.bp)
+
+SERVER_INFO = {
+    'compute1': {'hostname': 'cp-comp0001'},
+    'compute4': {'hostname': 'cp-comp0004'},
+    'compute5': {'hostname': 'cp-comp0005'},
+}
+
+
+class TestServers(testtools.TestCase):
+
+    def setUp(self):
+        super(TestServers, self).setUp()
+        self.client = app.test_client()
+
+        cp_dir = self.useFixture(fixtures.TempDir()).path
+        with open(os.path.join(cp_dir, 'server_info.yml'), 'w') as f:
+            yaml.safe_dump(SERVER_INFO, f)
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', cp_ready_output_dir=cp_dir,
+                         log_dir=self.useFixture(fixtures.TempDir()).path)
+
+        self.model = {'inputModel': {'servers': [{'id': 'compute1'},
+                                                 {'id': 'compute2'},
+                                                 {'id': 'compute3'}]}}
+        self.useFixture(fixtures.MockPatchObject(
+            servers.model_api, 'read_model', return_value=self.model))
+        self.write_model = self.useFixture(fixtures.MockPatchObject(
+            servers.model_api, 'write_model')).mock
+        self.commit_model = self.useFixture(fixtures.MockPatchObject(
+            servers.versions, 'commit_model')).mock
+
+        # Playbooks complete immediately
+        self.run_playbook = self.useFixture(fixtures.MockPatchObject(
+            servers.playbooks, 'run_playbook',
+            side_effect=lambda *args, **kwargs: {
+                'id': 1, 'url': 'http://localhost/api/v2/plays/1',
+                'promise': Promise.resolve('Success')})).mock
+
+    def get_server_ids(self):
+        written = self.write_model.call_args[0][0]
+        return [s['id'] for s in written['inputModel']['servers']]
+
+    def get_playbooks(self):
+        return [(c[0][0], c[0][1] if len(c[0]) > 1 else None)
+                for c in self.run_playbook.call_args_list]
+
+    def test_add_server(self):
+        resp = self.client.post('/api/v2/servers/process', json={
+            'server': {'id': 'compute4'},
+            'process': {}})
+        self.assertEqual(202, resp.status_code)
+        id = jsonutils.loads(resp.data)['id']
+        self.assertTrue(resp.headers['Location'].endswith(
+            '/api/v2/plays/%s' % id))
+        self.assertEqual(['compute1', 'compute2', 'compute3', 'compute4'],
+                         self.get_server_ids())
+
+        site = [p for (name, p) in self.get_playbooks() if name == 'site']
+        self.assertEqual('cp-comp0004', site[0]['limit'])
+
+    def test_add_servers(self):
+        resp = self.client.post('/api/v2/servers/process', json={
+            'servers': [{'id': 'compute4'}, {'id': 'compute5'}],
+            'process': {}})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(
+            ['compute1', 'compute2', 'compute3', 'compute4', 'compute5'],
+            self.get_server_ids())
+        self.assertEqual(1, self.write_model.call_count)
+        self.commit_model.assert_called_once_with(
+            message='Add servers compute4, compute5')
+
+        # Each playbook runs once for all of the servers
+        names = [name for (name, payload) in self.get_playbooks()]
+        self.assertEqual(['config-processor-run', 'ready-deployment', 'site',
+                          'site', 'monasca-deploy'], names)
+        site = self.get_playbooks()[2][1]
+        self.assertEqual('cp-comp0004,cp-comp0005', site['limit'])
+
+    def test_add_servers_unknown_hostname(self):
+        # Without the hostnames of all of the servers, site is not limited
+        self.client.post('/api/v2/servers/process', json={
+            'servers': [{'id': 'compute4'}, {'id': 'compute6'}],
+            'process': {}})
+        site = self.get_playbooks()[2][1]
+        self.assertNotIn('limit', site)
+
+    def test_add_servers_invalid(self):
+        for body in ({'servers': [], 'process': {}},
+                     {'servers': [{'name': 'x'}], 'process': {}},
+                     {'servers': [{'id': 'compute4'}, {'id': 'compute4'}],
+                      'process': {}},
+                     {'servers': [{'id': 'compute4'}, {'id': 'compute1'}],
+                      'process': {}}):
+            resp = self.client.post('/api/v2/servers/process', json=body)
+            self.assertEqual(400, resp.status_code)
+        self.write_model.assert_not_called()
+        self.run_playbook.assert_not_called()
+
+    def test_remove_server(self):
+        resp = self.client.delete('/api/v2/servers/compute2/process',
+                                  json={})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(['compute1', 'compute3'], self.get_server_ids())
+        self.commit_model.assert_called_once_with(
+            message='Remove server compute2')
+
+    def test_remove_servers(self):
+        resp = self.client.delete('/api/v2/servers/process', json={
+            'ids': ['compute1', 'compute3'],
+            'process': {'commitMessage': 'Shrink'}})
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(['compute2'], self.get_server_ids())
+        self.assertEqual(1, self.write_model.call_count)
+        self.commit_model.assert_called_once_with(message='Shrink')
+
+        names = [name for (name, payload) in self.get_playbooks()]
+        self.assertEqual(['config-processor-run', 'ready-deployment'], names)
+        payload = self.get_playbooks()[0][1]
+        self.assertEqual('y', payload['extra-vars']['remove_deleted_servers'])
+
+    def test_encryption_key_not_saved(self):
+        resp = self.client.post('/api/v2/servers/process', json={
+            'server': {'id': 'compute4'},
+            'process': {'encryption-key': 'secret'}})
+        id = jsonutils.loads(resp.data)['id']
+
+        payload = self.get_playbooks()[0][1]
+        self.assertEqual('secret', payload['extra-vars']['encrypt'])
+        with open(workflows.get_workflow_file(id)) as f:
+            self.assertNotIn('secret', f.read())
+
+    def test_resume(self):
+        # site fails on the first attempt
+        site_promise = Promise()
+
+        def run_playbook(name, payload=None, play_id=None):
+            promise = Promise.resolve('Success')
+            if name == 'site' and 'tags' not in payload:
+                promise = site_promise
+            return {'id': play_id, 'promise': promise}
+
+        self.run_playbook.side_effect = run_playbook
+        resp = self.client.post('/api/v2/servers/process', json={
+            'servers': [{'id': 'compute4'}, {'id': 'compute5'}],
+            'process': {}})
+        id = jsonutils.loads(resp.data)['id']
+        site_promise.do_reject(Exception('Play failed'))
+
+        workflow = jsonutils.loads(
+            self.client.get('/api/v2/workflows/%s' % id).data)
+        self.assertEqual('failed', workflow['status'])
+        self.assertEqual('failed', workflow['steps'][5]['status'])
+        self.assertEqual('cp-comp0004,cp-comp0005',
+                         workflow['params']['limit'])
+
+        # The steps before site are not repeated
+        self.run_playbook.reset_mock()
+        self.write_model.reset_mock()
+        site_promise = Promise.resolve('Success')
+        resp = self.client.post('/api/v2/workflows/%s/resume' % id)
+        self.assertEqual(202, resp.status_code)
+        self.write_model.assert_not_called()
+        self.assertEqual(['site', 'site', 'monasca-deploy'],
+                         [name for (name, p) in self.get_playbooks()])
+        self.assertEqual('cp-comp0004,cp-comp0005',
+                         self.get_playbooks()[0][1]['limit'])
+
+        workflow = jsonutils.loads(
+            self.client.get('/api/v2/workflows/%s' % id).data)
+        self.assertEqual('succeeded', workflow['status'])
+
+    def test_remove_servers_invalid(self):
+        for ids in ([], ['compute1', 'compute1'], ['compute1', 'compute9']):
+            resp = self.client.delete('/api/v2/servers/process',
+                                      json={'ids': ids})
+            self.assertIn(resp.status_code, (400, 404))
+        self.write_model.assert_not_called()
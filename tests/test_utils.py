@@ -31,3 +31,32 @@ class TestUtils(testtools.TestCase):
         self.assertEquals('[ff::1]', util.url_address('ff::1'))
         self.assertEquals('127.0.0.1', util.url_address('127.0.0.1'))
         self.assertEquals('somehost', util.url_address('somehost'))
+
+    def test_apply_patch(self):
+        doc = {'id': 'a', 'nics': [1, 2], 'x~y': {'a/b': 1}}
+        patched = util.apply_patch(doc, [
+            {'op': 'replace', 'path': '/id', 'value': 'b'},
+            {'op': 'add', 'path': '/nics/-', 'value': 3},
+            {'op': 'remove', 'path': '/x~0y/a~1b'},
+            {'op': 'move', 'from': '/nics/0', 'path': '/first'},
+            {'op': 'test', 'path': '/id', 'value': 'b'}])
+        self.assertEqual(
+            {'id': 'b', 'nics': [2, 3], 'x~y': {}, 'first': 1}, patched)
+
+    def test_project(self):
+        doc = {'a': {'b': [{'c': 1}, {'c': 2}], 'd': 3}, 'e': 4}
+        self.assertEqual({'a': {'d': 3}}, util.project(doc, ['a.d']))
+        self.assertEqual({'a': {'b': {'1': {'c': 2}}}, 'e': 4},
+                         util.project(doc, ['a.b.1.c', 'e', 'a.b.1']))
+        self.assertRaises(ValueError, util.project, doc, ['a.x'])
+        self.assertRaises(ValueError, util.project, doc, ['a.b.x'])
+        self.assertRaises(ValueError, util.project, doc, ['e.f'])
+
+    def test_apply_patch_errors(self):
+        doc = {'id': 'a', 'nics': [1, 2]}
+        for op in ({'op': 'remove', 'path': '/missing'},
+                   {'op': 'add', 'path': '/nics/5', 'value': 1},
+                   {'op': 'test', 'path': '/id', 'value': 'b'},
+                   {'op': 'bogus', 'path': '/id'},
+                   {'op': 'replace', 'path': '/id'}):
+            self.assertRaises(ValueError, util.apply_patch, doc, [op])
@@ -0,0 +1,215 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fixtures
+from flask import Flask
+from oslo_config import cfg
+from oslo_config import fixture as oslo_fixture
+from oslo_serialization import jsonutils
+from promise import Promise
+import testtools
+import time
+
+from ardana_service import plays
+from ardana_service import workflows
+
+app = Flask(__name__)
+app.register_blueprint(workflows.bp)
+
+
+class TestWorkflows(testtools.TestCase):
+
+    def setUp(self):
+        super(TestWorkflows, self).setUp()
+        self.client = app.test_client()
+        self.log_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf = self.useFixture(oslo_fixture.Config(cfg.CONF))
+        self.conf.config(group='paths', log_dir=self.log_dir)
+        self.useFixture(fixtures.MockPatchObject(workflows, '_active', {}))
+        self.useFixture(fixtures.MockPatchObject(workflows, '_types', {}))
+        self.useFixture(fixtures.MockPatchObject(plays, 'plays', {}))
+
+        # A workflow with a step that runs a play between two that do not
+        self.calls = []
+        self.promise = Promise()
+        self.fail_last = False
+
+        def first(id, params, secrets):
+            self.calls.append('first')
+            if params.get('fail'):
+                raise Exception('first failed')
+            params['value'] = secrets.get('key')
+
+        def play(id, params, secrets):
+            self.calls.append('play')
+            return {'id': id, 'promise': self.promise}
+
+        def last(id, params, secrets):
+            self.calls.append('last')
+            if self.fail_last:
+                raise Exception('last failed')
+
+        workflows.register('test', [('first', first),
+                                    ('play', play),
+                                    ('last', last)])
+
+    def start(self, **kwargs):
+        with app.test_request_context():
+            return workflows.start('test', {}, **kwargs)
+
+    def get(self, id):
+        resp = self.client.get('/api/v2/workflows/%s' % id)
+        self.assertEqual(200, resp.status_code)
+        return jsonutils.loads(resp.data)
+
+    def test_run(self):
+        workflow = self.start(secrets={'key': 'secret'})
+        self.assertEqual(['first', 'play'], self.calls)
+
+        saved = self.get(workflow['id'])
+        self.assertEqual('running', saved['status'])
+        self.assertEqual(['succeeded', 'running', 'pending'],
+                         [s['status'] for s in saved['steps']])
+        self.assertEqual(workflow['id'], saved['steps'][1]['playId'])
+        self.assertEqual('secret', saved['params']['value'])
+
+        self.promise.do_resolve('Success')
+        self.assertEqual(['first', 'play', 'last'], self.calls)
+        saved = self.get(workflow['id'])
+        self.assertEqual('succeeded', saved['status'])
+        self.assertIn('endTime', saved)
+
+        resp = self.client.get('/api/v2/workflows')
+        self.assertEqual([workflow['id']],
+                         [w['id'] for w in jsonutils.loads(resp.data)])
+
+    def test_resume_failed_play(self):
+        workflow = self.start()
+        self.promise.do_reject(Exception('Play failed'))
+        saved = self.get(workflow['id'])
+        self.assertEqual('failed', saved['status'])
+        self.assertEqual('Play failed', saved['steps'][1]['error'])
+
+        self.promise = Promise.resolve('Success')
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(['first', 'play', 'play', 'last'], self.calls)
+        self.assertEqual('succeeded', self.get(workflow['id'])['status'])
+
+        # A workflow that succeeded cannot be resumed
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(400, resp.status_code)
+
+    def test_failed_step_propagates(self):
+        # Steps that fail before a play starts fail the request
+        with app.test_request_context():
+            self.assertRaises(Exception, workflows.start, 'test',
+                              {'fail': True}, id='42')
+
+        saved = self.get('42')
+        self.assertEqual('failed', saved['status'])
+        self.assertEqual(['failed', 'pending', 'pending'],
+                         [s['status'] for s in saved['steps']])
+        self.assertEqual('first failed', saved['steps'][0]['error'])
+
+    def test_failed_step_after_play(self):
+        self.fail_last = True
+        workflow = self.start()
+        self.promise.do_resolve('Success')
+
+        saved = self.get(workflow['id'])
+        self.assertEqual('failed', saved['status'])
+        self.assertEqual('last failed', saved['steps'][2]['error'])
+
+    def test_resume_failed_step_after_play(self):
+        self.fail_last = True
+        workflow = self.start()
+        self.promise.do_resolve('Success')
+
+        # The step fails again when resumed, before any play is started
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(409, resp.status_code)
+        self.assertIn(b'last failed', resp.data)
+        self.assertEqual(['first', 'play', 'last', 'last'], self.calls)
+
+        saved = self.get(workflow['id'])
+        self.assertEqual('failed', saved['status'])
+        self.assertEqual('last failed', saved['steps'][2]['error'])
+
+        # And can be resumed once it is able to succeed
+        self.fail_last = False
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual('succeeded', self.get(workflow['id'])['status'])
+
+    def test_running(self):
+        workflow = self.start()
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(403, resp.status_code)
+
+    def test_interrupted(self):
+        workflow = self.start()
+
+        # The service restarted while the play was running
+        workflows._active.clear()
+        self.assertEqual('interrupted', self.get(workflow['id'])['status'])
+
+        # The play is still running
+        plays.plays[workflow['id']] = {}
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(403, resp.status_code)
+
+        # The play then succeeds, so it is not run again
+        plays.plays.clear()
+        step = self.get(workflow['id'])['steps'][1]
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'read_metadata', return_value={
+                'id': workflow['id'],
+                'startTime': step['startTime'],
+                'endTime': int(1000 * time.time()),
+                'code': 0}))
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(['first', 'play', 'last'], self.calls)
+        self.assertEqual('succeeded', self.get(workflow['id'])['status'])
+
+    def test_interrupted_play_failed(self):
+        workflow = self.start()
+        workflows._active.clear()
+        step = self.get(workflow['id'])['steps'][1]
+        self.useFixture(fixtures.MockPatchObject(
+            plays, 'read_metadata', return_value={
+                'id': workflow['id'],
+                'startTime': step['startTime'],
+                'endTime': int(1000 * time.time()),
+                'code': 2}))
+
+        self.promise = Promise.resolve('Success')
+        resp = self.client.post('/api/v2/workflows/%s/resume' %
+                                workflow['id'])
+        self.assertEqual(202, resp.status_code)
+        self.assertEqual(['first', 'play', 'play', 'last'], self.calls)
+
+    def test_not_found(self):
+        resp = self.client.get('/api/v2/workflows/missing')
+        self.assertEqual(404, resp.status_code)
+        resp = self.client.post('/api/v2/workflows/missing/resume')
+        self.assertEqual(404, resp.status_code)
@@ -0,0 +1,36 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import testtools
+
+from ardana_service import yaml_io
+
+
+class TestYamlIO(testtools.TestCase):
+
+    def test_round_trip(self):
+        data = {'servers': [{'id': 'controller1', 'ip-addr': '10.0.0.1'}],
+                'product': {'version': 2}}
+        text = yaml_io.safe_dump(data, default_flow_style=False)
+        self.assertEqual(data, yaml_io.safe_load(text))
+
+    def test_safe_load_rejects_python_tags(self):
+        text = "!!python/object/apply:collections.OrderedDict [[[a, 1]]]"
+        self.assertRaises(yaml_io.YAMLError, yaml_io.safe_load, text)
+
+    def test_trusted_load_accepts_python_tags(self):
+        text = "!!python/object/apply:collections.OrderedDict [[[a, 1]]]"
+        self.assertEqual(collections.OrderedDict([('a', 1)]),
+                         yaml_io.load(text))
@@ -0,0 +1,148 @@
+# (c) Copyright 2018 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compare the pure python yaml loader and dumper against the libyaml-based
+# ones used by ardana_service.yaml_io.  By default it reads every yml file in
+# the test data models and a synthesized CloudModel.yaml that approximates the
+# size of the one produced by the config processor for a large cloud.  Other
+# files, such as a real CloudModel.yaml, may be given on the command line.
+#
+#   python tools/benchmark_yaml.py [--servers N] [--repeat N] [file ...]
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import timeit
+import yaml
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DATA_DIR = os.path.join(TOP_DIR, 'tests', 'test_data')
+
+
+def synthesize_cloud_model(num_servers):
+    # Produce a document resembling the config processor's CloudModel, which
+    # has an entry per server with its networks, disks and service components
+    servers = []
+    for i in range(num_servers):
+        name = 'ardana-cp1-comp%04d' % i
+        servers.append({
+            'id': 'comp%04d' % i,
+            'hostname': name + '-mgmt',
+            'ardana_ansible_host': name,
+            'role': 'COMPUTE-ROLE',
+            'server-group': 'RACK%d' % (i % 3 + 1),
+            'interfaces': [{
+                'name': 'BOND0',
+                'device': {'name': 'bond0'},
+                'bond-data': {'provider': 'linux',
+                              'devices': [{'name': 'hed3'},
+                                          {'name': 'hed4'}]},
+                'networks': [{'name': 'MANAGEMENT-NET',
+                              'addr': '192.168.%d.%d' % (i // 250,
+                                                         i % 250 + 2),
+                              'cidr': '192.168.0.0/16',
+                              'tagged-vlan': False}],
+            }],
+            'disk-model': {
+                'volume-groups': [{
+                    'name': 'ardana-vg',
+                    'physical-volumes': ['/dev/sda_root'],
+                    'logical-volumes': [
+                        {'name': lv, 'size': '10%', 'fstype': 'ext4',
+                         'mount': '/' + lv} for lv in ('root', 'log', 'crash',
+                                                       'var', 'tmp')],
+                }],
+            },
+            'components': dict(
+                ('component-%d' % c, {'port': 5000 + c, 'enabled': True})
+                for c in range(20)),
+        })
+    return {'internal': {'servers': servers}}
+
+
+def benchmark(label, texts, repeat):
+    # Time loading and dumping of the given list of yaml documents using the
+    # pure python and the libyaml implementations
+    docs = [yaml.load(text, Loader=yaml.SafeLoader) for text in texts]
+
+    results = []
+    impls = [('python', yaml.SafeLoader, yaml.SafeDumper)]
+    if yaml.__with_libyaml__:
+        impls.append(('libyaml', yaml.CSafeLoader, yaml.CSafeDumper))
+
+    for name, loader, dumper in impls:
+        load = min(timeit.repeat(
+            lambda: [yaml.load(text, Loader=loader) for text in texts],
+            number=1, repeat=repeat))
+        dump = min(timeit.repeat(
+            lambda: [yaml.dump(doc, Dumper=dumper, default_flow_style=False)
+                     for doc in docs],
+            number=1, repeat=repeat))
+        results.append((name, load, dump))
+
+    size = sum(len(text) for text in texts)
+    print('%s (%d KB)' % (label, size // 1024))
+    for name, load, dump in results:
+        print('  %-8s load %8.4fs  dump %8.4fs' % (name, load, dump))
+    if len(results) > 1:
+        print('  speedup  load %7.1fx  dump %7.1fx' % (
+            results[0][1] / results[1][1], results[0][2] / results[1][2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare pure python and libyaml yaml performance')
+    parser.add_argument('--servers', type=int, default=200,
+                        help='Number of servers in the synthesized '
+                             'CloudModel.yaml')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to repeat each measurement')
+    parser.add_argument('files', nargs='*',
+                        help='Additional yaml files to benchmark')
+    args = parser.parse_args()
+
+    if not yaml.__with_libyaml__:
+        print('PyYAML was built without libyaml; only the pure python '
+              'implementation is available', file=sys.stderr)
+
+    # The test data models, each measured as a whole
+    for model in sorted(os.listdir(TEST_DATA_DIR)):
+        model_dir = os.path.join(TEST_DATA_DIR, model)
+        texts = []
+        for root, dirs, files in os.walk(model_dir):
+            for name in sorted(files):
+                if name.endswith('.yml'):
+                    with open(os.path.join(root, name)) as f:
+                        texts.append(f.read())
+        if texts:
+            try:
+                benchmark('model ' + model, texts, args.repeat)
+            except yaml.YAMLError:
+                # Some test data is deliberately invalid
+                pass
+
+    for filename in args.files:
+        with open(filename) as f:
+            benchmark(filename, [f.read()], args.repeat)
+
+    cloud_model = synthesize_cloud_model(args.servers)
+    text = yaml.dump(cloud_model, Dumper=yaml.SafeDumper,
+                     default_flow_style=False)
+    benchmark('synthesized CloudModel.yaml (%d servers)' % args.servers,
+              [text], args.repeat)
+
+
+if __name__ == '__main__':
+    main()